@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+以 asyncio 實作的爬取引擎，作為 PttWebCrawler 的替代後端
+
+單一行程可同時維持大量請求，並透過連線池重複使用 keep-alive 連線；
+HTML 解析沿用 PttWebCrawler 的靜態方法，輸出格式與同步版本一致。
+"""
+
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from PttWebCrawler.crawler import PttWebCrawler, VERIFY
+from PttWebCrawler.ratelimit import rate_limiter
+from PttWebCrawler.session import session_manager
+
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+}
+
+
+class AsyncCrawlEngine(object):
+    """
+    非同步爬取引擎
+
+    Args:
+        per_host_limit: 對同一主機同時進行的最大請求數
+        total_limit: 所有主機合計的最大同時請求數
+        timeout: 單一請求的超時秒數
+    """
+
+    def __init__(self, per_host_limit=8, total_limit=100, timeout=10):
+        if aiohttp is None:
+            raise ImportError("非同步引擎需要 aiohttp，請先執行 pip install aiohttp")
+        self.per_host_limit = per_host_limit
+        self.total_limit = total_limit
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.total_limit,
+                limit_per_host=self.per_host_limit,
+                ssl=None if VERIFY else False
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=HEADERS,
+                cookies={'over18': '1'},
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def fetch(self, url):
+        """取得頁面內容，回傳 (狀態碼, HTML)；與同步路徑共用 session_manager 的磁碟快取"""
+        await self.open()
+        cache = session_manager.cache
+        entry = None
+        headers = None
+        if cache is not None:
+            entry = cache.get(url)
+            if entry is not None and cache.is_fresh(entry):
+                cache.hits += 1
+                return 200, entry.body.decode('utf-8', 'replace')
+            if entry is not None:
+                headers = entry.conditional_headers()
+
+        delay = rate_limiter.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            async with self.session.get(url, headers=headers, allow_redirects=True) as resp:
+                status = resp.status
+                text = await resp.text(encoding='utf-8', errors='replace')
+                resp_headers = resp.headers
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+            rate_limiter.record(url, error=e)
+            raise
+        rate_limiter.record(url, status)
+
+        if entry is not None and status == 304:
+            cache.revalidated += 1
+            cache.refresh(entry)
+            return 200, entry.body.decode('utf-8', 'replace')
+        if cache is not None and status == 200:
+            cache.misses += 1
+            cache.store(url, text.encode('utf-8'), resp_headers)
+        return status, text
+
+    async def _parse_in_executor(self, func, *args):
+        # HTML 解析屬於 CPU 工作，交給預設執行緒池以免阻塞事件迴圈
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def get_last_page(self, board):
+        # 與同步路徑共用各看板最後頁碼的快取
+        last_page = PttWebCrawler.cached_last_page(board)
+        if last_page is not None:
+            return last_page
+        try:
+            status, text = await self.fetch(f'{PttWebCrawler.PTT_URL}/bbs/{board}/index.html')
+            if status != 200:
+                print(f"獲取最後頁面時失敗，狀態碼: {status}")
+                return 1
+            return PttWebCrawler.remember_last_page(board, PttWebCrawler.last_page_from_html(board, text))
+        except Exception as e:
+            print(f"獲取最後頁面時出錯: {e}")
+            return 1
+
+    async def parse(self, link, article_id, board):
+        print('Processing article:', article_id)
+        status, text = await self.fetch(link)
+        if status != 200:
+            print('invalid url:', link)
+            return {"error": "invalid url", "status_code": status}
+        return await self._parse_in_executor(PttWebCrawler.parse_html, text, link, article_id, board)
+
+    async def parse_article(self, article_id, board):
+        link = PttWebCrawler.PTT_URL + f'/bbs/{board}/{article_id}.html'
+        return await self.parse(link, article_id, board)
+
+    async def _fetch_index_rows(self, board, index, error_log):
+        page_url = f'{PttWebCrawler.PTT_URL}/bbs/{board}/index{index}.html'
+        print(f"爬取頁面: {page_url}")
+        try:
+            status, text = await self.fetch(page_url)
+            if status != 200:
+                error_msg = f"頁面請求失敗，狀態碼: {status}"
+                print(error_msg)
+                error_log.append(error_msg)
+                return []
+            return await self._parse_in_executor(PttWebCrawler.parse_index_rows, text, error_log)
+        except Exception as e:
+            error_msg = f"爬取頁面 {page_url} 時出錯: {e}"
+            print(error_msg)
+            error_log.append(error_msg)
+            return []
+
+    async def _page_range(self, start, end, board):
+        max_page = await self.get_last_page(board)
+        print(f"{board} 板最大頁數: {max_page}")
+        if start <= 0:
+            start = 1
+        if end == -1 or end > max_page:
+            end = max_page
+        return start, end
+
+    async def _gather_index_rows(self, start, end, board, error_log, article_filter=None):
+        """並行抓取所有列表頁，依頁碼順序回傳列表項目；提供 ArticleFilter 時只保留符合條件的項目"""
+        start, end = await self._page_range(start, end, board)
+        pages = await asyncio.gather(*[
+            self._fetch_index_rows(board, i, error_log) for i in range(start, end + 1)
+        ])
+        rows = [row for page in pages for row in page]
+        if article_filter is not None:
+            rows = article_filter.filter_rows(rows)
+        return rows
+
+    async def parse_list_articles(self, start, end, board, article_filter=None):
+        error_log = []
+        articles = await self._gather_index_rows(start, end, board, error_log, article_filter)
+        print(f"總共爬取了 {len(articles)} 篇文章列表資訊")
+        result = {'articles': articles}
+        if error_log:
+            result['errors'] = error_log
+        return result
+
+    async def _parse_or_none(self, row, board):
+        try:
+            return await self.parse(row['url'], row['article_id'], board)
+        except Exception as e:
+            print(f"處理文章時出錯: {e}")
+            return None
+
+    async def parse_articles(self, start, end, board, article_filter=None):
+        rows = await self._gather_index_rows(start, end, board, [], article_filter)
+        rows = [row for row in rows if row['url']]
+        results = await asyncio.gather(*[self._parse_or_none(row, board) for row in rows])
+        articles = [article for article in results if article is not None]
+        print(f"總共爬取了 {len(articles)} 篇文章")
+        return {'articles': articles}
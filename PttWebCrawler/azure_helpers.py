@@ -9,6 +9,7 @@ import logging
 import requests
 import socket
 import time
+from PttWebCrawler.ratelimit import rate_limiter
 
 # 檢測是否在 Azure 環境中運行
 IS_AZURE = 'AZURE_FUNCTIONS_ENVIRONMENT' in os.environ or 'WEBSITE_SITE_NAME' in os.environ
@@ -155,14 +156,16 @@ def get_request_with_retry(session, url, headers, timeout=60, max_retries=3, ver
                 if retry == max_retries - 1:
                     return response
                 
-                # 短暫延遲後再重試
-                time.sleep(5)
+                # 降低速率後再重試
+                rate_limiter.backoff(url)
+                rate_limiter.acquire(url)
                 
         except Exception as e:
             logging.error(f"請求異常: {e}")
             if retry == max_retries - 1:
                 raise
-            time.sleep(5)
+            rate_limiter.backoff(url)
+            rate_limiter.acquire(url)
     
     # 這裡不應該到達，但為了安全起見
     raise Exception("所有重試都失敗")
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+以 URL 為鍵的磁碟 HTTP 回應快取
+
+每筆快取存成兩個檔案：<sha1>.body 為回應內容，<sha1>.json 為 URL、ETag、
+Last-Modified、儲存時間與內容的 SHA-1。依 URL 類型（列表頁、文章、其他）套用不同的 TTL，
+過期後以條件式 GET（If-None-Match / If-Modified-Since）重新驗證；
+總容量超過上限時，依最後存取時間刪除最舊的項目。
+
+檔案先寫入暫存檔再以 os.replace 取代，其他行程不會讀到寫到一半的檔案。
+兩個檔案無法一起取代，因此先寫內容、最後寫 meta，讀取時以 meta 中的 SHA-1
+確認內容屬於同一次寫入，不會讓新的 ETag 搭配舊的內容。
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# 依 URL 類型決定的預設 TTL（秒）
+DEFAULT_TTLS = {
+    'index': 60,              # 看板列表頁，最新一頁會持續變動
+    'article': 7 * 24 * 3600, # 文章頁，大多數舊文章不再變動
+    'default': 300,
+}
+
+INDEX_URL = re.compile(r'/bbs/[^/]+/index\d*\.html$')
+ARTICLE_URL = re.compile(r'/bbs/[^/]+/M\.\d+\.A\.[0-9A-Fa-f]+\.html$')
+
+
+def url_class(url):
+    """回傳 URL 所屬的類型：'index'、'article' 或 'default'"""
+    path = url.split('?', 1)[0]
+    if INDEX_URL.search(path):
+        return 'index'
+    if ARTICLE_URL.search(path):
+        return 'article'
+    return 'default'
+
+
+class CacheEntry(object):
+    """一筆快取資料"""
+
+    def __init__(self, url, body, etag=None, last_modified=None, stored_at=None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    def conditional_headers(self):
+        """重新驗證時要附加的條件式請求標頭"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """
+    磁碟回應快取
+
+    Args:
+        directory: 快取目錄
+        max_bytes: 快取總容量上限，超過時依 LRU 刪除
+        ttls: 覆寫 DEFAULT_TTLS 中各類型的 TTL（秒）
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttls=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {URL 類型: 目前要求重新驗證的呼叫數}，見 revalidating
+        self._revalidate = {}
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.body', base + '.json'
+
+    def _scan(self):
+        """列出所有快取項目：(鍵值路徑前綴, 內容大小, 最後存取時間)"""
+        for name in os.listdir(self.directory):
+            if not name.endswith('.body'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path[:-len('.body')], stat.st_size, stat.st_atime
+
+    def get(self, url):
+        """讀取快取，不存在時回傳 None"""
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        # 內容與 meta 來自不同次寫入（其他執行緒或行程正在更新）時視為沒有快取
+        if meta.get('sha1') != hashlib.sha1(body).hexdigest():
+            return None
+        # 更新存取時間供 LRU 使用
+        now = time.time()
+        try:
+            os.utime(body_path, (now, os.stat(body_path).st_mtime))
+        except OSError:
+            pass
+        return CacheEntry(url, body, meta.get('etag'), meta.get('last_modified'), meta.get('stored_at'))
+
+    def is_fresh(self, entry):
+        kind = url_class(entry.url)
+        if self._revalidate.get(kind):
+            return False
+        return time.time() - entry.stored_at < self.ttls.get(kind, self.ttls['default'])
+
+    @contextmanager
+    def revalidating(self, *kinds):
+        """
+        期間內指定類型（'index'、'article'、'default'）的快取一律視為過期
+
+        過期的項目仍以條件式 GET 重新驗證，內容未變時沿用快取。增量同步與
+        推文更新需要最新的推文，不能使用 TTL 內未經驗證的文章頁。
+        """
+        with self._lock:
+            for kind in kinds:
+                self._revalidate[kind] = self._revalidate.get(kind, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                for kind in kinds:
+                    self._revalidate[kind] -= 1
+    def store(self, url, body, headers=None):
+        """儲存一筆 200 回應"""
+        headers = headers or {}
+        entry = CacheEntry(url, body, headers.get('ETag'), headers.get('Last-Modified'))
+        self._write(entry)
+        return entry
+
+    def refresh(self, entry):
+        """收到 304 時重設儲存時間"""
+        entry.stored_at = time.time()
+        self._write(entry)
+
+    def _write(self, entry):
+        body_path, meta_path = self._paths(entry.url)
+        meta = {
+            'url': entry.url,
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'stored_at': entry.stored_at,
+            'sha1': hashlib.sha1(entry.body).hexdigest(),
+        }
+        with self._lock:
+            try:
+                old_size = os.path.getsize(body_path)
+            except OSError:
+                old_size = 0
+            # meta 最後寫入，見模組說明
+            self._replace(body_path, entry.body)
+            self._replace(meta_path, json.dumps(meta).encode('utf-8'))
+            self._total_bytes += len(entry.body) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    @staticmethod
+    def _replace(path, data):
+        """寫入暫存檔後再取代 path，暫存檔名含行程與執行緒 ID 以免互相覆寫"""
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        # 依最後存取時間由舊到新刪除，直到低於容量上限的九成
+        target = self.max_bytes * 0.9
+        for base, size, _ in sorted(self._scan(), key=lambda item: item[2]):
+            if self._total_bytes <= target:
+                break
+            for path in (base + '.body', base + '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for base, _, _ in list(self._scan()):
+                for path in (base + '.body', base + '.json'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            self._total_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'bytes': self._total_bytes,
+        }
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+長範圍爬取的檢查點紀錄
+
+以 JSON Lines 日誌記錄已完成的文章與列表頁，每完成一項就附加一行並 flush，
+行程中止（網路中斷、記憶體不足被終止）後以 --resume 重新執行時，
+已完成的列表頁不再下載，未完成頁面中已寫出的文章也不再抓取。
+
+日誌的第一行記錄看板、起始頁與模式，之後每行為 {"article": 文章 ID} 或
+{"page": 頁碼}；寫到一半被中止的最後一行會在讀取時略過。
+"""
+
+import os
+import json
+import codecs
+
+
+def checkpoint_path(output):
+    """輸出檔對應的檢查點日誌路徑"""
+    return output + '.checkpoint'
+
+
+def trim_partial_line(path):
+    """移除 JSON Lines 檔案結尾寫到一半的一行，讓接續寫入的資料從新的一行開始"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != size:
+            f.truncate(position)
+
+
+class Checkpoint(object):
+    """
+    已完成的列表頁與文章
+
+    Args:
+        path: 日誌檔路徑
+        board, start, mode: 本次爬取的看板、起始頁與模式（'articles' 或 'list'），
+                            接續的日誌必須與這些參數相同
+        resume: 為 True 且日誌存在時接續既有紀錄，否則重新建立日誌
+
+    Raises:
+        ValueError: 既有日誌屬於不同的爬取
+    """
+
+    def __init__(self, path, board, start, mode='articles', resume=False):
+        self.path = path
+        self.done_pages = set()
+        self.done_articles = set()
+        # 尚未完成的頁面：{頁碼: 未完成的文章 ID}，以及文章 ID 所在的頁碼
+        self._open_pages = {}
+        self._article_pages = {}
+        header = {'board': board, 'start': start, 'mode': mode}
+
+        self.resumed = resume and os.path.exists(path)
+        if self.resumed:
+            self._load(header)
+            self._file = codecs.open(path, 'a', encoding='utf-8')
+        else:
+            self._file = codecs.open(path, 'w', encoding='utf-8')
+            self._write(header, sync=True)
+
+    def _load(self, header):
+        with codecs.open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # 中止時寫到一半的最後一行
+                continue
+        if not entries or entries[0] != header:
+            raise ValueError(f"檢查點 {self.path} 屬於不同的爬取（{entries[0] if entries else '空白檔案'}），"
+                             "請改用相同的參數或移除 --resume")
+        for entry in entries[1:]:
+            if 'page' in entry:
+                self.done_pages.add(entry['page'])
+            elif 'article' in entry:
+                self.done_articles.add(entry['article'])
+        print(f"由檢查點接續：已完成 {len(self.done_pages)} 頁、{len(self.done_articles)} 篇文章")
+        # 移除前次中止時寫到一半的最後一行，避免與新紀錄黏在一起
+        trim_partial_line(self.path)
+
+    def _write(self, entry, sync=False):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def page_done(self, page):
+        return page in self.done_pages
+
+    def pending_rows(self, page, rows):
+        """
+        過濾列表頁中已完成的文章，並記錄本頁還有哪些文章待完成
+
+        本頁沒有待完成的文章時立即標記本頁完成。
+        """
+        pending = [row for row in rows if row['article_id'] not in self.done_articles]
+        ids = set(row['article_id'] for row in pending if row['article_id'])
+        if ids:
+            self._open_pages[page] = ids
+            for article_id in ids:
+                self._article_pages[article_id] = page
+        else:
+            self.mark_page(page)
+        return pending
+
+    def mark_page(self, page):
+        if page not in self.done_pages:
+            self.done_pages.add(page)
+            self._write({'page': page}, sync=True)
+
+    def mark_article(self, article_id):
+        if article_id in self.done_articles:
+            return
+        self.done_articles.add(article_id)
+        self._write({'article': article_id})
+        page = self._article_pages.pop(article_id, None)
+        if page is not None:
+            remaining = self._open_pages[page]
+            remaining.discard(article_id)
+            if not remaining:
+                del self._open_pages[page]
+                self.mark_page(page)
+
+    def track(self, records):
+        """
+        逐筆轉交 records，下游處理完一筆（要求下一筆）之後才記錄該筆完成
+
+        應串接在所有輸出的最後，確保記錄為完成的文章都已寫出；
+        解析失敗的項目不會被記錄，接續時會重新抓取。
+        """
+        for record in records:
+            yield record
+            article_id = record.get('article_id')
+            if article_id and 'error' not in record:
+                self.mark_article(article_id)
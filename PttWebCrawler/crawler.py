@@ -8,29 +8,30 @@ import sys
 import json
 import requests
 import argparse
+import asyncio
 import time
 import random
 import codecs
+import contextlib
 import logging
 import socket
 import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlencode
 from bs4 import BeautifulSoup
-from six import u
-from requests.adapters import HTTPAdapter
-
-# 根據 Python 版本導入不同的 Retry
-try:
-    # Python 3
-    from urllib3.util import Retry
-except ImportError:
-    try:
-        # 較舊版本的 requests
-        from requests.packages.urllib3.util.retry import Retry
-    except ImportError:
-        # 如果都無法導入，定義一個空的 Retry 類
-        class Retry:
-            pass
+from PttWebCrawler.session import session_manager
+from PttWebCrawler.ratelimit import rate_limiter
+from PttWebCrawler.cache import ResponseCache
+from PttWebCrawler.sync import SyncState, DEFAULT_SYNC_STATE, article_mark, is_permanent_error
+from PttWebCrawler.storage import ArticleStore
+from PttWebCrawler.checkpoint import Checkpoint, checkpoint_path, trim_partial_line
+from PttWebCrawler.filters import ArticleFilter, load_article_ids
+from PttWebCrawler.priority import Budget, get_priority, order_rows
+from PttWebCrawler.models import ArticleError
+from PttWebCrawler import parsers
 
 __version__ = '1.0'
 
@@ -45,23 +46,72 @@ class PttWebCrawler(object):
 
     PTT_URL = 'https://www.ptt.cc'
 
+    # 文章頁面的解析後端：'lxml'（較快，需安裝 lxml）或 'bs4'
+    parser_backend = 'lxml'
+
+    # 所有抓取路徑共用的限速器，可透過 rate_limiter.current_rate() 查看目前速率
+    rate_limiter = rate_limiter
+
+    # 各看板最後頁碼的快取秒數；{看板: (最後頁碼, 取得時間)}
+    board_ttl = 60
+    _last_pages = {}
+
     """docstring for PttWebCrawler"""
-    def __init__(self, cmdline=None, as_lib=False):
+    def __init__(self, cmdline=None, as_lib=False, engine='sync', per_host_limit=8, pool_size=None, cache=None):
         self.parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description='''
             A crawler for the web version of PTT, the largest online community in Taiwan.
             Input: board name and page indices (or articla ID)
             Output: BOARD_NAME-START_INDEX-END_INDEX.json (or BOARD_NAME-ID.json)
         ''')
-        self.parser.add_argument('-b', metavar='BOARD_NAME', help='Board name', required=True)
-        group = self.parser.add_mutually_exclusive_group(required=True)
+        self.parser.add_argument('-b', metavar='BOARD_NAME', help='Board name')
+        group = self.parser.add_mutually_exclusive_group()
         group.add_argument('-i', metavar=('START_INDEX', 'END_INDEX'), type=int, nargs=2, help="Start and end index")
         group.add_argument('-a', metavar='ARTICLE_ID', help="Article ID")
+        group.add_argument('--sync', metavar='BOARD_NAME', help="增量同步看板：只抓取上次同步之後出現的列表頁與文章")
+        group.add_argument('--shard-worker', metavar='SHARD_DB', help="分片工作者：從共用的分片表認領頁數範圍並爬取，直到沒有待處理的分片（可用 -b 限定看板）")
+        self.parser.add_argument('--since', metavar='TIME', help="只爬取此時間之後的文章：未指定 -i 時換算成頁數範圍，範圍外的文章在抓取前略過（例如 2024-01-31 或 2024-01-31T08:00，未指定時區視為台灣時間）")
+        self.parser.add_argument('--until', metavar='TIME', help="只爬取此時間之前（不含）的文章所在的列表頁，可與 --since 搭配")
+        self.parser.add_argument('--only-ids', metavar='ID_FILE', help="只抓取檔案中列出的文章 ID（每行一個，或 .jsonl 檔中的 article_id）")
+        self.parser.add_argument('--skip-ids', metavar='ID_FILE', help="不抓取檔案中列出的文章 ID，例如先前已爬取的 .jsonl 輸出")
+        self.parser.add_argument('--priority', choices=['push', 'recent'], help="先讀完所有列表頁，再依推文數 (push) 或發文時間 (recent) 由高到低抓取文章")
+        self.parser.add_argument('--max-articles', metavar='N', type=int, help="搭配 --priority：最多抓取 N 篇文章")
+        self.parser.add_argument('--time-budget', metavar='SECONDS', type=float, help="搭配 --priority：超過此秒數（含讀取列表頁）後停止抓取")
         self.parser.add_argument('-l', '--list', action='store_true', help="只爬取文章列表（標題、作者、時間、推噓文）而不爬取內容")
+        self.parser.add_argument('-w', '--workers', metavar='N', type=int, default=1, help="同時抓取文章的執行緒數量（預設 1，即逐篇抓取）")
+        self.parser.add_argument('-p', '--processes', metavar='N', type=int, default=0, help="以 N 個行程解析文章 HTML，抓取仍由 -w 的執行緒負責（預設 0，在抓取的執行緒內解析）")
+        self.parser.add_argument('--engine', choices=['sync', 'async'], default=None, help="爬取引擎：sync 使用 requests 逐一請求，async 使用 asyncio 同時發出大量請求")
+        self.parser.add_argument('--parser', choices=['lxml', 'bs4'], default=None, help="文章頁面的 HTML 解析後端（預設 lxml，未安裝時自動改用 bs4）")
+        self.parser.add_argument('--cache', metavar='CACHE_DIR', help="啟用磁碟回應快取，過期後以條件式 GET 重新驗證")
+        self.parser.add_argument('--cache-size', metavar='MB', type=int, default=512, help="磁碟快取容量上限（MB，預設 512）")
+        self.parser.add_argument('--sync-state', metavar='STATE_FILE', default=DEFAULT_SYNC_STATE, help=f"增量同步進度檔（預設 {DEFAULT_SYNC_STATE}）")
+        self.parser.add_argument('--jsonl', metavar='OUTPUT', help="以 JSON Lines 格式逐篇寫入檔案，每解析完一篇立即輸出")
+        self.parser.add_argument('--db', metavar='DB_FILE', help="將文章與推文寫入 SQLite 資料庫，同一篇文章重複爬取時更新內容")
+        self.parser.add_argument('--export', metavar='OUTPUT_DIR', help="將文章與推文匯出為欄式檔案 articles 與 messages（需要 pyarrow）")
+        self.parser.add_argument('--export-format', choices=['parquet', 'arrow'], default='parquet', help="欄式匯出的格式（預設 parquet）")
+        self.parser.add_argument('--refresh', action='store_true', help="更新 --db 中已保存的文章：重新讀取列表頁，只抓取推文數有變化的文章並附加新的推文")
+        self.parser.add_argument('--resume', action='store_true', help="由 --jsonl 或 --db 輸出旁的檢查點接續中斷的 -i 爬取，已完成的頁面與文章不再抓取")
+        self.parser.add_argument('--shards', metavar='SHARD_DB', help="協調模式：將 -i 的頁數範圍切成分片寫入分片表，交由 --shard-worker 的節點爬取")
+        self.parser.add_argument('--shard-size', metavar='PAGES', type=int, default=100, help="每個分片的頁數（預設 100）")
+        self.parser.add_argument('--lease', metavar='SECONDS', type=int, default=300, help="分片租約秒數，工作者中止超過此時間後分片由其他節點接手（預設 300）")
         self.parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
 
+        self.engine = engine
+        self.per_host_limit = per_host_limit
+        self._async_engine = None
+        if pool_size is not None:
+            session_manager.configure(pool_size=pool_size)
+        if cache is not None:
+            session_manager.configure(cache=cache)
+
         self.args = None
         if cmdline:
-            self.args = self.parser.parse_args(cmdline)
+            self.args = self._parse_args(cmdline)
+            if self.args.engine:
+                self.engine = self.args.engine
+            if self.args.parser:
+                PttWebCrawler.parser_backend = self.args.parser
+            if self.args.cache:
+                session_manager.configure(cache=ResponseCache(self.args.cache, max_bytes=self.args.cache_size * 1024 * 1024))
         
         # 如果不是作為函式庫使用，則立即執行爬蟲
         if not as_lib and self.args:
@@ -72,29 +122,247 @@ class PttWebCrawler(object):
         執行爬蟲並回傳結果
         """
         if not self.args:
-            self.args = self.parser.parse_args()
+            self.args = self._parse_args()
             
         board = self.args.b
         result = {}
         
-        if self.args.i:
-            start = self.args.i[0]
-            if self.args.i[1] == -1:
-                end = self.getLastPage(board)
+        article_filter = self.make_article_filter()
+        if self.args.shard_worker:
+            return self.run_shard_worker(self.args.shard_worker, board, article_filter)
+        elif self.args.sync:
+            result = self.sync_board(self.args.sync, self.args.sync_state, workers=self.args.workers, save=False)
+            if 'errors' in result:
+                return result
+            if self.has_outputs():
+                output = self.write_outputs(result['articles'], self.args.sync)
+                output['sync'] = result['sync']
+                result = output
+            # 新文章都已寫出後才推進同步位置，寫出失敗時下次同步會重新抓取
+            state = SyncState(self.args.sync_state)
+            state.set(self.args.sync, result['sync'])
+            state.save()
+            return result
+        elif self.args.i or self.args.since or self.args.until:
+            if self.args.i:
+                start = self.args.i[0]
+                if self.args.i[1] == -1:
+                    end = self.getLastPage(board) if self.engine != 'async' else -1
+                else:
+                    end = self.args.i[1]
             else:
-                end = self.args.i[1]
+                page_range = self.find_page_range(board, self.args.since, self.args.until)
+                if page_range is None:
+                    return {'articles': []}
+                start, end = page_range
+            
+            if self.args.shards:
+                return self.plan_shards(self.args.shards, board, start, end, self.args.shard_size)
+            
+            if self.args.refresh:
+                with ArticleStore(self.args.db) as store:
+                    return self.refresh_articles(store, board, start, end, workers=self.args.workers,
+                                                 article_filter=article_filter)
+            
+            # 輸出 JSONL 或資料庫時以產生器逐篇寫入，不在記憶體中累積結果
+            if self.has_outputs() and self.engine != 'async':
+                checkpoint = self.open_checkpoint(board, start)
+                try:
+                    if self.args.list:
+                        records = self.iter_list_articles(start, end, board, checkpoint=checkpoint,
+                                                          article_filter=article_filter)
+                    elif self.args.priority:
+                        records = self.iter_priority_articles(start, end, board, self.args.priority,
+                                                              workers=self.args.workers,
+                                                              processes=self.args.processes, checkpoint=checkpoint,
+                                                              article_filter=article_filter,
+                                                              budget=self.make_budget())
+                    else:
+                        records = self.iter_articles(start, end, board, workers=self.args.workers,
+                                                     processes=self.args.processes, checkpoint=checkpoint,
+                                                     article_filter=article_filter)
+                    return self.write_outputs(records, board, checkpoint=checkpoint)
+                finally:
+                    if checkpoint is not None:
+                        checkpoint.close()
             
             # 依據是否指定只爬列表決定使用的方法
             if hasattr(self.args, 'list') and self.args.list:
-                result = self.parse_list_articles(start, end, board)
+                result = self.parse_list_articles(start, end, board, article_filter=article_filter)
             else:
-                result = self.parse_articles(start, end, board)
+                result = self.parse_articles(start, end, board, workers=self.args.workers,
+                                             processes=self.args.processes, article_filter=article_filter,
+                                             priority=self.args.priority, budget=self.make_budget())
         else:  # self.args.a
             article_id = self.args.a
             result = self.parse_article(article_id, board)
+        
+        if self.has_outputs():
+            records = result['articles'] if 'articles' in result else [result]
+            return self.write_outputs(records, board)
+            
+        return result
+
+    def has_outputs(self):
+        """命令列是否指定了 JSONL、資料庫或欄式匯出等輸出"""
+        return bool(self.args.jsonl or self.args.db or self.args.export)
+
+    def make_article_filter(self):
+        """依 --since/--until 與 --only-ids/--skip-ids 建立抓取前的過濾條件，都沒有指定時回傳 None"""
+        args = self.args
+        if not (args.since or args.until or args.only_ids or args.skip_ids):
+            return None
+        return ArticleFilter(
+            since=args.since,
+            until=args.until,
+            allow=load_article_ids(args.only_ids) if args.only_ids else None,
+            deny=load_article_ids(args.skip_ids) if args.skip_ids else None,
+        )
+
+    def make_budget(self):
+        """依 --max-articles 與 --time-budget 建立優先排程的預算，都沒有指定時回傳 None"""
+        if self.args.max_articles is None and self.args.time_budget is None:
+            return None
+        return Budget(self.args.max_articles, self.args.time_budget)
+
+    def open_checkpoint(self, board, start):
+        """
+        建立 -i 爬取的檢查點日誌，放在 --jsonl（或 --db）輸出旁
+        
+        指定 --resume 且日誌存在時接續既有紀錄；只有欄式匯出時不建立檢查點。
+        """
+        output = self.args.jsonl or self.args.db
+        if not output:
+            return None
+        return Checkpoint(checkpoint_path(output), board, start, 'list' if self.args.list else 'articles',
+                          resume=self.args.resume)
+
+    def write_outputs(self, records, board=None, name=None, checkpoint=None):
+        """
+        依命令列參數將 records 串接寫入資料庫、欄式檔案及 JSONL 檔案
+        
+        Args:
+            name: 分片爬取時的分片名稱；指定時 --jsonl 與 --export 視為目錄，
+                  每個分片寫入 name.jsonl 與 name/ 子目錄，重新爬取時覆寫同一份輸出
+            checkpoint: 若提供 Checkpoint，每筆資料寫入所有輸出後才記錄為完成；
+                        接續爬取時 JSONL 改為附加寫入
+        """
+        jsonl, export = self.args.jsonl, self.args.export
+        if name is not None:
+            if jsonl:
+                os.makedirs(jsonl, exist_ok=True)
+                jsonl = os.path.join(jsonl, name + '.jsonl')
+            if export:
+                export = os.path.join(export, name)
+        
+        sinks = []
+        try:
+            if self.args.db:
+                # 有檢查點時每篇文章立即提交，記錄為完成的文章一定已在資料庫中
+                sinks.append(ArticleStore(self.args.db, batch_size=1 if checkpoint is not None else 200))
+                records = sinks[-1].iter_write(records, board)
+            if export:
+                from PttWebCrawler.export import ColumnarExporter
+                sinks.append(ColumnarExporter(export, self.args.export_format))
+                records = sinks[-1].iter_write(records, board)
+            if checkpoint is not None:
+                records = checkpoint.track(records)
             
+            if jsonl:
+                mode = 'w'
+                if checkpoint is not None and checkpoint.resumed:
+                    trim_partial_line(jsonl)
+                    mode = 'a'
+                result = self.write_jsonl(jsonl, records, mode)
+            else:
+                count = sum(1 for _ in records)
+                result = {'output': self.args.db or export, 'count': count}
+                print(f"已寫入 {count} 筆資料到 {result['output']}")
+        finally:
+            for sink in sinks:
+                sink.close()
+        if self.args.db:
+            result['db'] = self.args.db
+        if export:
+            result['export'] = export
+        return result
+
+    def plan_shards(self, path, board, start, end, shard_size=100):
+        """將頁數範圍切成分片寫入分片表，回傳新增的分片數與目前進度"""
+        from PttWebCrawler.shards import ShardStore
+        store = ShardStore(path)
+        created = store.plan(board, start, end, shard_size)
+        progress = store.progress(board)
+        print(f"{board} 板第 {start} 到 {end} 頁新增 {created} 個分片，目前進度: {progress}")
+        return {'shards': path, 'created': created, 'progress': progress}
+
+    def run_shard_worker(self, path, board=None, article_filter=None):
+        """
+        從分片表持續認領分片並爬取，直到沒有可認領的分片
+        
+        每個分片依命令列的 -l、-w、-p 與輸出參數爬取；分片內有任何頁面或文章出錯
+        時交還分片稍後重試，租約遺失時停止輸出並交由接手的節點重新爬取。
+        """
+        from PttWebCrawler.shards import ShardStore, run_worker, shard_name
+        
+        def process(shard, lease):
+            error_log = []
+            start, end, shard_board = shard['start_page'], shard['end_page'], shard['board']
+            if self.args.list:
+                records = self.iter_list_articles(start, end, shard_board, error_log=error_log,
+                                                  article_filter=article_filter)
+            else:
+                records = self.iter_articles(start, end, shard_board, workers=self.args.workers,
+                                             error_log=error_log, processes=self.args.processes,
+                                             article_filter=article_filter)
+            records = lease.guard(records)
+            if self.has_outputs():
+                count = self.write_outputs(records, shard_board, shard_name(shard))['count']
+            else:
+                count = sum(1 for _ in records)
+            if error_log:
+                raise RuntimeError(f"{len(error_log)} 個錯誤，第一個: {error_log[0]}")
+            return count
+        
+        store = ShardStore(path)
+        result = run_worker(store, process, lease_seconds=self.args.lease, board=board)
+        result['progress'] = store.progress(board)
         return result
 
+    def _parse_args(self, cmdline=None):
+        args = self.parser.parse_args(cmdline)
+        window = args.since or args.until
+        if not (args.i or args.a or args.sync or args.shard_worker or window):
+            self.parser.error('one of the arguments -i -a --sync --shard-worker --since --until is required')
+        if window and (args.a or args.sync):
+            self.parser.error('--since/--until 不能與 -a 或 --sync 同時使用')
+        for value in (args.since, args.until):
+            if value:
+                try:
+                    parsers.parse_time(value)
+                except ValueError:
+                    self.parser.error(f'無法解析的時間: {value}')
+        if not args.sync and not args.shard_worker and not args.b:
+            self.parser.error('the following arguments are required: -b')
+        if (args.max_articles is not None or args.time_budget is not None) and not args.priority:
+            self.parser.error('--max-articles 與 --time-budget 需要搭配 --priority')
+        if args.priority:
+            if not (args.i or window):
+                self.parser.error('--priority 需要搭配 -i 或 --since/--until')
+            if args.list or args.refresh or args.shards or args.engine == 'async':
+                self.parser.error('--priority 不能與 -l、--refresh、--shards 或 --engine async 同時使用')
+        if args.refresh and (not (args.i or window) or not args.db):
+            self.parser.error('--refresh 需要搭配 -i（或 --since/--until）以及 --db')
+        if args.resume:
+            if not (args.i or window) or not (args.jsonl or args.db):
+                self.parser.error('--resume 需要搭配 -i（或 --since/--until）以及 --jsonl 或 --db 輸出')
+            if args.export:
+                self.parser.error('--resume 不支援 --export：欄式檔案無法接續寫入')
+            if (args.engine or self.engine) == 'async':
+                # 非同步引擎一次取得所有結果，不經過檢查點，接續時會覆寫既有的 JSONL
+                self.parser.error('--resume 不能與 --engine async 同時使用')
+        return args
+
     # def parse_articles(self, start, end, board, path='.', timeout=3):
     #         filename = board + '-' + str(start) + '-' + str(end) + '.json'
     #         filename = os.path.join(path, filename)
@@ -126,7 +394,8 @@ class PttWebCrawler(object):
     #             time.sleep(0.1)
     #         self.store(filename, u']}', 'a')
     #         return filename
-    def parse_articles(self, start, end, board, timeout=10):
+    def parse_articles(self, start, end, board, timeout=10, workers=1, processes=0, article_filter=None,
+                       priority=None, budget=None):
         """
         爬取指定板塊中的文章列表
         
@@ -135,14 +404,45 @@ class PttWebCrawler(object):
             end: 結束頁碼
             board: 板塊名稱
             timeout: 請求超時時間
+            workers: 同時抓取文章的執行緒數量，大於 1 時每一頁的文章會並行抓取，
+                     輸出順序仍與列表頁相同
+            processes: 解析 HTML 的行程數量，大於 0 時執行緒只負責下載，
+                       解析交給行程池，適合 CPU 成為瓶頸的大量爬取
+            article_filter: 若提供 ArticleFilter，不符合條件的文章在抓取前即被略過
+            priority: 若提供，先讀完所有列表頁再依優先順序抓取文章，見 iter_priority_articles
+            budget: 搭配 priority 使用的 Budget，預算用完時停止抓取
             
         Returns:
             一個字典，包含爬取到的文章列表
         """
-        articles = []
+        # 優先排程需要先取得所有列表項目，一律使用同步的抓取路徑
+        if self.engine == 'async' and priority is None:
+            return self._run_async_engine('parse_articles', timeout, start, end, board, article_filter=article_filter)
+        
+        if priority is not None:
+            articles = list(self.iter_priority_articles(start, end, board, priority, timeout, workers,
+                                                        processes=processes, article_filter=article_filter,
+                                                        budget=budget))
+        else:
+            articles = list(self.iter_articles(start, end, board, timeout, workers, processes=processes,
+                                               article_filter=article_filter))
+        print(f"總共爬取了 {len(articles)} 篇文章，目前速率: {rate_limiter.current_rate(self.PTT_URL):.2f} 次/秒")
+        return {'articles': articles}
+
+    def iter_articles(self, start, end, board, timeout=10, workers=1, error_log=None, processes=0, checkpoint=None,
+                      article_filter=None):
+        """
+        逐篇產生指定板塊的文章，每解析完一頁就立即輸出，記憶體用量不隨頁數增加
+        
+        參數與 parse_articles 相同，產生的文章字典順序與列表頁相同；
+        若提供 error_log，爬取過程中的錯誤訊息會附加到此列表；
+        若提供 Checkpoint，已完成的列表頁與文章會被略過
+        """
+        if error_log is None:
+            error_log = []
         
-        # 建立 Session 保持 cookie
-        session = requests.Session()
+        # 使用行程內共用的 Session，並確保連線池足以容納所有執行緒
+        session_manager.ensure_pool_size(workers)
         
         # 設定模擬瀏覽器 headers
         headers = {
@@ -152,35 +452,9 @@ class PttWebCrawler(object):
             'Referer': 'https://www.ptt.cc/bbs/index.html',
         }
         
-        # 第一次請求獲取 cookies
+        # 共用 Session 已帶有 over18 cookie，只需取得最大頁數（同一看板在 TTL 內不重複下載）
         try:
-            # 先訪問首頁獲取基本 cookie
-            print(f"訪問 PTT 首頁獲取 cookie")
-            resp = session.get(
-                'https://www.ptt.cc/bbs/index.html',
-                headers=headers,
-                timeout=timeout,
-                verify=VERIFY
-            )
-            
-            # 強制設置 over18 cookie
-            session.cookies.set('over18', '1', domain='www.ptt.cc')
-            
-            # 直接訪問目標板塊
-            print(f"訪問 {board} 板")
-            resp = session.get(
-                f'{self.PTT_URL}/bbs/{board}/index.html',
-                headers=headers,
-                timeout=timeout,
-                verify=VERIFY
-            )
-            
-            if resp.status_code != 200:
-                print(f"訪問 {board} 板失敗，狀態碼: {resp.status_code}")
-                return {'articles': []}
-                
-            # 獲取最大頁數
-            max_page = self.getLastPage(board, timeout)
+            max_page = self.board_last_page(board, timeout, headers=headers)
             print(f"{board} 板最大頁數: {max_page}")
             
             # 確保頁碼在有效範圍內
@@ -189,11 +463,41 @@ class PttWebCrawler(object):
                 print(f"結束頁碼超過最大頁數，已自動調整為: {end}")
                 
         except Exception as e:
-            print(f"初始化連接時出錯: {e}")
-            return {'articles': []}
+            error_msg = f"初始化連接時出錯: {e}"
+            print(error_msg)
+            error_log.append(error_msg)
+            return
         
-        # 開始爬取頁面
+        # 並行模式下整個爬取過程共用一個執行緒池；管線模式另外建立解析用的行程池
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 or processes > 0 else None
+        parse_pool = self.make_parse_pool(processes)
+        
+        try:
+            pages = self._iter_index_pages(start, end, board, headers, timeout, error_log, checkpoint,
+                                           article_filter)
+            if parse_pool is not None:
+                # 各頁的文章接成同一條管線，下一頁的下載與上一頁的解析可以重疊
+                rows = (row for page_rows in pages for row in page_rows)
+                window = 2 * (max(workers, 1) + processes)
+                for article in self.pipeline_articles(rows, board, timeout, executor, parse_pool, error_log, window):
+                    yield article
+            else:
+                for rows in pages:
+                    # 依序或並行抓取本頁文章內容
+                    for article in self.fetch_articles(rows, board, timeout, executor, error_log):
+                        yield article
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            if parse_pool is not None:
+                parse_pool.shutdown(wait=True)
+
+    def _iter_index_pages(self, start, end, board, headers, timeout, error_log, checkpoint=None, article_filter=None):
+        """逐頁下載列表頁並產生每頁的文章資訊列表，失敗的頁面只記錄錯誤並略過"""
+        session = session_manager.get()
         for i in range(start, end + 1):
+            if checkpoint is not None and checkpoint.page_done(i):
+                continue
             page_url = f'{self.PTT_URL}/bbs/{board}/index{i}.html'
             print(f"爬取頁面: {page_url}")
             
@@ -206,73 +510,584 @@ class PttWebCrawler(object):
                 )
                 
                 if resp.status_code != 200:
-                    print(f"頁面請求失敗，狀態碼: {resp.status_code}")
+                    error_msg = f"頁面請求失敗，狀態碼: {resp.status_code}"
+                    print(error_msg)
+                    error_log.append(error_msg)
                     continue
                 
-                # 解析 HTML
-                soup = BeautifulSoup(resp.text, 'html.parser')
+                # 解析列表頁，只保留有連結的文章
+                rows = self.parse_index_rows(resp.text)
+                print(f"找到 {len(rows)} 個文章區塊")
+                if article_filter is not None:
+                    rows = article_filter.filter_rows(rows)
+                if checkpoint is not None:
+                    rows = checkpoint.pending_rows(i, rows)
                 
-                # 查找所有文章區塊
-                article_divs = soup.select('div.r-ent')
-                print(f"找到 {len(article_divs)} 個文章區塊")
+            except Exception as e:
+                error_msg = f"爬取頁面 {page_url} 時出錯: {e}"
+                print(error_msg)
+                error_log.append(error_msg)
+                continue
+            
+            yield rows
+
+    def fetch_articles(self, rows, board, timeout=10, executor=None, error_log=None, outcomes=None):
+        """
+        抓取列表項目對應的文章內容，沒有連結的項目（已刪除文章）會被略過
+        
+        Args:
+            rows: parse_index_rows 回傳的文章資訊列表
+            executor: 若提供 ThreadPoolExecutor 則並行抓取，輸出順序仍與 rows 相同
+            error_log: 若提供，個別文章的錯誤訊息會附加到此列表
+            outcomes: 若提供字典，記錄每篇文章的結果 {文章 ID: 文章字典、錯誤字典或例外}，
+                      錯誤字典本身不含文章 ID，呼叫端可由此對應
+            
+        Returns:
+            成功解析的文章字典列表；個別文章失敗只會記錄訊息並略過
+        """
+        if error_log is None:
+            error_log = []
+        targets = [(row['url'], row['article_id'], row['title']) for row in rows if row['url']]
+        articles = []
+        
+        if executor is None:
+            for article_url, article_id, title in targets:
+                try:
+                    print(f"爬取文章: {article_id} - {title}")
+                    article = self._fetch_article(article_url, article_id, board, timeout)
+                except Exception as e:
+                    error_msg = f"處理文章 {article_id} 時出錯: {e}"
+                    print(error_msg)
+                    error_log.append(error_msg)
+                    article = e
+                else:
+                    articles.append(article)
+                if outcomes is not None:
+                    outcomes[article_id] = article
+        else:
+            futures = []
+            for article_url, article_id, title in targets:
+                print(f"爬取文章: {article_id} - {title}")
+                futures.append((article_id, executor.submit(self._fetch_article, article_url, article_id, board, timeout)))
+            
+            # 依照列表頁順序收集結果，個別文章失敗不影響其他文章
+            for article_id, future in futures:
+                try:
+                    article = future.result()
+                except Exception as e:
+                    error_msg = f"處理文章 {article_id} 時出錯: {e}"
+                    print(error_msg)
+                    error_log.append(error_msg)
+                    article = e
+                else:
+                    articles.append(article)
+                if outcomes is not None:
+                    outcomes[article_id] = article
+        
+        return articles
+
+    @staticmethod
+    def make_parse_pool(processes):
+        """
+        建立解析 HTML 的行程池，processes 為 0 時回傳 None
+        
+        行程池會在下載執行緒中才啟動工作行程，從多執行緒的行程 fork 可能複製到
+        其他執行緒持有的鎖而死結，因此改用 forkserver（不支援時使用 spawn）啟動。
+        """
+        if processes <= 0:
+            return None
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(method))
+
+    def pipeline_articles(self, rows, board, timeout, executor, parse_pool, error_log=None, window=16):
+        """
+        以執行緒下載文章 HTML、以行程池解析，依 rows 的順序產生文章字典
+        
+        下載與解析中的文章最多 window 篇，達到上限時先等待最早送出的文章完成，
+        因此 rows 可以是不限長度的產生器，記憶體用量只與 window 有關。
+        
+        Args:
+            rows: parse_index_rows 回傳格式的文章資訊，沒有連結的項目會被略過
+            executor: 下載 HTML 的 ThreadPoolExecutor
+            parse_pool: 解析 HTML 的 ProcessPoolExecutor
+            error_log: 若提供，個別文章的錯誤訊息會附加到此列表
+        """
+        if error_log is None:
+            error_log = []
+        
+        pending = deque()
+        
+        def collect():
+            article_id, future = pending.popleft()
+            try:
+                result = future.result()
+                # 下載成功時得到的是行程池的 Future，下載失敗時直接是錯誤字典
+                return result.result() if isinstance(result, Future) else result
+            except Exception as e:
+                error_msg = f"處理文章 {article_id} 時出錯: {e}"
+                print(error_msg)
+                error_log.append(error_msg)
+                return None
+        
+        for row in rows:
+            if not row['url']:
+                continue
+            while len(pending) >= window:
+                article = collect()
+                if article is not None:
+                    yield article
+            print(f"爬取文章: {row['article_id']} - {row['title']}")
+            pending.append((row['article_id'], executor.submit(
+                self._fetch_for_pipeline, row['url'], row['article_id'], board, timeout, parse_pool)))
+        
+        while pending:
+            article = collect()
+            if article is not None:
+                yield article
+
+    def _fetch_for_pipeline(self, article_url, article_id, board, timeout, parse_pool):
+        """下載文章 HTML 並交給行程池解析，回傳解析的 Future；無法取得時回傳錯誤字典"""
+        try:
+            html = self.fetch_article_html(article_url, article_id, board, timeout)
+        except ArticleError as e:
+            return e.data
+        # 子行程不一定繼承執行期修改的類別屬性，明確傳入解析後端
+        return parse_pool.submit(PttWebCrawler.parse_html, html, article_url, article_id, board, self.parser_backend)
+
+    def iter_priority_articles(self, start, end, board, priority='push', timeout=10, workers=1, error_log=None,
+                               processes=0, checkpoint=None, article_filter=None, budget=None):
+        """
+        先讀完 start 到 end 的列表頁，再依優先順序由高到低逐篇產生文章
+        
+        列表項目全部保留在記憶體中（每篇只有標題、作者等列表資訊），文章內容仍逐篇
+        產生。預算在每批請求送出前檢查，已送出的請求會完成後才停止。
+        
+        Args:
+            priority: priority.PRIORITIES 中的名稱（push、recent），或接受列表項目並回傳
+                      可排序值的函式，值越大越先抓取
+            budget: 若提供 Budget，請求數或時間用完時停止抓取，並記錄未抓取的文章數；
+                    時間自開始讀取列表頁起算
+            其餘參數與 iter_articles 相同；產生的文章依優先順序排列
+        """
+        if error_log is None:
+            error_log = []
+        key = get_priority(priority)
+        if budget is None:
+            budget = Budget()
+        budget.start()
+        
+        rows = order_rows(self.iter_list_articles(start, end, board, timeout, error_log, checkpoint, article_filter),
+                          key)
+        print(f"列表頁共有 {len(rows)} 篇文章，依優先順序抓取")
+        
+        session_manager.ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 or processes > 0 else None
+        parse_pool = self.make_parse_pool(processes)
+        
+        try:
+            if parse_pool is not None:
+                def budgeted():
+                    # 管線逐篇取用，每送出一篇前檢查預算
+                    for i, row in enumerate(rows):
+                        if not budget.take([row]):
+                            budget.left += len(rows) - i - 1
+                            return
+                        yield row
                 
-                for div in article_divs:
-                    try:
-                        # 獲取文章連結
-                        title_div = div.select_one('div.title')
-                        if not title_div:
-                            continue
-                            
-                        a_tag = title_div.select_one('a')
-                        if not a_tag:
-                            # 可能是已刪除的文章
-                            continue
-                            
-                        href = a_tag.get('href')
-                        if not href or '/bbs/' not in href:
-                            continue
-                            
-                        # 文章標題
-                        title = a_tag.text.strip()
-                        
-                        # 完整的文章 URL
-                        article_url = self.PTT_URL + href
-                        
-                        # 文章 ID
-                        article_id = href.split('/')[-1].replace('.html', '')
-                        
-                        # 作者和日期
-                        meta_div = div.select_one('div.meta')
-                        author = meta_div.select_one('div.author').text.strip() if meta_div and meta_div.select_one('div.author') else ''
-                        date = meta_div.select_one('div.date').text.strip() if meta_div and meta_div.select_one('div.date') else ''
-                        
-                        # 推文數
-                        push_count_div = div.select_one('div.nrec')
-                        push_count_str = push_count_div.text.strip() if push_count_div else '0'
-                        
-                        print(f"爬取文章: {article_id} - {title}")
-                        
-                        # 獲取文章內容
-                        article_json = self.parse(article_url, article_id, board, timeout)
-                        article_data = json.loads(article_json)
-                        articles.append(article_data)
-                        
-                        # 避免請求過於頻繁
-                        time.sleep(0.5)
-                        
-                    except Exception as e:
-                        print(f"處理文章時出錯: {e}")
-                        continue
+                window = 2 * (max(workers, 1) + processes)
+                for article in self.pipeline_articles(budgeted(), board, timeout, executor, parse_pool, error_log,
+                                                      window):
+                    yield article
+            else:
+                # 每批送出與執行緒數量相同的請求，完成後再檢查預算
+                size = max(workers, 1)
+                for i in range(0, len(rows), size):
+                    batch = budget.take(rows[i:i + size])
+                    if not batch:
+                        budget.left += max(len(rows) - i - size, 0)
+                        break
+                    for article in self.fetch_articles(batch, board, timeout, executor, error_log):
+                        yield article
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            if parse_pool is not None:
+                parse_pool.shutdown(wait=True)
+        
+        if budget.left:
+            print(f"預算用完，已抓取 {budget.spent} 篇，尚有 {budget.left} 篇優先順序較低的文章未抓取")
+
+    def refresh_articles(self, store, board, start, end, timeout=10, workers=1, article_filter=None,
+                         refresh_saturated=True):
+        """
+        依列表頁上的推文數更新已保存的文章
+        
+        重新讀取列表頁，與 ArticleStore 中保存的推噓相抵數量比較，只重新抓取推文數
+        有變化的文章，並以 store.merge_messages 附加新的推文。列表頁只顯示概略的
+        數量（爆、X1~X9），推噓相抵後不變的變化無法察覺。
+        
+        啟用磁碟回應快取時，列表頁與文章頁一律以條件式 GET 重新驗證，
+        不會拿 TTL 內的舊推文比對。
+        
+        Args:
+            store: 保存文章的 ArticleStore；只有列表資訊或尚未保存的文章不會被抓取
+            refresh_saturated: 列表頁顯示 爆 或 XX 時無法判斷是否變化，為 True 時一律重新抓取
+            
+        Returns:
+            一個字典，refresh 欄位為檢查、重新抓取與新增推文的數量
+        """
+        with self.revalidating_cache():
+            return self._refresh_articles(store, board, start, end, timeout, workers, article_filter,
+                                          refresh_saturated)
+
+    def _refresh_articles(self, store, board, start, end, timeout, workers, article_filter, refresh_saturated):
+        error_log = []
+        stats = {'checked': 0, 'not_stored': 0, 'changed': 0, 'new_messages': 0, 'rewritten': 0}
+        session_manager.ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        
+        def refresh(rows):
+            rows = [row for row in rows if row['url']]
+            stored = store.push_counts(board, [row['article_id'] for row in rows])
+            changed = []
+            for row in rows:
+                stats['checked'] += 1
+                if row['article_id'] not in stored:
+                    stats['not_stored'] += 1
+                    continue
+                shown = parsers.display_push_count(stored[row['article_id']] or 0)
+                if row['push_count'] != shown or (refresh_saturated and abs(shown) == 100):
+                    changed.append(row)
+            stats['changed'] += len(changed)
+            for article in self.fetch_articles(changed, board, timeout, executor, error_log):
+                if 'error' in article:
+                    continue
+                appended = store.merge_messages(article, board)
+                if appended is None:
+                    stats['rewritten'] += 1
+                else:
+                    stats['new_messages'] += appended
+        
+        try:
+            # 每累積一頁的列表項目就比對並更新一次
+            batch = []
+            for row in self.iter_list_articles(start, end, board, timeout, error_log, article_filter=article_filter):
+                batch.append(row)
+                if len(batch) >= 20:
+                    refresh(batch)
+                    batch = []
+            if batch:
+                refresh(batch)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        
+        print(f"檢查 {stats['checked']} 篇文章，重新抓取 {stats['changed']} 篇，新增 {stats['new_messages']} 則推文")
+        result = {'refresh': stats}
+        if error_log:
+            result['errors'] = error_log
+        return result
+
+    def sync_board(self, board, state_file=DEFAULT_SYNC_STATE, timeout=10, workers=1, initial_pages=1, save=True):
+        """
+        增量同步看板，只抓取上次同步位置之後的列表頁與文章
+        
+        啟用磁碟回應快取時，列表頁與文章頁一律以條件式 GET 重新驗證。
+        
+        Args:
+            board: 板塊名稱
+            state_file: 同步進度檔
+            workers: 同時抓取文章的執行緒數量
+            initial_pages: 第一次同步時要抓取的最新頁數
+            save: 為 False 時不寫入進度檔，由呼叫端在新文章寫出後以 SyncState.set 保存 sync
+            
+        Returns:
+            一個字典，包含新文章列表與更新後的同步位置 (sync)；無法取得看板最後頁碼時
+            不抓取任何頁面也不更新進度，errors 欄位為錯誤訊息
+        """
+        with self.revalidating_cache():
+            return self._sync_board(board, state_file, timeout, workers, initial_pages, save)
+
+    def _sync_board(self, board, state_file, timeout, workers, initial_pages, save):
+        state = SyncState(state_file)
+        record = state.get(board)
+        mark = state.high_water_mark(board)
+        
+        try:
+            last_page = self.board_last_page(board, timeout)
+        except Exception as e:
+            error_msg = f"取得 {board} 板最後頁碼時出錯，略過本次同步: {e}"
+            print(error_msg)
+            return {'articles': [], 'sync': record, 'errors': [error_msg]}
+        if record:
+            if last_page < record['last_page']:
+                # 推算失敗時最後頁碼為 1，不能據此倒退同步位置
+                print(f"{board} 板目前最後頁 {last_page} 小於上次同步的 {record['last_page']}，略過本次同步")
+                return {'articles': [], 'sync': record}
+            start = record['last_page']
+        else:
+            start = max(1, last_page - initial_pages + 1)
+        print(f"同步 {board} 板，頁碼 {start} 到 {last_page}")
+        
+        session_manager.ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        articles = []
+        synced_page = start
+        try:
+            for i in range(start, last_page + 1):
+                try:
+                    rows, _ = self.fetch_index_rows(board, i, timeout)
+                except Exception as e:
+                    # 從失敗的頁面停止，下次同步由此頁繼續
+                    print(f"爬取頁面 {i} 時出錯，停止本次同步: {e}")
+                    break
                 
-                # 頁面之間的延遲
-                time.sleep(1)
+                new_rows = [row for row in rows if row['article_id'] and (mark is None or article_mark(row['article_id']) > mark)]
+                new_rows.sort(key=lambda row: article_mark(row['article_id']))
+                outcomes = {}
+                fetched = self.fetch_articles(new_rows, board, timeout, executor, outcomes=outcomes)
+                articles.extend(fetched)
                 
-            except Exception as e:
-                print(f"爬取頁面 {page_url} 時出錯: {e}")
+                # 只把高水位推進到第一篇暫時失敗的文章之前，確保這些文章下次會被重抓；
+                # 已刪除（404）等永久失敗的文章重抓也不會成功，視為已處理
+                stalled = False
+                for row in new_rows:
+                    outcome = outcomes.get(row['article_id'])
+                    if not isinstance(outcome, dict):
+                        stalled = True
+                        break
+                    if 'error' in outcome:
+                        if not is_permanent_error(outcome):
+                            stalled = True
+                            break
+                        print(f"文章 {row['article_id']} 無法取得（{outcome['error']}），不再重試")
+                    mark = article_mark(row['article_id'])
+                synced_page = i
+                if stalled:
+                    print(f"頁面 {i} 有文章抓取失敗，下次同步由此頁繼續")
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        
+        state.update(board, synced_page, mark)
+        if save:
+            state.save()
+        print(f"同步完成，新增 {len(articles)} 篇文章")
+        return {'articles': articles, 'sync': state.get(board)}
+
+    @staticmethod
+    def revalidating_cache():
+        """磁碟回應快取的列表頁與文章頁在期間內一律重新驗證；未啟用快取時不做任何事"""
+        cache = session_manager.cache
+        if cache is None:
+            return contextlib.nullcontext()
+        return cache.revalidating('index', 'article')
+
+    def fetch_index_rows(self, board, index, timeout=10):
+        """
+        抓取並解析單一列表頁，index 為 None 時抓取最新一頁 (index.html)
+        
+        Returns:
+            (文章資訊列表, 頁面 HTML)；請求失敗時拋出例外
+        """
+        page = '' if index is None else str(index)
+        page_url = f'{self.PTT_URL}/bbs/{board}/index{page}.html'
+        print(f"爬取頁面: {page_url}")
+        resp = session_manager.get().get(page_url, timeout=timeout, verify=VERIFY)
+        if resp.status_code != 200:
+            raise Exception(f"頁面請求失敗，狀態碼: {resp.status_code}")
+        return self.parse_index_rows(resp.text), resp.text
+
+    def page_time_range(self, board, page, timeout=10):
+        """
+        列表頁上文章的 (最早, 最晚) 發文時間，取自文章 ID 中的 Unix time
+        
+        Returns:
+            (最早, 最晚)；頁面上沒有可判斷時間的文章（例如全部已刪除）時回傳 None
+        """
+        rows, _ = self.fetch_index_rows(board, page, timeout)
+        times = []
+        for row in rows:
+            timestamp = parsers.article_timestamp(row['article_id'])
+            if timestamp is None:
                 continue
-                
-        print(f"總共爬取了 {len(articles)} 篇文章")
-        return {'articles': articles}
+            # 最後一頁底部的置底文章通常較舊，時間倒退時即停止
+            if times and timestamp < times[-1]:
+                break
+            times.append(timestamp)
+        return (times[0], times[-1]) if times else None
+
+    def find_page_range(self, board, since=None, until=None, timeout=10):
+        """
+        以二分搜尋列表頁找出發文時間落在 [since, until) 的頁碼範圍
+        
+        列表頁依發文時間排序，每次探測一頁並讀取文章 ID 中的時間，以內插猜測頁碼、
+        必要時改用二分縮小範圍，數萬頁的看板找出一天的範圍通常只需十幾次請求。
+        邊界頁面可能包含範圍外的文章。
+        
+        Args:
+            since, until: Unix time 或 parsers.parse_time 接受的日期字串，未指定表示不限
+            
+        Returns:
+            (起始頁, 結束頁)；範圍內沒有任何列表頁時回傳 None
+        """
+        since = parsers.parse_time(since) if since is not None else None
+        until = parsers.parse_time(until) if until is not None else None
+        last_page = self.board_last_page(board, timeout)
+        probed = {}
+        
+        def times(page):
+            # 沒有可判斷時間的頁面沿用前一頁的時間
+            for candidate in range(page, 0, -1):
+                if candidate not in probed:
+                    probed[candidate] = self.page_time_range(board, candidate, timeout)
+                if probed[candidate] is not None:
+                    return probed[candidate]
+            return None
+        
+        def latest(page):
+            found = times(page)
+            return found[1] if found else 0
+        
+        def earliest(page):
+            found = times(page)
+            return found[0] if found else 0
+        
+        start = 1
+        if since is not None:
+            start = self._first_page_reaching(1, last_page, latest, since)
+            if start > last_page:
+                print(f"{board} 板沒有 {since} 之後的文章")
+                return None
+        end = last_page
+        if until is not None:
+            end = self._first_page_reaching(start, last_page, earliest, until) - 1
+            if end < start:
+                print(f"{board} 板第 {start} 頁之前沒有 {until} 之前的文章")
+                return None
+        print(f"{board} 板時間範圍對應第 {start} 到 {end} 頁，共探測 {len(probed)} 個列表頁")
+        return start, end
+
+    @staticmethod
+    def _first_page_reaching(low, high, value, target):
+        """
+        在 [low, high] 中找出第一個 value(page) >= target 的頁碼，都沒有時回傳 high + 1
+        
+        value 須隨頁碼遞增。先探測兩端，之後以上下界的值線性內插猜測頁碼；
+        內插未能讓範圍縮小一半時下一步改用二分，最差情況也不超過二分搜尋的兩倍。
+        """
+        below = (low, value(low))
+        if below[1] >= target:
+            return low
+        above = (high, value(high))
+        if above[1] < target:
+            return high + 1
+        # 不變量：value(below) < target <= value(above)
+        interpolate = True
+        while above[0] - below[0] > 1:
+            width = above[0] - below[0]
+            page = (below[0] + above[0]) // 2
+            if interpolate and above[1] > below[1]:
+                ratio = (target - below[1]) / (above[1] - below[1])
+                page = min(max(below[0] + int(round(ratio * width)), below[0] + 1), above[0] - 1)
+            current = value(page)
+            if current >= target:
+                above = (page, current)
+            else:
+                below = (page, current)
+            interpolate = above[0] - below[0] <= width // 2
+        return above[0]
+
+    def search_articles(self, keyword, board, max_pages=5, timeout=10, workers=4, author=None, recommend=None,
+                        fetch_content=False, error_log=None):
+        """
+        以 PTT 的看板搜尋頁 (/bbs/{board}/search?q=...) 搜尋文章
+        
+        Args:
+            keyword: 搜尋關鍵字，可直接使用 PTT 的 author:、recommend: 語法；可為空字串
+            board: 板塊名稱
+            max_pages: 最多抓取的搜尋結果頁數
+            workers: 同時抓取搜尋結果頁（及文章內容）的執行緒數量
+            author: 只保留此作者的文章
+            recommend: 只保留推文數大於等於此值的文章
+            fetch_content: 是否進一步抓取每篇文章的完整內容
+            error_log: 若提供，爬取過程中的錯誤訊息會附加到此列表
+            
+        Returns:
+            一個字典，包含符合條件的文章（列表資訊或完整內容）與搜尋條件
+        """
+        if error_log is None:
+            error_log = []
+        terms = [keyword.strip()] if keyword and keyword.strip() else []
+        if author:
+            terms.append(f'author:{author}')
+        if recommend is not None:
+            terms.append(f'recommend:{recommend}')
+        query = ' '.join(terms)
+        if not query:
+            raise ValueError("必須提供關鍵字或篩選條件")
+        
+        session_manager.ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            # 第一頁的分頁連結標示搜尋結果的總頁數，其餘頁面再並行抓取
+            pages = [self._fetch_search_page(board, query, 1, timeout, error_log)]
+            last_page = min(max_pages, self.search_last_page(board, pages[0][1]))
+            others = range(2, last_page + 1)
+            if executor is None:
+                pages.extend(self._fetch_search_page(board, query, i, timeout, error_log) for i in others)
+            else:
+                pages.extend(executor.map(lambda i: self._fetch_search_page(board, query, i, timeout, error_log), others))
+            
+            rows = [row for page_rows, _ in pages for row in page_rows]
+            # PTT 的搜尋語法之外再於本地篩選一次，確保結果符合條件
+            if author:
+                rows = [row for row in rows if row['author'].lower() == author.lower()]
+            if recommend is not None:
+                rows = [row for row in rows if row['push_count'] >= recommend]
+            print(f"搜尋 {board} 板「{query}」，共 {len(rows)} 筆結果")
+            
+            articles = self.fetch_articles(rows, board, timeout, executor, error_log) if fetch_content else rows
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        
+        result = {'articles': articles, 'query': query, 'pages': len(pages)}
+        if error_log:
+            result['errors'] = error_log
+        return result
+
+    def _fetch_search_page(self, board, query, page, timeout, error_log):
+        """抓取並解析單一搜尋結果頁，回傳 (文章資訊列表, 頁面 HTML)；沒有結果或失敗時回傳空列表"""
+        page_url = f'{self.PTT_URL}/bbs/{board}/search?' + urlencode({'page': page, 'q': query})
+        print(f"爬取搜尋頁面: {page_url}")
+        try:
+            resp = session_manager.get().get(page_url, timeout=timeout, verify=VERIFY)
+            if resp.status_code == 404:
+                # 超出結果範圍或沒有符合的文章
+                return [], ''
+            if resp.status_code != 200:
+                raise Exception(f"頁面請求失敗，狀態碼: {resp.status_code}")
+            return self.parse_index_rows(resp.text, error_log), resp.text
+        except Exception as e:
+            error_msg = f"爬取搜尋頁面 {page_url} 時出錯: {e}"
+            print(error_msg)
+            error_log.append(error_msg)
+            return [], ''
+
+    @staticmethod
+    def search_last_page(board, content):
+        """從搜尋結果頁的分頁連結取得總頁數（「最舊」一頁的頁碼），找不到時回傳 1"""
+        pages = re.findall(r'href="/bbs/' + re.escape(board) + r'/search\?page=(\d+)', content)
+        return max([int(page) for page in pages] + [1])
+
+    def _fetch_article(self, article_url, article_id, board, timeout):
+        """抓取並解析單篇文章，回傳解析後的字典；無法取得時回傳錯誤字典"""
+        try:
+            return self.parse_record(article_url, article_id, board, timeout).to_dict()
+        except ArticleError as e:
+            return e.data
 
 
     # def parse_article(self, article_id, board, path='.'):
@@ -282,27 +1097,55 @@ class PttWebCrawler(object):
     #     self.store(filename, self.parse(link, article_id, board), 'w')
     #     return filename
     def parse_article(self, article_id, board):
-        link = self.PTT_URL + f'/bbs/{board}/{article_id}.html'
-        result = self.parse(link, article_id, board)
-        return json.loads(result)
+        if self.engine == 'async':
+            return self._run_async_engine('parse_article', 10, article_id, board)
+        try:
+            return self.parse_article_record(article_id, board).to_dict()
+        except ArticleError as e:
+            return e.data
 
+    def parse_article_record(self, article_id, board, timeout=3):
+        """
+        爬取特定文章並回傳 Article
+        
+        Raises:
+            ArticleError: 文章無法取得或解析，e.data 為與 parse() 相同格式的錯誤字典
+        """
+        link = self.PTT_URL + f'/bbs/{board}/{article_id}.html'
+        return self.parse_record(link, article_id, board, timeout)
 
     @staticmethod
     def parse(link, article_id, board, timeout=3):
-        print('Processing article:', article_id)
+        """爬取並解析文章，回傳 JSON 字串；需要結構化資料時請使用 parse_record"""
+        try:
+            return PttWebCrawler.parse_record(link, article_id, board, timeout).to_json()
+        except ArticleError as e:
+            return json.dumps(e.data, sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def parse_record(link, article_id, board, timeout=3):
+        """
+        爬取並解析文章，回傳 Article，不經過 JSON 字串
         
-        # 建立 Session 以保持 cookie
-        session = requests.Session()
-        session.cookies.set('over18', '1', domain='www.ptt.cc')
+        Raises:
+            ArticleError: 文章無法取得或解析，e.data 為與 parse() 相同格式的錯誤字典
+        """
+        html = PttWebCrawler.fetch_article_html(link, article_id, board, timeout)
+        return PttWebCrawler.parse_html_record(html, link, article_id, board)
+
+    @staticmethod
+    def fetch_article_html(link, article_id, board, timeout=3):
+        """
+        下載文章頁面（必要時通過年齡驗證），回傳 HTML 字串，不做解析
         
-        # 使用更完整的標頭
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        }
+        Raises:
+            ArticleError: 文章無法取得，e.data 為與 parse() 相同格式的錯誤字典
+        """
+        print('Processing article:', article_id)
+        
+        # 使用行程內共用的 Session（已設定 over18 cookie 與預設標頭）
+        session = session_manager.get()
+        headers = {}
         
         # 檢查是否在 Azure 環境中運行
         is_azure = 'AZURE_FUNCTIONS_ENVIRONMENT' in os.environ or 'WEBSITE_SITE_NAME' in os.environ
@@ -315,9 +1158,6 @@ class PttWebCrawler(object):
             # 修改請求標頭以增加成功率
             if 'Referer' not in headers:
                 headers['Referer'] = 'https://www.ptt.cc/bbs/' + board + '/index.html'
-                
-            # 配置 session
-            session.trust_env = False  # 不使用系統代理設定
             
             # 檢查代理配置
             proxy = os.environ.get('HTTP_PROXY') or os.environ.get('http_proxy')
@@ -343,14 +1183,13 @@ class PttWebCrawler(object):
                     if resp.status_code == 200:
                         break
                     print(f"請求失敗，狀態碼: {resp.status_code}")
-                    time.sleep(3)  # 失敗後等待一段時間再重試
+                    rate_limiter.backoff(link)  # 失敗後降低速率再重試
                 except Exception as e:
                     print(f"請求異常: {e}")
                     if retry == max_retries - 1:
                         raise
-                    time.sleep(3)
             else:  # 所有重試都失敗
-                return json.dumps({"error": "無法連接到 PTT 網站", "article_id": article_id}, sort_keys=True, ensure_ascii=False)
+                raise ArticleError({"error": "無法連接到 PTT 網站", "article_id": article_id})
         else:
             # 非 Azure 環境，使用正常請求
             resp = session.get(
@@ -362,7 +1201,7 @@ class PttWebCrawler(object):
         
         if resp.status_code != 200:
             print('invalid url:', resp.url)
-            return json.dumps({"error": "invalid url", "status_code": resp.status_code}, sort_keys=True, ensure_ascii=False)
+            raise ArticleError({"error": "invalid url", "status_code": resp.status_code})
         
         # 檢查是否需要年齡驗證
         if '您必須年滿十八歲才能瀏覽此網頁' in resp.text:
@@ -378,13 +1217,51 @@ class PttWebCrawler(object):
             # 再次獲取文章
             resp = session.get(url=link, headers=headers, verify=VERIFY, timeout=timeout)
             if resp.status_code != 200:
-                return json.dumps({"error": "age verification failed"}, sort_keys=True, ensure_ascii=False)
+                raise ArticleError({"error": "age verification failed"})
+        
+        return resp.text
+
+    @staticmethod
+    def parse_html(html, link, article_id, board, backend=None):
+        """
+        解析文章頁面的 HTML，不涉及任何網路請求，供同步與非同步引擎共用
+        
+        Args:
+            backend: 'lxml' 或 'bs4'，未指定時使用 PttWebCrawler.parser_backend
+            
+        Returns:
+            文章資料字典；找不到文章主體時回傳含 error 欄位的字典
+        """
+        try:
+            return PttWebCrawler.parse_html_record(html, link, article_id, board, backend).to_dict()
+        except ArticleError as e:
+            return e.data
+
+    @staticmethod
+    def parse_html_record(html, link, article_id, board, backend=None):
+        """
+        解析文章頁面的 HTML，回傳 Article
         
-        soup = BeautifulSoup(resp.text, 'html.parser')
+        Raises:
+            ArticleError: 找不到文章主體
+        """
+        backend = backend or PttWebCrawler.parser_backend
+        if backend == 'lxml' and 'lxml' in parsers.available_backends():
+            try:
+                return parsers.parse_article_lxml(html, link, article_id, board)
+            except ArticleError:
+                raise
+            except Exception as e:
+                print(f"lxml 解析失敗，改用 BeautifulSoup: {e}")
+        return PttWebCrawler._parse_html_bs4(html, link, article_id, board)
+
+    @staticmethod
+    def _parse_html_bs4(html, link, article_id, board):
+        soup = BeautifulSoup(html, 'html.parser')
         main_content = soup.find(id="main-content")
         
         if not main_content:
-            return json.dumps({"error": "main-content not found", "url": link}, sort_keys=True, ensure_ascii=False)
+            raise ArticleError({"error": "main-content not found", "url": link})
         metas = main_content.select('div.article-metaline')
         author = ''
         title = ''
@@ -405,27 +1282,9 @@ class PttWebCrawler(object):
         for push in pushes:
             push.extract()
 
-        try:
-            ip = main_content.find(string=re.compile(u'※ 發信站:'))
-            ip = re.search('[0-9]*\.[0-9]*\.[0-9]*\.[0-9]*', ip).group()
-        except:
-            ip = "None"
-
-        # 移除 '※ 發信站:' (starts with u'\u203b'), '◆ From:' (starts with u'\u25c6'), 空行及多餘空白
-        # 保留英數字, 中文及中文標點, 網址, 部分特殊符號
-        filtered = [ v for v in main_content.stripped_strings if v[0] not in [u'※', u'◆'] and v[:2] not in [u'--'] ]
-        expr = re.compile(u(r'[^\u4e00-\u9fa5\u3002\uff1b\uff0c\uff1a\u201c\u201d\uff08\uff09\u3001\uff1f\u300a\u300b\s\w:/-_.?~%()]'))
-        for i in range(len(filtered)):
-            filtered[i] = re.sub(expr, '', filtered[i])
-
-        filtered = [_f for _f in filtered if _f]  # remove empty strings
-        filtered = [x for x in filtered if article_id not in x]  # remove last line containing the url of the article
-        content = ' '.join(filtered)
-        content = re.sub(r'(\s)+', ' ', content)
-        # print 'content', content
+        ip = parsers.extract_ip(main_content.find(string=parsers.SIGNATURE_EXPR))
 
         # push messages
-        p, b, n = 0, 0, 0
         messages = []
         for push in pushes:
             if not push.find('span', 'push-tag'):
@@ -436,77 +1295,173 @@ class PttWebCrawler(object):
             push_content = push.find('span', 'push-content').strings
             push_content = ' '.join(push_content)[1:].strip(' \t\n\r')  # remove ':'
             push_ipdatetime = push.find('span', 'push-ipdatetime').string.strip(' \t\n\r')
-            messages.append( {'push_tag': push_tag, 'push_userid': push_userid, 'push_content': push_content, 'push_ipdatetime': push_ipdatetime} )
-            if push_tag == u'推':
-                p += 1
-            elif push_tag == u'噓':
-                b += 1
-            else:
-                n += 1
-
-        # count: 推噓文相抵後的數量; all: 推文總數
-        message_count = {'all': p+b+n, 'count': p-b, 'push': p, 'boo': b, "neutral": n}
-
-        # print 'msgs', messages
-        # print 'mscounts', message_count
-
-        # json data
-        data = {
-            'url': link,
-            'board': board,
-            'article_id': article_id,
-            'article_title': title,
-            'author': author,
-            'date': date,
-            'content': content,
-            'ip': ip,
-            'message_count': message_count,
-            'messages': messages
-        }
-        # print 'original:', d
-        return json.dumps(data, sort_keys=True, ensure_ascii=False)
+            messages.append((push_tag, push_userid, push_content, push_ipdatetime))
+
+        return parsers.build_article(link, board, article_id, title, author, date, ip,
+                                     list(main_content.stripped_strings), messages)
 
     @staticmethod
     def getLastPage(board, timeout=3):
-        # 建立 Session 以保持 cookie
-        session = requests.Session()
-        session.cookies.set('over18', '1', domain='www.ptt.cc')
+        try:
+            return PttWebCrawler.board_last_page(board, timeout)
+        except Exception as e:
+            print(f"獲取最後頁面時出錯: {e}")
+            return 1
+
+    @staticmethod
+    def board_last_page(board, timeout=10, headers=None):
+        """
+        取得看板最後一頁的頁碼，TTL 內直接使用快取，否則下載一次看板首頁並從中推算
         
-        # 使用更完整的標頭
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        }
+        Returns:
+            最後頁碼；看板首頁請求失敗時拋出例外
+        """
+        last_page = PttWebCrawler.cached_last_page(board)
+        if last_page is not None:
+            return last_page
         
-        try:
-            response = session.get(
-                url='https://www.ptt.cc/bbs/' + board + '/index.html',
-                headers=headers,
-                timeout=timeout,
-                verify=VERIFY
-            )
-            
-            if response.status_code != 200:
-                print(f"獲取最後頁面時失敗，狀態碼: {response.status_code}")
-                return 1
-            
-            content = response.content.decode('utf-8')
-            first_page = re.search(r'href="/bbs/' + board + '/index(\d+).html">&lsaquo;', content)
-            
+        # 使用行程內共用的 Session（已設定 over18 cookie 與預設標頭）
+        response = session_manager.get().get(
+            url=f'{PttWebCrawler.PTT_URL}/bbs/{board}/index.html',
+            headers=headers,
+            timeout=timeout,
+            verify=VERIFY
+        )
+        if response.status_code != 200:
+            raise Exception(f"訪問 {board} 板失敗，狀態碼: {response.status_code}")
+        
+        content = response.content.decode('utf-8')
+        return PttWebCrawler.remember_last_page(board, PttWebCrawler.last_page_from_html(board, content))
+
+    @staticmethod
+    def cached_last_page(board):
+        """回傳 TTL 內已知的看板最後頁碼，沒有時回傳 None"""
+        cached = PttWebCrawler._last_pages.get(board)
+        if cached is None or time.time() - cached[1] >= PttWebCrawler.board_ttl:
+            return None
+        return cached[0]
+
+    @staticmethod
+    def remember_last_page(board, last_page):
+        """記錄從看板首頁推算出的最後頁碼；推算失敗時的預設值 1 不列入快取"""
+        if last_page > 1:
+            PttWebCrawler._last_pages[board] = (last_page, time.time())
+        return last_page
+
+    @staticmethod
+    def last_page_from_html(board, content):
+        """從看板首頁 HTML 的「上頁」連結推算最後一頁的頁碼"""
+        first_page = re.search(r'href="/bbs/' + board + '/index(\d+).html">&lsaquo;', content)
+        
+        if first_page is None:
+            # 嘗試其他可能的模式
+            first_page = re.search(r'href="/bbs/' + board + '/index(\d+).html"', content)
             if first_page is None:
-                # 嘗試其他可能的模式
-                first_page = re.search(r'href="/bbs/' + board + '/index(\d+).html"', content)
-                if first_page is None:
-                    print(f"無法解析 {board} 板的最後頁面，使用默認值 1")
-                    return 1
+                print(f"無法解析 {board} 板的最後頁面，使用默認值 1")
+                return 1
+        
+        return int(first_page.group(1)) + 1
+
+    @staticmethod
+    def parse_index_rows(html, error_log=None):
+        """
+        解析看板列表頁 (index{N}.html) 的 HTML，回傳每一列文章的資訊
+        
+        Args:
+            html: 列表頁的 HTML
+            error_log: 若提供，處理個別列表項目的錯誤訊息會附加到此列表
             
-            return int(first_page.group(1)) + 1
+        Returns:
+            文章資訊字典的列表，已刪除的文章其 url 與 article_id 為 None
+        """
+        try:
+            return parsers.parse_index_rows(html, PttWebCrawler.PTT_URL, error_log)
         except Exception as e:
-            print(f"獲取最後頁面時出錯: {e}")
-            return 1
+            print(f"串流解析列表頁失敗，改用 BeautifulSoup: {e}")
+            return PttWebCrawler._parse_index_rows_bs4(html, error_log)
+
+    @staticmethod
+    def _parse_index_rows_bs4(html, error_log=None):
+        soup = BeautifulSoup(html, 'html.parser')
+        article_divs = soup.select('div.r-ent')
+        rows = []
+        for div in article_divs:
+            try:
+                # 獲取文章連結
+                title_div = div.select_one('div.title')
+                if not title_div:
+                    continue
+                    
+                a_tag = title_div.select_one('a')
+                if not a_tag:
+                    # 可能是已刪除的文章，但我們仍然記錄標題
+                    title = title_div.text.strip()
+                    article_url = None
+                    article_id = None
+                else:
+                    href = a_tag.get('href')
+                    if not href or '/bbs/' not in href:
+                        continue
+                        
+                    # 文章標題
+                    title = a_tag.text.strip()
+                    
+                    # 完整的文章 URL
+                    article_url = PttWebCrawler.PTT_URL + href
+                    
+                    # 文章 ID
+                    article_id = href.split('/')[-1].replace('.html', '')
+                
+                # 作者和日期
+                meta_div = div.select_one('div.meta')
+                author = meta_div.select_one('div.author').text.strip() if meta_div and meta_div.select_one('div.author') else ''
+                date = meta_div.select_one('div.date').text.strip() if meta_div and meta_div.select_one('div.date') else ''
+                
+                # 推文數
+                push_count_div = div.select_one('div.nrec')
+                push_count_text = push_count_div.text.strip() if push_count_div else '0'
+                
+                # 解析推文數
+                push_count = parsers.parse_push_count(push_count_text)
+                
+                # 建立文章資訊字典
+                article_info = {
+                    'title': title,
+                    'url': article_url,
+                    'article_id': article_id,
+                    'author': author,
+                    'date': date,
+                    'push_count': push_count,
+                    'push_count_text': push_count_text
+                }
+                
+                rows.append(article_info)
+                
+            except Exception as e:
+                error_msg = f"處理文章列表項目時出錯: {e}"
+                print(error_msg)
+                if error_log is not None:
+                    error_log.append(error_msg)
+                continue
+        
+        return rows
+
+    @staticmethod
+    def write_jsonl(filename, records, mode='w'):
+        """
+        將文章逐筆寫成 JSON Lines，每寫一筆就 flush，爬取中斷時已寫入的資料不會遺失
+        
+        Returns:
+            一個字典，包含輸出檔名與寫入筆數
+        """
+        count = 0
+        with codecs.open(filename, mode, encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, sort_keys=True, ensure_ascii=False) + '\n')
+                f.flush()
+                count += 1
+        print(f"已寫入 {count} 筆資料到 {filename}")
+        return {'output': filename, 'count': count}
 
     @staticmethod
     def store(filename, data, mode):
@@ -518,7 +1473,7 @@ class PttWebCrawler(object):
         with codecs.open(filename, mode, encoding='utf-8') as f:
             return json.load(f)
 
-    def parse_list_articles(self, start, end, board, timeout=10):
+    def parse_list_articles(self, start, end, board, timeout=10, article_filter=None):
         """
         只爬取指定板塊中的文章列表資訊，不進入文章頁面爬取內容
         
@@ -527,15 +1482,37 @@ class PttWebCrawler(object):
             end: 結束頁碼
             board: 板塊名稱
             timeout: 請求超時時間
+            article_filter: 若提供 ArticleFilter，只保留符合條件的列表項目
             
         Returns:
             一個字典，包含爬取到的文章列表資訊
         """
-        articles = []
+        if self.engine == 'async':
+            return self._run_async_engine('parse_list_articles', timeout, start, end, board,
+                                          article_filter=article_filter)
+        
         error_log = []
+        articles = list(self.iter_list_articles(start, end, board, timeout, error_log, article_filter=article_filter))
+        print(f"總共爬取了 {len(articles)} 篇文章列表資訊，目前速率: {rate_limiter.current_rate(self.PTT_URL):.2f} 次/秒")
+        result = {'articles': articles}
+        if error_log:
+            result['errors'] = error_log
+        return result
+
+    def iter_list_articles(self, start, end, board, timeout=10, error_log=None, checkpoint=None, article_filter=None):
+        """
+        逐筆產生指定板塊的文章列表資訊，每解析完一頁就立即輸出
+        
+        Args:
+            error_log: 若提供，爬取過程中的錯誤訊息會附加到此列表
+            checkpoint: 若提供 Checkpoint，已完成的列表頁與文章會被略過
+            article_filter: 若提供 ArticleFilter，只保留符合條件的列表項目
+        """
+        if error_log is None:
+            error_log = []
         
-        # 建立 Session 保持 cookie
-        session = requests.Session()
+        # 使用行程內共用的 Session
+        session = session_manager.get()
         
         # 使用更完整的瀏覽器標頭，避免被反爬蟲機制識別
         headers = {
@@ -589,117 +1566,106 @@ class PttWebCrawler(object):
             max_retries = 1
             proxies = None
         
-        # 處理 cookie 的特殊邏輯
         try:
-            # 直接設定年齡驗證 cookie
-            session.cookies.set('over18', '1', domain='www.ptt.cc')
-            
-            # 直接訪問目標板塊
-            print(f"訪問 {board} 板")
-            board_url = f'{self.PTT_URL}/bbs/{board}/index.html'
-            
-            # 使用循環進行重試
-            for retry in range(max_retries):
-                try:
-                    resp = session.get(
-                        board_url,
-                        headers=headers,
-                        timeout=timeout,
-                        verify=VERIFY,
-                        allow_redirects=True,  # 允許重定向
-                        proxies=proxies
-                    )
-                    
-                    if resp.status_code == 200:
-                        break
-                    
-                    print(f"嘗試 {retry+1}/{max_retries} 失敗，狀態碼: {resp.status_code}")
-                    
-                    # 只有在 Azure 環境中才嘗試使用不同的請求方式
-                    if is_azure and retry < max_retries - 1:
-                        # 短暫延遲後再重試
-                        time.sleep(5)
+            # 同一看板在 TTL 內已知最大頁數時，不再重複下載看板首頁
+            max_page = self.cached_last_page(board)
+            if max_page is None:
+                # 直接訪問目標板塊
+                print(f"訪問 {board} 板")
+                board_url = f'{self.PTT_URL}/bbs/{board}/index.html'
+                
+                # 使用循環進行重試
+                for retry in range(max_retries):
+                    try:
+                        resp = session.get(
+                            board_url,
+                            headers=headers,
+                            timeout=timeout,
+                            verify=VERIFY,
+                            allow_redirects=True,  # 允許重定向
+                            proxies=proxies
+                        )
+                        
+                        if resp.status_code == 200:
+                            break
                         
-                        # 更換 User-Agent
-                        headers['User-Agent'] = random.choice(user_agents)
+                        print(f"嘗試 {retry+1}/{max_retries} 失敗，狀態碼: {resp.status_code}")
                         
-                        # 嘗試直接使用更簡單的標頭
-                        if retry == 1:
-                            # 簡化請求標頭
-                            simple_headers = {
-                                'User-Agent': headers['User-Agent'],
-                                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                            }
-                            headers = simple_headers
-                            print("使用簡化的請求標頭重試")
+                        # 只有在 Azure 環境中才嘗試使用不同的請求方式
+                        if is_azure and retry < max_retries - 1:
+                            # 降低速率後再重試
+                            rate_limiter.backoff(board_url)
+                            
+                            # 更換 User-Agent
+                            headers['User-Agent'] = random.choice(user_agents)
+                            
+                            # 嘗試直接使用更簡單的標頭
+                            if retry == 1:
+                                # 簡化請求標頭
+                                simple_headers = {
+                                    'User-Agent': headers['User-Agent'],
+                                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                                }
+                                headers = simple_headers
+                                print("使用簡化的請求標頭重試")
+                    
+                    except Exception as e:
+                        print(f"訪問嘗試 {retry+1}/{max_retries} 發生異常: {e}")
+                        if retry == max_retries - 1:
+                            raise
                 
-                except Exception as e:
-                    print(f"訪問嘗試 {retry+1}/{max_retries} 發生異常: {e}")
-                    if retry == max_retries - 1:
-                        raise
-                    time.sleep(5)
-            
-            # 檢查板塊是否存在
-            if resp.status_code != 200:
-                error_msg = f"訪問 {board} 板失敗，狀態碼: {resp.status_code}，可能板塊不存在或已被暫停"
-                print(error_msg)
-                error_log.append(error_msg)
-                return {'articles': [], 'errors': error_log}
-            
-            # 檢查是否需要年齡驗證（有些板塊會單獨需要）
-            if '您必須年滿十八歲才能瀏覽此網頁' in resp.text:
-                print(f"{board} 板需要年齡驗證，嘗試通過...")
-                resp = session.post(
-                    'https://www.ptt.cc/ask/over18',
-                    data={'from': f'/bbs/{board}/index.html', 'yes': 'yes'},
-                    headers=headers,
-                    timeout=timeout,
-                    verify=VERIFY
-                )
+                # 檢查板塊是否存在
                 if resp.status_code != 200:
-                    error_msg = f"板塊 {board} 年齡驗證失敗，狀態碼: {resp.status_code}"
+                    error_msg = f"訪問 {board} 板失敗，狀態碼: {resp.status_code}，可能板塊不存在或已被暫停"
                     print(error_msg)
                     error_log.append(error_msg)
-                    return {'articles': [], 'errors': error_log}
+                    return
                 
-                # 再次訪問板塊
-                resp = session.get(
-                    board_url,
-                    headers=headers,
-                    timeout=timeout,
-                    verify=VERIFY
-                )
+                # 檢查是否需要年齡驗證（有些板塊會單獨需要）
+                if '您必須年滿十八歲才能瀏覽此網頁' in resp.text:
+                    print(f"{board} 板需要年齡驗證，嘗試通過...")
+                    resp = session.post(
+                        'https://www.ptt.cc/ask/over18',
+                        data={'from': f'/bbs/{board}/index.html', 'yes': 'yes'},
+                        headers=headers,
+                        timeout=timeout,
+                        verify=VERIFY
+                    )
+                    if resp.status_code != 200:
+                        error_msg = f"板塊 {board} 年齡驗證失敗，狀態碼: {resp.status_code}"
+                        print(error_msg)
+                        error_log.append(error_msg)
+                        return
+                    
+                    # 再次訪問板塊
+                    resp = session.get(
+                        board_url,
+                        headers=headers,
+                        timeout=timeout,
+                        verify=VERIFY
+                    )
+                max_page = self.remember_last_page(board, self.last_page_from_html(board, resp.text))
+            print(f"{board} 板最大頁數: {max_page}")
             
-            # 獲取最大頁數
-            try:
-                max_page = self.getLastPage(board, timeout)
-                print(f"{board} 板最大頁數: {max_page}")
-                
-                # 確保頁碼在有效範圍內
-                if start <= 0:
-                    start = 1
-                    print(f"起始頁碼小於等於0，已自動調整為: {start}")
-                
-                if end > max_page:
-                    end = max_page
-                    print(f"結束頁碼超過最大頁數，已自動調整為: {end}")
-            except Exception as e:
-                error_msg = f"獲取最大頁數時出錯: {e}"
-                print(error_msg)
-                error_log.append(error_msg)
-                # 如果無法獲取最大頁數，使用合理的預設值
-                if end > 10000:
-                    end = 10000  # 設定一個合理的上限
-                    print(f"無法獲取最大頁數，設定結束頁碼為: {end}")
+            # 確保頁碼在有效範圍內
+            if start <= 0:
+                start = 1
+                print(f"起始頁碼小於等於0，已自動調整為: {start}")
+            
+            if end > max_page:
+                end = max_page
+                print(f"結束頁碼超過最大頁數，已自動調整為: {end}")
                 
         except Exception as e:
             error_msg = f"初始化連接時出錯: {e}"
             print(error_msg)
             error_log.append(error_msg)
-            return {'articles': [], 'errors': error_log}
+            return
         
         # 開始爬取頁面
         for i in range(start, end + 1):
+            if checkpoint is not None and checkpoint.page_done(i):
+                continue
             page_url = f'{self.PTT_URL}/bbs/{board}/index{i}.html'
             print(f"爬取頁面: {page_url}")
             
@@ -717,133 +1683,90 @@ class PttWebCrawler(object):
                     error_log.append(error_msg)
                     continue
                 
-                # 解析 HTML
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                
-                # 查找所有文章區塊
+                # 解析列表頁中的文章區塊
                 try:
-                    article_divs = soup.select('div.r-ent')
-                    print(f"找到 {len(article_divs)} 個文章區塊")
+                    rows = self.parse_index_rows(resp.text, error_log)
+                    print(f"找到 {len(rows)} 個文章區塊")
                     
                     # 如果找不到文章區塊，可能是頁面結構變化或反爬蟲機制
-                    if len(article_divs) == 0:
-                        # 嘗試其他選擇器
-                        article_divs = soup.find_all("div", class_="r-ent")
-                        print(f"使用 find_all 方法找到 {len(article_divs)} 個文章區塊")
+                    if len(rows) == 0:
+                        error_msg = f"在頁面 {page_url} 中找不到文章區塊，可能被反爬蟲機制阻擋或頁面結構變化"
+                        print(error_msg)
+                        error_log.append(error_msg)
                         
-                        if len(article_divs) == 0:
-                            error_msg = f"在頁面 {page_url} 中找不到文章區塊，可能被反爬蟲機制阻擋或頁面結構變化"
-                            print(error_msg)
-                            error_log.append(error_msg)
-                            
-                            # 保存頁面內容以便調試
-                            debug_file = f"debug_{board}_{i}.html"
-                            with open(debug_file, 'w', encoding='utf-8') as f:
-                                f.write(resp.text)
-                            print(f"已將頁面內容保存到 {debug_file} 以便調試")
-                            
-                            # 嘗試檢查頁面內容中是否有特定提示
-                            page_content = resp.text.lower()
-                            if 'over18' in page_content or '年滿十八歲' in page_content:
-                                print("疑似年齡驗證問題，重新嘗試設定 cookie")
-                                # 重新設定 cookie 後重試
-                                session.cookies.clear()
-                                session.cookies.set('over18', '1', domain='www.ptt.cc')
-                                # 不重試，繼續下一頁
-                            continue
+                        # 保存頁面內容以便調試
+                        debug_file = f"debug_{board}_{i}.html"
+                        with open(debug_file, 'w', encoding='utf-8') as f:
+                            f.write(resp.text)
+                        print(f"已將頁面內容保存到 {debug_file} 以便調試")
+                        
+                        # 嘗試檢查頁面內容中是否有特定提示
+                        page_content = resp.text.lower()
+                        if 'over18' in page_content or '年滿十八歲' in page_content:
+                            print("疑似年齡驗證問題，重新嘗試設定 cookie")
+                            # 重新設定 cookie 後重試
+                            session.cookies.clear()
+                            session.cookies.set('over18', '1', domain='www.ptt.cc')
+                            # 不重試，繼續下一頁
+                        continue
                 except Exception as e:
                     error_msg = f"解析 HTML 時發生錯誤: {e}"
                     print(error_msg)
                     error_log.append(error_msg)
                     continue
                 
-                for div in article_divs:
-                    try:
-                        # 獲取文章連結
-                        title_div = div.select_one('div.title')
-                        if not title_div:
-                            continue
-                            
-                        a_tag = title_div.select_one('a')
-                        if not a_tag:
-                            # 可能是已刪除的文章，但我們仍然記錄標題
-                            title = title_div.text.strip()
-                            article_url = None
-                            article_id = None
-                        else:
-                            href = a_tag.get('href')
-                            if not href or '/bbs/' not in href:
-                                continue
-                                
-                            # 文章標題
-                            title = a_tag.text.strip()
-                            
-                            # 完整的文章 URL
-                            article_url = self.PTT_URL + href
-                            
-                            # 文章 ID
-                            article_id = href.split('/')[-1].replace('.html', '')
-                        
-                        # 作者和日期
-                        meta_div = div.select_one('div.meta')
-                        author = meta_div.select_one('div.author').text.strip() if meta_div and meta_div.select_one('div.author') else ''
-                        date = meta_div.select_one('div.date').text.strip() if meta_div and meta_div.select_one('div.date') else ''
-                        
-                        # 推文數
-                        push_count_div = div.select_one('div.nrec')
-                        push_count_text = push_count_div.text.strip() if push_count_div else '0'
-                        
-                        # 解析推文數
-                        if push_count_text == '爆':
-                            push_count = 100
-                        elif push_count_text.startswith('X'):
-                            if push_count_text == 'XX':
-                                push_count = -100
-                            else:
-                                try:
-                                    push_count = -int(push_count_text[1:]) if push_count_text[1:].isdigit() else 0
-                                except:
-                                    push_count = 0
-                        else:
-                            try:
-                                push_count = int(push_count_text) if push_count_text.isdigit() else 0
-                            except:
-                                push_count = 0
-                        
-                        # 建立文章資訊字典
-                        article_info = {
-                            'title': title,
-                            'url': article_url,
-                            'article_id': article_id,
-                            'author': author,
-                            'date': date,
-                            'push_count': push_count,
-                            'push_count_text': push_count_text
-                        }
-                        
-                        articles.append(article_info)
-                        
-                    except Exception as e:
-                        error_msg = f"處理文章列表項目時出錯: {e}"
-                        print(error_msg)
-                        error_log.append(error_msg)
-                        continue
-                
-                # 頁面之間的延遲，隨機化以避免被識別為爬蟲
-                sleep_time = 0.5 + random.random() * 1.5  # 0.5 到 2 秒之間
-                time.sleep(sleep_time)
+                if article_filter is not None:
+                    rows = article_filter.filter_rows(rows)
+                if checkpoint is not None:
+                    rows = checkpoint.pending_rows(i, rows)
+                for row in rows:
+                    yield row
                 
             except Exception as e:
                 error_msg = f"爬取頁面 {page_url} 時出錯: {e}"
                 print(error_msg)
                 error_log.append(error_msg)
                 continue
-                
-        print(f"總共爬取了 {len(articles)} 篇文章列表資訊")
-        result = {'articles': articles}
-        if error_log:
-            result['errors'] = error_log
-        return result
+
+    def _run_async_engine(self, method, timeout, *args, **kwargs):
+        """在新的事件迴圈中以非同步引擎執行指定方法，供同步介面使用"""
+        from PttWebCrawler.async_engine import AsyncCrawlEngine
+
+        async def runner():
+            async with AsyncCrawlEngine(per_host_limit=self.per_host_limit, timeout=timeout) as engine:
+                return await getattr(engine, method)(*args, **kwargs)
+
+        return asyncio.run(runner())
+
+    def _get_async_engine(self, timeout):
+        # 非同步介面在同一個事件迴圈內重複使用引擎與其連線池
+        if self._async_engine is None:
+            from PttWebCrawler.async_engine import AsyncCrawlEngine
+            self._async_engine = AsyncCrawlEngine(per_host_limit=self.per_host_limit, timeout=timeout)
+        return self._async_engine
+
+    async def aparse_articles(self, start, end, board, timeout=10, article_filter=None):
+        """parse_articles 的非同步版本，可直接在 async 網頁框架中 await"""
+        return await self._get_async_engine(timeout).parse_articles(start, end, board, article_filter=article_filter)
+
+    async def aparse_list_articles(self, start, end, board, timeout=10, article_filter=None):
+        """parse_list_articles 的非同步版本"""
+        return await self._get_async_engine(timeout).parse_list_articles(start, end, board,
+                                                                          article_filter=article_filter)
+
+    async def aparse_article(self, article_id, board, timeout=10):
+        """parse_article 的非同步版本"""
+        return await self._get_async_engine(timeout).parse_article(article_id, board)
+
+    async def agetLastPage(self, board, timeout=10):
+        """getLastPage 的非同步版本"""
+        return await self._get_async_engine(timeout).get_last_page(board)
+
+    async def aclose(self):
+        """關閉非同步介面使用的連線池"""
+        if self._async_engine is not None:
+            await self._async_engine.close()
+            self._async_engine = None
 
 if __name__ == '__main__':
     c = PttWebCrawler()
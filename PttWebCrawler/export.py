@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+以欄式格式 (Parquet / Arrow IPC) 匯出文章與推文
+
+輸出兩個資料表：articles 每篇文章一列，messages 將推文攤平成每則一列，並以
+article_id 對應文章。board、author、push_tag 等重複值很多的欄位使用
+dictionary 編碼。可作為爬蟲的輸出端，也可將既有的 JSON / JSONL 檔轉檔：
+    python -m PttWebCrawler.export OUTPUT_DIR Gossiping-1-10.json more.jsonl
+"""
+
+import os
+import argparse
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from PttWebCrawler.parsers import article_timestamp
+from PttWebCrawler.storage import load_articles
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def _schemas():
+    text = pa.string()
+    category = pa.dictionary(pa.int32(), pa.string())
+    articles = pa.schema([
+        ('board', category),
+        ('article_id', text),
+        ('url', text),
+        ('title', text),
+        ('author', category),
+        ('date', text),
+        ('timestamp', pa.int64()),
+        ('content', text),
+        ('ip', text),
+        ('push_count', pa.int32()),
+        ('push', pa.int32()),
+        ('boo', pa.int32()),
+        ('neutral', pa.int32()),
+        ('message_total', pa.int32()),
+    ])
+    messages = pa.schema([
+        ('board', category),
+        ('article_id', text),
+        ('seq', pa.int32()),
+        ('push_tag', category),
+        ('push_userid', category),
+        ('push_content', text),
+        ('push_ipdatetime', text),
+    ])
+    return articles, messages
+
+
+class ColumnarExporter(object):
+    """
+    將文章字典分批寫成 articles 與 messages 兩個欄式檔案
+
+    Args:
+        directory: 輸出目錄，產生 articles.<ext> 與 messages.<ext>
+        format: 'parquet' 或 'arrow'（Arrow IPC 檔案格式）
+        batch_size: 每累積多少篇文章寫出一個 record batch
+    """
+
+    def __init__(self, directory, format='parquet', batch_size=5000):
+        if pa is None:
+            raise ImportError("欄式匯出需要 pyarrow，請先執行 pip install pyarrow")
+        if format not in FORMATS:
+            raise ValueError(f"format 必須是 {', '.join(FORMATS)} 其中之一")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.batch_size = batch_size
+        self.article_schema, self.message_schema = _schemas()
+        self._articles = self._empty(self.article_schema)
+        self._messages = self._empty(self.message_schema)
+        self._pending = 0
+        self.article_count = 0
+        self.message_count = 0
+        self._writers = {
+            'articles': self._open('articles', self.article_schema),
+            'messages': self._open('messages', self.message_schema),
+        }
+
+    @staticmethod
+    def _empty(schema):
+        return {name: [] for name in schema.names}
+
+    def path(self, table):
+        return os.path.join(self.directory, table + FORMATS[self.format])
+
+    def _open(self, table, schema):
+        if self.format == 'parquet':
+            return pq.ParquetWriter(self.path(table), schema)
+        return pa.ipc.new_file(self.path(table), schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, article, board=None):
+        """
+        加入一篇文章；沒有文章 ID 或解析失敗的項目會被略過，回傳是否加入
+
+        Args:
+            board: 文章沒有 board 欄位時（例如列表資訊）使用的板名
+        """
+        article_id = article.get('article_id')
+        if not article_id or 'error' in article:
+            return False
+        board = article.get('board') or board
+        message_count = article.get('message_count') or {}
+        columns = self._articles
+        columns['board'].append(board)
+        columns['article_id'].append(article_id)
+        columns['url'].append(article.get('url'))
+        columns['title'].append(article.get('article_title') or article.get('title'))
+        columns['author'].append(article.get('author'))
+        columns['date'].append(article.get('date'))
+        columns['timestamp'].append(article_timestamp(article_id))
+        columns['content'].append(article.get('content'))
+        columns['ip'].append(article.get('ip'))
+        columns['push_count'].append(message_count.get('count', article.get('push_count')))
+        columns['push'].append(message_count.get('push'))
+        columns['boo'].append(message_count.get('boo'))
+        columns['neutral'].append(message_count.get('neutral'))
+        columns['message_total'].append(message_count.get('all'))
+
+        columns = self._messages
+        for seq, message in enumerate(article.get('messages') or []):
+            columns['board'].append(board)
+            columns['article_id'].append(article_id)
+            columns['seq'].append(seq)
+            columns['push_tag'].append(message.get('push_tag'))
+            columns['push_userid'].append(message.get('push_userid'))
+            columns['push_content'].append(message.get('push_content'))
+            columns['push_ipdatetime'].append(message.get('push_ipdatetime'))
+
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+        return True
+
+    def iter_write(self, records, board=None):
+        """逐筆轉交 records，同時寫入欄式檔案，可串接在其他輸出之前"""
+        for record in records:
+            self.add(record, board)
+            yield record
+
+    def write(self, records, board=None):
+        """寫入所有 records，回傳加入的文章數"""
+        return sum(1 for record in records if self.add(record, board))
+
+    def flush(self):
+        if not self._pending:
+            return
+        for table, schema, columns in (('articles', self.article_schema, self._articles),
+                                       ('messages', self.message_schema, self._messages)):
+            if columns[schema.names[0]]:
+                batch = pa.record_batch([pa.array(columns[name], type=schema.field(name).type) for name in schema.names],
+                                        schema=schema)
+                if self.format == 'parquet':
+                    self._writers[table].write_table(pa.Table.from_batches([batch]))
+                else:
+                    self._writers[table].write_batch(batch)
+        self.article_count += len(self._articles['article_id'])
+        self.message_count += len(self._messages['article_id'])
+        self._articles = self._empty(self.article_schema)
+        self._messages = self._empty(self.message_schema)
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+
+
+def main(cmdline=None):
+    parser = argparse.ArgumentParser(description='將爬蟲輸出的 JSON / JSONL 檔轉成 Parquet 或 Arrow 欄式檔案')
+    parser.add_argument('output', metavar='OUTPUT_DIR', help='輸出目錄')
+    parser.add_argument('files', metavar='FILE', nargs='+', help='要轉換的 JSON 或 JSONL 檔案')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='parquet', help='輸出格式（預設 parquet）')
+    args = parser.parse_args(cmdline)
+
+    with ColumnarExporter(args.output, args.format) as exporter:
+        for path in args.files:
+            exporter.write(load_articles(path))
+    print(f"已匯出 {exporter.article_count} 篇文章、{exporter.message_count} 則推文到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+抓取文章前的過濾條件
+
+文章 ID（例如 M.1409529482.A.9D3）中含有發文的 Unix time，因此不必下載文章
+就能判斷是否落在時間範圍內。列表頁解析完後先以 ArticleFilter 過濾，範圍外或
+不在允許清單、位於排除清單的文章不會發出任何請求。
+"""
+
+import json
+import codecs
+
+from PttWebCrawler.parsers import article_timestamp, parse_time
+
+
+def load_article_ids(path):
+    """
+    讀取文章 ID 清單
+
+    一般文字檔每行一個 ID（空行與 # 開頭的行會被略過）；.jsonl 檔（例如先前
+    爬取的輸出）則取每筆資料的 article_id。
+    """
+    ids = set()
+    with codecs.open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith('.jsonl'):
+                article_id = json.loads(line).get('article_id')
+                if article_id:
+                    ids.add(article_id)
+            else:
+                ids.add(line)
+    return ids
+
+
+class ArticleFilter(object):
+    """
+    依文章 ID 決定是否抓取
+
+    Args:
+        since, until: 發文時間範圍 [since, until)，Unix time 或 parse_time 接受的日期字串
+        allow: 只抓取這些文章 ID
+        deny: 不抓取這些文章 ID
+
+    無法從 ID 判斷時間的文章一律保留；沒有 ID 的列表項目（已刪除文章）只在
+    未指定時間範圍與允許清單時保留。
+    """
+
+    def __init__(self, since=None, until=None, allow=None, deny=None):
+        self.since = parse_time(since) if since is not None else None
+        self.until = parse_time(until) if until is not None else None
+        self.allow = set(allow) if allow is not None else None
+        self.deny = set(deny) if deny is not None else set()
+        self.skipped = 0
+
+    def accepts(self, article_id):
+        if not article_id:
+            return self.since is None and self.until is None and self.allow is None
+        if article_id in self.deny:
+            return False
+        if self.allow is not None and article_id not in self.allow:
+            return False
+        timestamp = article_timestamp(article_id)
+        if timestamp is None:
+            return True
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.until is not None and timestamp >= self.until:
+            return False
+        return True
+
+    def filter_rows(self, rows):
+        """過濾 parse_index_rows 回傳的列表項目，並累計略過的數量"""
+        kept = [row for row in rows if self.accepts(row['article_id'])]
+        skipped = len(rows) - len(kept)
+        if skipped:
+            self.skipped += skipped
+            print(f"略過 {skipped} 篇時間範圍或文章清單以外的文章")
+        return kept
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+背景爬取工作與 SQLite 狀態紀錄
+
+長範圍的爬取改由本機執行緒池在背景執行，API 只負責建立工作與查詢進度。
+工作狀態與結果都寫入 SQLite，重新啟動後仍可查詢，未完成的工作會從
+已完成的頁數繼續。
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PttWebCrawler.crawler import PttWebCrawler
+from PttWebCrawler.shards import default_owner
+
+DEFAULT_JOBS_DB = os.environ.get('PTT_JOBS_DB', 'ptt_jobs.sqlite')
+
+JOB_MODES = ('articles', 'list')
+
+# 工作的擁有者超過這個秒數沒有更新心跳，視為原本的行程已中止
+STALE_SECONDS = 120
+
+# 每個工作只保留最近的錯誤訊息，總數記錄在 error_count
+MAX_ERRORS = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    board TEXT NOT NULL,
+    start_page INTEGER NOT NULL,
+    end_page INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER NOT NULL DEFAULT 0,
+    article_count INTEGER NOT NULL DEFAULT 0,
+    errors TEXT NOT NULL DEFAULT '[]',
+    error_count INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+'''
+
+
+class JobStore(object):
+    """以 SQLite 保存工作狀態與結果，每次操作使用獨立連線以便跨執行緒使用"""
+
+    def __init__(self, path=DEFAULT_JOBS_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            # 舊版資料庫沒有 owner 與 error_count 欄位
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            if 'error_count' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN error_count INTEGER NOT NULL DEFAULT 0')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, board, start, end, mode, owner=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, board, start_page, end_page, mode, status, owner, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, board, start, end, mode, 'queued', owner, now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['errors'] = json.loads(job['errors'])
+        return job
+
+    def update(self, job_id, owner=None, **fields):
+        """
+        更新工作欄位
+
+        Args:
+            owner: 若提供，只在工作仍屬於 owner 時更新
+
+        Returns:
+            是否有更新到工作
+        """
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        sql = f'UPDATE jobs SET {columns} WHERE id = ?'
+        params = list(fields.values()) + [job_id]
+        if owner is not None:
+            sql += ' AND owner = ?'
+            params.append(owner)
+        with self._connect() as conn:
+            cursor = conn.execute(sql, params)
+        return cursor.rowcount == 1
+
+    def add_results(self, job_id, records, pages_done, errors, owner=None):
+        """
+        寫入一頁的結果並同步更新進度，兩者在同一個交易中完成
+
+        Args:
+            errors: 這一頁新增的錯誤訊息
+            owner: 若提供，工作已被其他行程接手時不寫入任何資料
+
+        Returns:
+            是否寫入成功
+        """
+        now = time.time()
+        sql = 'UPDATE jobs SET pages_done = ?, article_count = article_count + ?, updated_at = ? WHERE id = ?'
+        params = [pages_done, len(records), now, job_id]
+        if owner is not None:
+            sql += ' AND owner = ?'
+            params.append(owner)
+        with self._connect() as conn:
+            # 先更新進度取得寫入鎖並確認擁有者，再依目前筆數編號結果
+            if conn.execute(sql, params).rowcount != 1:
+                conn.rollback()
+                return False
+            self._append_errors(conn, job_id, errors)
+            seq = conn.execute('SELECT COUNT(*) FROM job_results WHERE job_id = ?', (job_id,)).fetchone()[0]
+            conn.executemany(
+                'INSERT INTO job_results (job_id, seq, data) VALUES (?, ?, ?)',
+                [(job_id, seq + i, json.dumps(record, ensure_ascii=False)) for i, record in enumerate(records)]
+            )
+        return True
+
+    def add_errors(self, job_id, errors, owner=None):
+        """
+        記錄工作的錯誤訊息，只保留最近 MAX_ERRORS 則
+
+        Returns:
+            是否有更新到工作
+        """
+        sql = 'UPDATE jobs SET updated_at = ? WHERE id = ?'
+        params = [time.time(), job_id]
+        if owner is not None:
+            sql += ' AND owner = ?'
+            params.append(owner)
+        with self._connect() as conn:
+            if conn.execute(sql, params).rowcount != 1:
+                conn.rollback()
+                return False
+            self._append_errors(conn, job_id, errors)
+        return True
+
+    @staticmethod
+    def _append_errors(conn, job_id, errors):
+        if not errors:
+            return
+        row = conn.execute('SELECT errors FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        kept = (json.loads(row['errors']) + list(errors))[-MAX_ERRORS:]
+        conn.execute(
+            'UPDATE jobs SET errors = ?, error_count = error_count + ? WHERE id = ?',
+            (json.dumps(kept, ensure_ascii=False), len(errors), job_id)
+        )
+
+    def heartbeat(self, owner):
+        """更新 owner 所有未完成工作的 updated_at，回傳更新的工作數"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time(), owner)
+            )
+        return cursor.rowcount
+
+    def results(self, job_id, offset=0, limit=100):
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT data FROM job_results WHERE job_id = ? ORDER BY seq LIMIT ? OFFSET ?',
+                (job_id, limit, offset)
+            ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def claim_stale(self, owner, stale_seconds=STALE_SECONDS):
+        """
+        認領原本的行程已中止、仍未完成的工作，回傳成功認領的工作 ID
+
+        存活的 JobManager 會定期更新自己所有工作（包含還在執行緒池中排隊的工作）
+        的心跳，因此只有擁有者停止心跳超過 stale_seconds 的工作會被認領。
+        認領後擁有者改為 owner，原本的行程即使恢復也無法再寫入結果。
+        """
+        claimed = []
+        threshold = time.time() - stale_seconds
+        with self._connect() as conn:
+            candidates = conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND updated_at < ?", (threshold,)
+            ).fetchall()
+            for row in candidates:
+                # 以 updated_at 作為條件更新，避免多個行程同時認領同一個工作
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = ?, updated_at = ? "
+                    "WHERE id = ? AND status IN ('queued', 'running') AND updated_at < ?",
+                    (owner, time.time(), row['id'], threshold)
+                )
+                if cursor.rowcount:
+                    claimed.append(row['id'])
+        return claimed
+
+
+class JobManager(object):
+    """
+    以本機執行緒池執行爬取工作
+
+    Args:
+        store: JobStore
+        max_workers: 同時執行的工作數量
+        workers: 每個工作抓取文章時使用的執行緒數量
+        heartbeat_seconds: 更新工作心跳的間隔，須小於 STALE_SECONDS
+
+    每個 JobManager 有唯一的擁有者名稱，並以背景執行緒定期更新自己所有未完成
+    工作的心跳，其他行程不會接手仍在執行或排隊中的工作。
+    """
+
+    def __init__(self, store, max_workers=2, workers=4, heartbeat_seconds=STALE_SECONDS / 3):
+        self.store = store
+        self.workers = workers
+        self.owner = f'{default_owner()}-{uuid.uuid4().hex[:8]}'
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.heartbeat_seconds = heartbeat_seconds
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stopped.wait(self.heartbeat_seconds):
+            try:
+                self.store.heartbeat(self.owner)
+            except sqlite3.Error as e:
+                print(f"更新工作心跳時出錯: {e}")
+
+    def shutdown(self, wait=True):
+        """停止接受工作並結束心跳"""
+        self.executor.shutdown(wait=wait)
+        self._stopped.set()
+
+    def submit(self, board, start, end, mode='articles'):
+        if mode not in JOB_MODES:
+            raise ValueError(f"mode 必須是 {', '.join(JOB_MODES)} 其中之一")
+        job_id = self.store.create(board, start, end, mode, owner=self.owner)
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def resume_stale(self):
+        """重新排程中斷的工作，從已完成的頁數繼續"""
+        job_ids = self.store.claim_stale(self.owner)
+        for job_id in job_ids:
+            self.executor.submit(self._run, job_id)
+        return job_ids
+
+    def _run(self, job_id):
+        """
+        逐頁執行工作，每完成一頁就寫入結果與進度，中斷後可由 pages_done 繼續
+
+        工作已被其他行程接手時立即停止，不再寫入任何結果。
+        """
+        job = self.store.get(job_id)
+        if job is None or job['owner'] != self.owner:
+            return
+        crawler = PttWebCrawler(as_lib=True)
+        try:
+            start = max(1, job['start_page'])
+            end = job['end_page']
+            # getLastPage 失敗時回傳 1，會讓工作以 0 筆結果完成；改為拋出例外讓工作失敗
+            last_page = crawler.board_last_page(job['board'])
+            if end == -1 or end > last_page:
+                end = last_page
+            pages_total = max(0, end - start + 1)
+            if not self.store.update(job_id, owner=self.owner, status='running', pages_total=pages_total):
+                return
+
+            executor = ThreadPoolExecutor(max_workers=self.workers) if job['mode'] == 'articles' and self.workers > 1 else None
+            try:
+                for done in range(job['pages_done'], pages_total):
+                    index = start + done
+                    errors = []
+                    try:
+                        rows, _ = crawler.fetch_index_rows(job['board'], index)
+                        if job['mode'] == 'articles':
+                            records = crawler.fetch_articles(rows, job['board'], executor=executor, error_log=errors)
+                        else:
+                            records = rows
+                    except Exception as e:
+                        errors.append(f"爬取頁面 {index} 時出錯: {e}")
+                        records = []
+                    if not self.store.add_results(job_id, records, done + 1, errors, owner=self.owner):
+                        print(f"工作 {job_id} 已被其他行程接手，停止執行")
+                        return
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self.store.update(job_id, owner=self.owner, status='finished')
+        except Exception as e:
+            self.store.add_errors(job_id, [f"工作執行失敗: {e}"], owner=self.owner)
+            self.store.update(job_id, owner=self.owner, status='failed')
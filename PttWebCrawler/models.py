@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+文章解析結果的型別
+
+Article、PushMessage 與 MessageCount 只保存欄位本身（以 __slots__ 節省記憶體），
+需要時才以 to_dict / to_json 轉成與 parse() 相同格式的字典或 JSON 字串，
+避免在函式之間傳遞時反覆序列化。
+"""
+
+import json
+from dataclasses import dataclass
+
+
+class ArticleError(Exception):
+    """
+    文章無法取得或解析
+
+    Attributes:
+        data: 與 parse() 相同格式的錯誤字典，例如 {"error": "invalid url", "status_code": 404}
+    """
+
+    def __init__(self, data):
+        Exception.__init__(self, data.get('error'))
+        self.data = data
+
+
+@dataclass
+class PushMessage(object):
+    __slots__ = ('push_tag', 'push_userid', 'push_content', 'push_ipdatetime')
+
+    push_tag: str
+    push_userid: str
+    push_content: str
+    push_ipdatetime: str
+
+    def to_dict(self):
+        return {
+            'push_tag': self.push_tag,
+            'push_userid': self.push_userid,
+            'push_content': self.push_content,
+            'push_ipdatetime': self.push_ipdatetime,
+        }
+
+
+@dataclass
+class MessageCount(object):
+    """推文統計；count 為推噓相抵後的數量，all 為推文總數"""
+    __slots__ = ('all', 'count', 'push', 'boo', 'neutral')
+
+    all: int
+    count: int
+    push: int
+    boo: int
+    neutral: int
+
+    def to_dict(self):
+        return {'all': self.all, 'count': self.count, 'push': self.push, 'boo': self.boo, 'neutral': self.neutral}
+
+
+@dataclass
+class Article(object):
+    __slots__ = ('url', 'board', 'article_id', 'article_title', 'author', 'date', 'content', 'ip',
+                 'message_count', 'messages')
+
+    url: str
+    board: str
+    article_id: str
+    article_title: str
+    author: str
+    date: str
+    content: str
+    ip: str
+    message_count: MessageCount
+    messages: list
+
+    def to_dict(self):
+        """轉成與 parse() 輸出相同的字典"""
+        return {
+            'url': self.url,
+            'board': self.board,
+            'article_id': self.article_id,
+            'article_title': self.article_title,
+            'author': self.author,
+            'date': self.date,
+            'content': self.content,
+            'ip': self.ip,
+            'message_count': self.message_count.to_dict(),
+            'messages': [message.to_dict() for message in self.messages],
+        }
+
+    def to_json(self):
+        """轉成與 parse() 回傳值相同的 JSON 字串"""
+        return json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False)
+
+    @classmethod
+    def from_dict(cls, data):
+        """由 parse() 格式的字典（例如讀回的 JSON 檔）建立 Article"""
+        message_count = data.get('message_count') or {}
+        return cls(
+            url=data.get('url'),
+            board=data.get('board'),
+            article_id=data.get('article_id'),
+            article_title=data.get('article_title'),
+            author=data.get('author'),
+            date=data.get('date'),
+            content=data.get('content'),
+            ip=data.get('ip'),
+            message_count=MessageCount(*(message_count.get(key, 0) for key in MessageCount.__slots__)),
+            messages=[PushMessage(*(message.get(key) for key in PushMessage.__slots__))
+                      for message in data.get('messages') or []],
+        )
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+PTT 頁面的 HTML 解析後端
+
+文章頁面預設使用以 C 實作的 lxml 解析，未安裝 lxml 時退回 BeautifulSoup；
+兩種後端都只負責取出原始欄位，再由 build_article 組成相同的 Article。
+看板列表頁則以單次串流掃描的 IndexPageParser 解析。
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from six import u
+
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    from HTMLParser import HTMLParser
+
+try:
+    from lxml import etree
+    import lxml.html
+except ImportError:
+    etree = None
+
+from PttWebCrawler.models import Article, ArticleError, MessageCount, PushMessage
+
+# 保留英數字, 中文及中文標點, 網址, 部分特殊符號
+CONTENT_EXPR = re.compile(u(r'[^\u4e00-\u9fa5\u3002\uff1b\uff0c\uff1a\u201c\u201d\uff08\uff09\u3001\uff1f\u300a\u300b\s\w:/-_.?~%()]'))
+IP_EXPR = re.compile('[0-9]*\.[0-9]*\.[0-9]*\.[0-9]*')
+SIGNATURE_EXPR = re.compile(u'※ 發信站:')
+PUSH_SPAN_CLASSES = ('push-tag', 'push-userid', 'push-content', 'push-ipdatetime')
+# 文章 ID 例如 M.1409529482.A.9D3，中間的數字為發文時間（Unix time）
+ARTICLE_ID_EXPR = re.compile(r'^[A-Z]\.(\d+)\.A\.[0-9A-Fa-f]+$')
+
+
+def article_timestamp(article_id):
+    """從文章 ID 取出發文的 Unix time，格式不符時回傳 None"""
+    match = ARTICLE_ID_EXPR.match(article_id or '')
+    return int(match.group(1)) if match else None
+
+
+# PTT 顯示的時間為台灣時間，未指定時區的日期以此解讀
+PTT_TIMEZONE = timezone(timedelta(hours=8))
+
+
+def parse_time(value):
+    """
+    將 Unix time 或 ISO 8601 日期時間（例如 2024-01-31、2024-01-31 08:00）轉成 Unix time
+
+    未指定時區時視為台灣時間。
+
+    Raises:
+        ValueError: 無法解析的格式
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=PTT_TIMEZONE)
+    return int(moment.timestamp())
+
+
+def available_backends():
+    """回傳目前環境可用的解析後端名稱"""
+    return ['lxml', 'bs4'] if etree is not None else ['bs4']
+
+
+def build_article(link, board, article_id, title, author, date, ip, strings, pushes):
+    """
+    由解析後端取出的原始欄位組成 Article
+
+    Args:
+        strings: 移除 metaline 與推文後，文章主體中所有去除前後空白的非空字串
+        pushes: (push_tag, push_userid, push_content, push_ipdatetime) 的列表
+    """
+    # 移除 '※ 發信站:' (starts with u'\u203b'), '◆ From:' (starts with u'\u25c6'), 空行及多餘空白
+    filtered = [v for v in strings if v[0] not in [u'※', u'◆'] and v[:2] not in [u'--']]
+    filtered = [re.sub(CONTENT_EXPR, '', v) for v in filtered]
+    filtered = [_f for _f in filtered if _f]  # remove empty strings
+    filtered = [x for x in filtered if article_id not in x]  # remove last line containing the url of the article
+    content = ' '.join(filtered)
+    content = re.sub(r'(\s)+', ' ', content)
+
+    # push messages
+    p, b, n = 0, 0, 0
+    messages = []
+    for push_tag, push_userid, push_content, push_ipdatetime in pushes:
+        messages.append(PushMessage(push_tag, push_userid, push_content, push_ipdatetime))
+        if push_tag == u'推':
+            p += 1
+        elif push_tag == u'噓':
+            b += 1
+        else:
+            n += 1
+
+    # count: 推噓文相抵後的數量; all: 推文總數
+    message_count = MessageCount(all=p+b+n, count=p-b, push=p, boo=b, neutral=n)
+
+    return Article(
+        url=link,
+        board=board,
+        article_id=article_id,
+        article_title=title,
+        author=author,
+        date=date,
+        content=content,
+        ip=ip,
+        message_count=message_count,
+        messages=messages
+    )
+
+
+def extract_ip(signature):
+    """從「※ 發信站:」那一行取出 IP，取不到時回傳 "None" """
+    try:
+        return re.search(IP_EXPR, signature).group()
+    except Exception:
+        return "None"
+
+
+def _class_xpath(tag, cls):
+    return ".//%s[contains(concat(' ', normalize-space(@class), ' '), ' %s ')]" % (tag, cls)
+
+
+def _is_element(node):
+    # 註解與處理指令的 tag 不是字串
+    return isinstance(node.tag, str)
+
+
+def _iter_strings(el):
+    """依文件順序產生元素內所有文字節點，與 BeautifulSoup 的 .strings 相同（略過註解）"""
+    if el.tag not in ('script', 'style'):
+        if el.text:
+            yield el.text
+        for child in el:
+            if _is_element(child):
+                for text in _iter_strings(child):
+                    yield text
+            if child.tail:
+                yield child.tail
+
+
+def _string(el):
+    """模擬 BeautifulSoup 的 Tag.string：只有單一子節點時回傳其文字，否則回傳 None"""
+    count = (1 if el.text else 0) + sum(1 + (1 if child.tail else 0) for child in el)
+    if count != 1:
+        return None
+    if el.text:
+        return el.text
+    child = el[0]
+    if not _is_element(child):
+        return child.text
+    return _string(child)
+
+
+def _push_spans(push):
+    """一次走訪推文節點，取得各欄位第一個符合 class 的 span"""
+    spans = {}
+    for span in push.iter('span'):
+        for cls in (span.get('class') or '').split():
+            if cls in PUSH_SPAN_CLASSES and cls not in spans:
+                spans[cls] = span
+    return spans
+
+
+def parse_article_lxml(html, link, article_id, board):
+    """以 lxml 解析文章頁面，輸出與 BeautifulSoup 版本相同的 Article；找不到文章主體時拋出 ArticleError"""
+    root = lxml.html.fromstring(html)
+    found = root.xpath('//*[@id="main-content"]')
+    if not found:
+        raise ArticleError({"error": "main-content not found", "url": link})
+    main_content = found[0]
+
+    metas = main_content.xpath(_class_xpath('div', 'article-metaline'))
+    author = ''
+    title = ''
+    date = ''
+    if metas:
+        author = _string(metas[0].xpath(_class_xpath('span', 'article-meta-value'))[0])
+        title = _string(metas[1].xpath(_class_xpath('span', 'article-meta-value'))[0])
+        date = _string(metas[2].xpath(_class_xpath('span', 'article-meta-value'))[0])
+
+        # remove meta nodes（drop_tree 會保留節點後方的文字）
+        for meta in metas:
+            meta.drop_tree()
+        for meta in main_content.xpath(_class_xpath('div', 'article-metaline-right')):
+            meta.drop_tree()
+
+    # remove and keep push nodes
+    push_nodes = main_content.xpath(_class_xpath('div', 'push'))
+    for push in push_nodes:
+        push.drop_tree()
+
+    strings = list(_iter_strings(main_content))
+    signature = next((s for s in strings if SIGNATURE_EXPR.search(s)), None)
+    ip = extract_ip(signature)
+
+    pushes = []
+    for push in push_nodes:
+        spans = _push_spans(push)
+        if 'push-tag' not in spans:
+            continue
+        push_tag = _string(spans['push-tag']).strip(' \t\n\r')
+        push_userid = _string(spans['push-userid']).strip(' \t\n\r')
+        push_content = ' '.join(_iter_strings(spans['push-content']))[1:].strip(' \t\n\r')  # remove ':'
+        push_ipdatetime = _string(spans['push-ipdatetime']).strip(' \t\n\r')
+        pushes.append((push_tag, push_userid, push_content, push_ipdatetime))
+
+    stripped = [s.strip() for s in strings]
+    return build_article(link, board, article_id, title, author, date, ip,
+                         [s for s in stripped if s], pushes)
+
+
+def parse_push_count(push_count_text):
+    """將列表頁的推文數文字轉成整數：爆 為 100，X1~X9 為負數，XX 為 -100"""
+    try:
+        if push_count_text == '爆':
+            return 100
+        elif push_count_text.startswith('X'):
+            if push_count_text == 'XX':
+                return -100
+            return -int(push_count_text[1:]) if push_count_text[1:].isdigit() else 0
+        return int(push_count_text) if push_count_text.isdigit() else 0
+    except ValueError:
+        return 0
+
+
+def display_push_count(count):
+    """
+    將推噓相抵的數量轉成列表頁顯示後再經 parse_push_count 得到的值
+
+    列表頁只顯示 1~99 的正數，100 以上為 爆，-10 以下每 10 為一級 (X1~X9)，
+    -100 以下為 XX，其餘不顯示，因此不同的數量可能對應到相同的值。
+    """
+    if count >= 100:
+        return 100
+    if count > 0:
+        return count
+    if count <= -100:
+        return -100
+    if count <= -10:
+        return -(-count // 10)
+    return 0
+
+
+class IndexPageParser(HTMLParser):
+    """
+    以單次串流掃描解析看板列表頁，取出每個 div.r-ent 的欄位
+
+    只追蹤 div 的巢狀深度與目前開啟中的欄位，不建立文件樹。
+    """
+
+    ROW_FIELDS = ('title', 'meta', 'nrec')
+    META_FIELDS = ('author', 'date')
+
+    def __init__(self, ptt_url, error_log=None):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.ptt_url = ptt_url
+        self.error_log = error_log
+        self.rows = []
+        self._row = None
+        self._depth = 0
+        self._open = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'div':
+            classes = (dict(attrs).get('class') or '').split()
+            if self._row is None:
+                if 'r-ent' in classes:
+                    self._row = {'texts': {}, 'href': None, 'has_a': False}
+                    self._depth = 1
+                return
+            self._depth += 1
+            texts = self._row['texts']
+            opened = [name for name, _ in self._open]
+            for field in self.ROW_FIELDS:
+                if field in classes and field not in texts:
+                    self._open_field(field)
+            if 'meta' in opened:
+                for field in self.META_FIELDS:
+                    if field in classes and field not in texts:
+                        self._open_field(field)
+        elif tag == 'a' and self._row is not None and not self._row['has_a']:
+            if any(name == 'title' for name, _ in self._open):
+                self._row['has_a'] = True
+                self._row['href'] = dict(attrs).get('href')
+                self._row['texts']['a'] = []
+                self._open.append(('a', None))
+
+    def _open_field(self, field):
+        self._row['texts'][field] = []
+        self._open.append((field, self._depth))
+
+    def handle_endtag(self, tag):
+        if self._row is None:
+            return
+        if tag == 'a':
+            self._open = [(name, depth) for name, depth in self._open if name != 'a']
+        elif tag == 'div':
+            self._open = [(name, depth) for name, depth in self._open if depth != self._depth]
+            self._depth -= 1
+            if self._depth == 0:
+                self._finish_row()
+
+    def handle_data(self, data):
+        if self._row is not None:
+            for name, _ in self._open:
+                self._row['texts'][name].append(data)
+
+    def _finish_row(self):
+        row, self._row, self._open = self._row, None, []
+        try:
+            info = self._build_row(row)
+            if info is not None:
+                self.rows.append(info)
+        except Exception as e:
+            error_msg = f"處理文章列表項目時出錯: {e}"
+            print(error_msg)
+            if self.error_log is not None:
+                self.error_log.append(error_msg)
+
+    def _build_row(self, row):
+        texts = row['texts']
+        text = lambda field: ''.join(texts[field]).strip() if field in texts else None
+
+        # 獲取文章連結
+        if 'title' not in texts:
+            return None
+        if not row['has_a']:
+            # 可能是已刪除的文章，但我們仍然記錄標題
+            title = text('title')
+            article_url = None
+            article_id = None
+        else:
+            href = row['href']
+            if not href or '/bbs/' not in href:
+                return None
+            title = text('a')
+            article_url = self.ptt_url + href
+            article_id = href.split('/')[-1].replace('.html', '')
+
+        # 作者、日期與推文數
+        push_count_text = text('nrec') if 'nrec' in texts else '0'
+        return {
+            'title': title,
+            'url': article_url,
+            'article_id': article_id,
+            'author': text('author') or '',
+            'date': text('date') or '',
+            'push_count': parse_push_count(push_count_text),
+            'push_count_text': push_count_text
+        }
+
+
+def parse_index_rows(html, ptt_url, error_log=None):
+    """串流解析看板列表頁，回傳與 BeautifulSoup 版本相同的文章資訊列表"""
+    parser = IndexPageParser(ptt_url, error_log)
+    parser.feed(html)
+    parser.close()
+    return parser.rows
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+依優先順序抓取文章
+
+一般的 -i 爬取依列表頁順序抓取文章，在請求數或時間有限時，安靜的舊文章可能
+先用完預算，爆文反而來不及抓取。優先排程先讀完整個範圍的列表頁，依優先函式
+排序後由高到低抓取文章，預算用完時最有價值的文章已經完成。
+
+內建的優先函式：
+    push    列表頁上的推文數（爆 為 100，X1~X9 為負數），相同時較新的文章優先
+    recent  發文時間（取自文章 ID），較新的文章優先
+"""
+
+import time
+
+from PttWebCrawler.parsers import article_timestamp
+
+
+def push_priority(row):
+    """列表頁推文數，相同時以發文時間排序"""
+    return (row['push_count'], article_timestamp(row['article_id']) or 0)
+
+
+def recent_priority(row):
+    """發文時間"""
+    return article_timestamp(row['article_id']) or 0
+
+
+PRIORITIES = {
+    'push': push_priority,
+    'recent': recent_priority,
+}
+
+
+def get_priority(priority):
+    """
+    取得優先函式
+
+    Args:
+        priority: PRIORITIES 中的名稱，或接受列表項目並回傳可排序值的函式（值越大越先抓取）
+
+    Raises:
+        ValueError: 未知的優先函式名稱
+    """
+    if callable(priority):
+        return priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的優先順序: {priority}（可用: {', '.join(sorted(PRIORITIES))}）")
+    return PRIORITIES[priority]
+
+
+def order_rows(rows, priority='push'):
+    """
+    依優先函式由高到低排序列表項目，沒有連結的項目（已刪除文章）會被略過
+
+    優先值相同的項目維持列表頁順序。
+    """
+    key = get_priority(priority)
+    return sorted((row for row in rows if row['url']), key=key, reverse=True)
+
+
+class Budget(object):
+    """
+    抓取文章的請求數與時間預算
+
+    Args:
+        max_articles: 最多發出幾篇文章的請求，None 表示不限
+        max_seconds: 自 start() 起算的秒數上限（包含讀取列表頁的時間），None 表示不限
+
+    開始抓取後累計已送出的文章數 (spent) 與預算用完時尚未抓取的文章數 (left)。
+    """
+
+    def __init__(self, max_articles=None, max_seconds=None):
+        self.max_articles = max_articles
+        self.max_seconds = max_seconds
+        self.started = None
+        self.spent = 0
+        self.left = 0
+
+    def start(self):
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def exhausted(self):
+        if self.max_articles is not None and self.spent >= self.max_articles:
+            return True
+        if self.max_seconds is not None and self.started is not None:
+            return time.monotonic() - self.started >= self.max_seconds
+        return False
+
+    def take(self, rows):
+        """
+        從 rows 開頭取出預算內可抓取的項目並計入已送出的數量
+
+        預算已用完時回傳空列表，並將剩餘的項目數計入 left。
+        """
+        if self.exhausted():
+            self.left += len(rows)
+            return []
+        if self.max_articles is not None:
+            allowed = self.max_articles - self.spent
+            if allowed < len(rows):
+                self.left += len(rows) - allowed
+                rows = rows[:allowed]
+        self.spent += len(rows)
+        return rows
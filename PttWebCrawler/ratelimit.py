@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+依主機分開計算的自適應 token bucket 限速器
+
+回應正常時逐步加快（加法增加），遇到 429、503 或逾時時立即減速（乘法減少），
+取代原本散落在各處的固定 sleep。
+"""
+
+import time
+import threading
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+# 視為「伺服器要求減速」的狀態碼
+THROTTLE_STATUS = (429, 503)
+
+
+class TokenBucket(object):
+    """
+    單一主機的 token bucket，速率以 AIMD 調整
+
+    Args:
+        rate: 初始速率（每秒請求數）
+        min_rate: 速率下限
+        max_rate: 速率上限
+        capacity: 可累積的 token 數量上限，即允許的瞬間突發請求數
+        increase: 每次成功回應增加的速率
+        decrease: 遇到限速訊號時速率乘上的倍數
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.2, max_rate=20.0, capacity=5,
+                 increase=0.05, decrease=0.5, clock=time.monotonic):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.capacity = float(capacity)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.clock = clock
+        self.tokens = 1.0
+        self.last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self):
+        """預訂一個 token，回傳呼叫端需要等待的秒數"""
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens -= 1.0
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # 清空已累積的 token，讓接下來的請求立刻依新速率排隊
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimiter(object):
+    """
+    以主機為單位管理 TokenBucket
+
+    所有抓取路徑在發出請求前呼叫 acquire（非同步路徑使用 reserve 後自行 await），
+    收到回應後呼叫 record 以調整速率。
+    """
+
+    def __init__(self, **bucket_options):
+        self.bucket_options = bucket_options
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **bucket_options):
+        """更新預設參數，並清除既有的 bucket"""
+        with self._lock:
+            self.bucket_options.update(bucket_options)
+            self._buckets = {}
+
+    @staticmethod
+    def _host(url_or_host):
+        return urlsplit(url_or_host).netloc or url_or_host
+
+    def bucket(self, url_or_host):
+        host = self._host(url_or_host)
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(**self.bucket_options)
+            return self._buckets[host]
+
+    def reserve(self, url):
+        """預訂一次請求，回傳需要等待的秒數"""
+        return self.bucket(url).reserve()
+
+    def acquire(self, url):
+        """阻塞直到可以對該主機發出請求"""
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, url, status_code=None, error=None):
+        """依回應結果調整速率；逾時或連線錯誤請傳入 error"""
+        bucket = self.bucket(url)
+        if error is not None or status_code in THROTTLE_STATUS:
+            bucket.on_throttle()
+        elif status_code is not None and status_code < 400:
+            bucket.on_success()
+
+    def backoff(self, url):
+        """主動減速，用於呼叫端判斷需要重試的情況"""
+        self.bucket(url).on_throttle()
+
+    def current_rate(self, url_or_host=None):
+        """
+        回傳目前速率（每秒請求數）
+
+        不指定主機時回傳 {主機: 速率} 的字典
+        """
+        if url_or_host is not None:
+            return self.bucket(url_or_host).rate
+        with self._lock:
+            return {host: bucket.rate for host, bucket in self._buckets.items()}
+
+
+# 行程內共用的限速器
+rate_limiter = RateLimiter()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+API 結果的共用快取
+
+以 SQLite 檔案保存已組好的 API 回應，同一台機器上的多個 gunicorn worker
+共用同一份快取。每個端點有各自的 TTL，總容量超過上限時依最後存取時間
+刪除最舊的項目。
+"""
+
+import os
+import json
+import time
+import sqlite3
+
+DEFAULT_RESULT_CACHE = os.environ.get('PTT_RESULT_CACHE', 'ptt_result_cache.sqlite')
+
+# 各端點的預設 TTL（秒）；文章推文數變動頻繁，不宜快取太久
+DEFAULT_ENDPOINT_TTLS = {
+    'article': 60,
+    'list': 30,
+    'default': 60,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    endpoint TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, key)
+);
+CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at);
+'''
+
+
+class ResultCache(object):
+    """
+    跨行程共用的結果快取
+
+    Args:
+        path: SQLite 檔案路徑
+        max_bytes: 快取總容量上限，超過時依 LRU 刪除
+        ttls: 覆寫 DEFAULT_ENDPOINT_TTLS 中各端點的 TTL（秒）
+    """
+
+    def __init__(self, path=DEFAULT_RESULT_CACHE, max_bytes=64 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_ENDPOINT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 舊版的表只以 key 為主鍵，不同端點的結果會互相覆寫；快取內容可以丟棄，直接重建
+            primary_key = [row[1] for row in conn.execute('PRAGMA table_info(results)') if row[5]]
+            if primary_key == ['key']:
+                conn.execute('DROP TABLE results')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.ttls['default'])
+
+    def get(self, endpoint, key):
+        """
+        讀取快取的結果
+
+        Returns:
+            (結果, 已快取的秒數)；不存在或已過期時回傳 None
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT data, stored_at FROM results WHERE key = ? AND endpoint = ?',
+                (key, endpoint)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl(endpoint):
+                return None
+            conn.execute('UPDATE results SET accessed_at = ? WHERE endpoint = ? AND key = ?', (now, endpoint, key))
+        return json.loads(row[0]), int(now - row[1])
+
+    def set(self, endpoint, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (endpoint, key, data, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (endpoint, key, data, len(data.encode('utf-8')), now, now)
+            )
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(conn, total)
+
+    def _evict(self, conn, total):
+        # 依最後存取時間由舊到新刪除，直到低於容量上限的九成
+        target = self.max_bytes * 0.9
+        expired = []
+        for endpoint, key, size in conn.execute('SELECT endpoint, key, size FROM results ORDER BY accessed_at').fetchall():
+            if total <= target:
+                break
+            expired.append((endpoint, key))
+            total -= size
+        conn.executemany('DELETE FROM results WHERE endpoint = ? AND key = ?', expired)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM results')
+
+    def stats(self):
+        with self._connect() as conn:
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'entries': count, 'bytes': total}
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+已爬取文章的本地全文檢索
+
+以 SQLite 保存倒排索引：中文以單字與相鄰兩字 (bigram) 為索引詞，英數字以
+相鄰三字 (trigram) 為索引詞，不到三字的單字保留整個單字。查詢時先以索引詞
+的交集找出候選文章，再比對原文確認關鍵字或片語確實連續出現（與 PTT 搜尋
+相同，關鍵字可以是單字的一部分）。索引可隨時加入新文章，同一篇文章重複
+加入時會更新內容。
+
+建立索引：
+    python -m PttWebCrawler.search_index ptt_index.sqlite Gossiping-1-10.json more.jsonl
+"""
+
+import os
+import re
+import json
+import sqlite3
+import argparse
+
+from PttWebCrawler.storage import load_articles
+
+DEFAULT_SEARCH_INDEX = os.environ.get('PTT_SEARCH_INDEX', 'ptt_search_index.sqlite')
+
+# 中日韓統一表意文字（含擴充 A 與相容字）連續出現的片段，以及英數字單字
+TOKEN_EXPR = re.compile('([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)|([0-9a-z]+)')
+# 查詢字串中以雙引號包住的片語
+PHRASE_EXPR = re.compile(r'"([^"]+)"')
+
+# 索引詞的切法改變時遞增，開啟舊版索引時由保存的原文重建 postings
+TOKENIZER_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    article_id TEXT NOT NULL,
+    author TEXT,
+    date TEXT,
+    push_count INTEGER NOT NULL DEFAULT 0,
+    text TEXT NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (board, article_id)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (token, doc_id)
+) WITHOUT ROWID;
+'''
+
+
+def normalize(text):
+    """索引與比對前統一轉為小寫，並將連續空白合併為一個空格"""
+    return re.sub(r'\s+', ' ', (text or '').lower())
+
+
+def ngrams(text, n):
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def tokenize(text):
+    """
+    將文字切成索引詞
+
+    中文片段切成每個單字與相鄰兩字，英數字切成相鄰三字（不到三字時保留整個
+    單字），關鍵字是原文任何一段子字串時都能由索引詞找到。
+    """
+    tokens = []
+    for cjk, word in TOKEN_EXPR.findall(normalize(text)):
+        if word:
+            tokens.extend(ngrams(word, 3) if len(word) >= 3 else [word])
+        else:
+            tokens.extend(cjk)
+            tokens.extend(ngrams(cjk, 2))
+    return tokens
+
+
+def query_tokens(term):
+    """
+    查詢詞中一定會出現在相符文章索引裡的索引詞
+
+    關鍵字以子字串比對：中文使用相鄰兩字（單一中文字使用單字），英數字使用
+    相鄰三字。不到三字的英數字可能是原文中較長單字的一部分，只有兩端都不是
+    英數字（原文中就是整個單字）時才能作為索引詞，否則由原文比對確認。
+    """
+    tokens = []
+    for match in TOKEN_EXPR.finditer(term):
+        cjk, word = match.groups()
+        if word:
+            if len(word) >= 3:
+                tokens.extend(ngrams(word, 3))
+            elif match.start() > 0 and match.end() < len(term):
+                tokens.append(word)
+        else:
+            tokens.extend(ngrams(cjk, 2) if len(cjk) > 1 else [cjk])
+    return tokens
+
+
+def parse_query(query):
+    """將查詢字串拆成必須出現的詞：雙引號內為片語，其餘以空白分隔"""
+    phrases = [p.strip() for p in PHRASE_EXPR.findall(query) if p.strip()]
+    rest = PHRASE_EXPR.sub(' ', query)
+    return [normalize(term) for term in phrases + rest.split()]
+
+
+def article_text(article):
+    """組出文章要被索引的文字：標題、內文與推文內容"""
+    parts = [article.get('article_title') or article.get('title') or '', article.get('content') or '']
+    parts.extend(message.get('push_content') or '' for message in article.get('messages') or [])
+    return '\n'.join(parts)
+
+
+def article_push_count(article):
+    """完整文章使用推噓相抵後的數量，列表資訊使用列表頁上的推文數"""
+    if 'message_count' in article:
+        return article['message_count'].get('count', 0)
+    return article.get('push_count') or 0
+
+
+class SearchIndex(object):
+    """
+    持久化的倒排索引
+
+    Args:
+        path: SQLite 檔案路徑
+    """
+
+    def __init__(self, path=DEFAULT_SEARCH_INDEX):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < TOKENIZER_VERSION:
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        """以目前的切詞方式由保存的原文重建所有索引詞"""
+        self.conn.execute('DELETE FROM postings')
+        postings = []
+        for doc_id, text in self.conn.execute('SELECT doc_id, text FROM docs').fetchall():
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            postings.extend((token, doc_id, tf) for token, tf in counts.items())
+        self._insert_postings(postings)
+        self.conn.execute(f'PRAGMA user_version = {TOKENIZER_VERSION}')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+    def add(self, article):
+        """加入或更新一篇文章；沒有文章 ID 或解析失敗的項目會被略過，回傳是否加入"""
+        postings = self._add_doc(article)
+        if postings is None:
+            return False
+        self._insert_postings(postings)
+        self.conn.commit()
+        return True
+
+    def add_articles(self, articles, batch_size=500):
+        """
+        批次加入多篇文章，回傳實際加入的數量
+
+        每批文章的索引詞依 (索引詞, 文章) 排序後一次寫入，讓 B-tree 以接近
+        循序的方式插入，大量建立索引時比逐篇寫入快得多。
+        """
+        count = 0
+        postings = []
+        for article in articles:
+            doc_postings = self._add_doc(article)
+            if doc_postings is None:
+                continue
+            postings.extend(doc_postings)
+            count += 1
+            if count % batch_size == 0:
+                self._insert_postings(postings)
+                self.conn.commit()
+                postings = []
+        self._insert_postings(postings)
+        self.conn.commit()
+        return count
+
+    def _add_doc(self, article):
+        """寫入文章資料並移除舊的索引詞，回傳待寫入的 (索引詞, 文章, 詞頻) 列表"""
+        board = article.get('board') or ''
+        article_id = article.get('article_id')
+        if not article_id or 'error' in article:
+            return None
+        text = article_text(article)
+        row = self.conn.execute(
+            'SELECT doc_id, text FROM docs WHERE board = ? AND article_id = ?', (board, article_id)
+        ).fetchone()
+        values = (board, article_id, article.get('author'), article.get('date'), article_push_count(article),
+                  normalize(text), json.dumps(article, ensure_ascii=False))
+        if row is None:
+            doc_id = self.conn.execute(
+                'INSERT INTO docs (board, article_id, author, date, push_count, text, data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                values
+            ).lastrowid
+        else:
+            doc_id = row[0]
+            self.conn.execute(
+                'UPDATE docs SET board = ?, article_id = ?, author = ?, date = ?, push_count = ?, text = ?, data = ? '
+                'WHERE doc_id = ?', values + (doc_id,)
+            )
+            # 由舊的內文重新算出索引詞，以主鍵刪除，不需要額外維護 doc_id 索引
+            self.conn.executemany(
+                'DELETE FROM postings WHERE token = ? AND doc_id = ?',
+                [(token, doc_id) for token in set(tokenize(row[1]))]
+            )
+
+        counts = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        return [(token, doc_id, tf) for token, tf in counts.items()]
+
+    def _insert_postings(self, postings):
+        postings.sort()
+        self.conn.executemany('INSERT INTO postings (token, doc_id, tf) VALUES (?, ?, ?)', postings)
+
+    def search(self, query, board=None, author=None, recommend=None, limit=50):
+        """
+        搜尋包含所有關鍵字（或片語）的文章
+
+        Args:
+            query: 以空白分隔的關鍵字，雙引號內為片語；可為空字串（只依篩選條件查詢）
+            board: 只搜尋此看板
+            author: 只保留此作者的文章
+            recommend: 只保留推文數大於等於此值的文章
+            limit: 最多回傳的文章數
+
+        Returns:
+            依相關程度排序的文章字典列表
+        """
+        terms = parse_query(query or '')
+        tokens = sorted(set(token for term in terms for token in query_tokens(term)))
+
+        filters = []
+        params = []
+        if board:
+            filters.append('d.board = ?')
+            params.append(board)
+        if author:
+            # 完整文章的作者欄位為「帳號 (暱稱)」，列表資訊只有帳號
+            filters.append("(lower(d.author) = ? OR lower(d.author) LIKE ? || ' (%')")
+            params.extend([author.lower(), author.lower()])
+        if recommend is not None:
+            filters.append('d.push_count >= ?')
+            params.append(recommend)
+        # 索引詞交集可能來自不相連的位置，以原文確認每個詞都連續出現
+        for term in terms:
+            filters.append('instr(d.text, ?) > 0')
+            params.append(term)
+
+        if tokens:
+            # 所有索引詞都出現的文章，依詞頻總和排序
+            placeholders = ', '.join('?' * len(tokens))
+            sql = ('SELECT d.doc_id, d.text, d.data FROM docs d JOIN ('
+                   f'SELECT doc_id, SUM(tf) AS score FROM postings WHERE token IN ({placeholders}) '
+                   'GROUP BY doc_id HAVING COUNT(*) = ?) p ON p.doc_id = d.doc_id')
+            params = tokens + [len(tokens)] + params
+            order = ' ORDER BY p.score DESC, d.doc_id DESC'
+        else:
+            # 沒有可用的索引詞（例如不到三字的英文單字片段或只用篩選條件），直接掃描文章
+            sql = 'SELECT d.doc_id, d.text, d.data FROM docs d'
+            order = ' ORDER BY d.doc_id DESC'
+        if filters:
+            sql += (' AND ' if tokens else ' WHERE ') + ' AND '.join(filters)
+
+        rows = self.conn.execute(sql + order + ' LIMIT ?', params + [limit])
+        return [json.loads(data) for _, _, data in rows]
+
+
+def main(cmdline=None):
+    parser = argparse.ArgumentParser(description='建立或查詢已爬取文章的本地全文索引')
+    parser.add_argument('index', metavar='INDEX_DB', help='索引檔路徑')
+    parser.add_argument('files', metavar='FILE', nargs='*', help='要加入索引的 JSON 或 JSONL 檔案')
+    parser.add_argument('-q', '--query', help='查詢字串，雙引號內為片語')
+    parser.add_argument('-b', metavar='BOARD_NAME', help='只搜尋此看板')
+    args = parser.parse_args(cmdline)
+
+    index = SearchIndex(args.index)
+    try:
+        for path in args.files:
+            count = index.add_articles(load_articles(path))
+            print(f"已將 {path} 的 {count} 篇文章加入索引")
+        if args.query:
+            for article in index.search(args.query, board=args.b):
+                print(json.dumps(article, sort_keys=True, ensure_ascii=False))
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
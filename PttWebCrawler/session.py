@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+行程內共用的 HTTP Session 管理
+
+所有抓取路徑（parse、getLastPage、列表爬蟲）共用同一個 requests.Session，
+藉由連線池重複使用與 www.ptt.cc 的 TCP/TLS 連線，避免每篇文章都重新握手。
+"""
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from PttWebCrawler.ratelimit import rate_limiter
+
+# 根據 Python 版本導入不同的 Retry
+try:
+    # Python 3
+    from urllib3.util import Retry
+except ImportError:
+    try:
+        # 較舊版本的 requests
+        from requests.packages.urllib3.util.retry import Retry
+    except ImportError:
+        Retry = None
+
+# configure() 未指定 cache 時的預設值，與 cache=None（停用快取）區分
+_UNSET = object()
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+IS_AZURE = 'AZURE_FUNCTIONS_ENVIRONMENT' in os.environ or 'WEBSITE_SITE_NAME' in os.environ
+
+
+def _build_retry(total):
+    """
+    建立重試策略，舊版 urllib3 不支援 allowed_methods 時改用 method_whitelist
+
+    429 與 503 不在自動重試之列：這些回應必須交給限速器減速，由 urllib3 重試
+    會繞過 token bucket 並在重試用完時拋出 RetryError。
+    """
+    if Retry is None:
+        return total
+    kwargs = dict(total=total, backoff_factor=0.5, status_forcelist=[500, 502, 504], raise_on_status=False)
+    try:
+        return Retry(allowed_methods=['HEAD', 'GET', 'OPTIONS'], **kwargs)
+    except TypeError:
+        try:
+            return Retry(method_whitelist=['HEAD', 'GET', 'OPTIONS'], **kwargs)
+        except TypeError:
+            return total
+
+
+class CrawlerSession(requests.Session):
+    """
+    每次請求前向限速器取得 token，並依回應結果回報給限速器
+
+    設定了 ResponseCache 時，GET 請求會先查詢快取：未過期直接回傳，
+    過期則以條件式 GET 重新驗證，收到 304 時沿用快取內容。
+    """
+
+    def __init__(self, limiter, cache=None):
+        super(CrawlerSession, self).__init__()
+        self.limiter = limiter
+        self.cache = cache
+
+    def request(self, method, url, *args, **kwargs):
+        entry = None
+        if self.cache is not None and method.upper() == 'GET':
+            entry = self.cache.get(url)
+            if entry is not None and self.cache.is_fresh(entry):
+                self.cache.hits += 1
+                return self._cached_response(url, entry)
+            if entry is not None:
+                headers = dict(kwargs.get('headers') or {})
+                headers.update(entry.conditional_headers())
+                kwargs['headers'] = headers
+
+        self.limiter.acquire(url)
+        try:
+            resp = super(CrawlerSession, self).request(method, url, *args, **kwargs)
+        except (requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError) as e:
+            self.limiter.record(url, error=e)
+            raise
+        self.limiter.record(url, resp.status_code)
+
+        if entry is not None and resp.status_code == 304:
+            self.cache.revalidated += 1
+            self.cache.refresh(entry)
+            return self._cached_response(url, entry)
+        if self.cache is not None and method.upper() == 'GET' and resp.status_code == 200:
+            self.cache.misses += 1
+            self.cache.store(url, resp.content, resp.headers)
+        return resp
+
+    @staticmethod
+    def _cached_response(url, entry):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = url
+        resp._content = entry.body
+        resp.encoding = 'utf-8'
+        resp.headers['X-Cache'] = 'HIT'
+        return resp
+
+
+class SessionManager(object):
+    """
+    管理行程內唯一的 requests.Session
+
+    Args:
+        pool_size: 連線池大小，並行抓取時應不小於執行緒數量
+        retries: 連線錯誤及 5xx 回應的自動重試次數
+        limiter: 所有請求共用的 RateLimiter
+        cache: 選用的 ResponseCache，設定後所有 GET 請求都會經過磁碟快取
+    """
+
+    def __init__(self, pool_size=10, retries=3, limiter=rate_limiter, cache=None):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.limiter = limiter
+        self.cache = cache
+        self._session = None
+        self._lock = threading.Lock()
+
+    def configure(self, pool_size=None, retries=None, cache=_UNSET):
+        """
+        調整連線池或快取設定，之後取得的 Session 使用新的設定
+
+        未指定的設定維持不變；cache=None 表示停用快取。
+
+        已建立的 Session 不會被關閉：其他執行緒可能正在使用它發出請求，
+        改為建立新的 Session 取代，舊的 Session 在使用者用完後由垃圾回收釋放。
+        """
+        with self._lock:
+            if pool_size is not None:
+                self.pool_size = pool_size
+            if retries is not None:
+                self.retries = retries
+            if cache is not _UNSET:
+                self.cache = cache
+            self._replace()
+
+    def ensure_pool_size(self, pool_size):
+        """確保連線池至少可容納 pool_size 條同時連線"""
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            self._replace()
+
+    def get(self):
+        """取得共用的 Session，第一次呼叫時建立"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build()
+        return self._session
+
+    def reset(self):
+        """關閉目前的 Session"""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _replace(self):
+        """以新設定建立 Session 取代目前的 Session，沿用其 cookie 與標頭，舊的 Session 不關閉"""
+        if self._session is not None:
+            self._session = self._build(previous=self._session)
+
+    def _build(self, previous=None):
+        session = CrawlerSession(self.limiter, self.cache)
+        session.headers.update(DEFAULT_HEADERS)
+        session.cookies.set('over18', '1', domain='www.ptt.cc')
+        if previous is not None:
+            # 執行期間設定的 cookie（例如重新通過年齡驗證）與標頭
+            session.headers.update(previous.headers)
+            session.cookies.update(previous.cookies)
+
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=_build_retry(self.retries)
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        if IS_AZURE:
+            session.trust_env = False  # 不使用系統代理設定
+            proxy = os.environ.get('HTTP_PROXY') or os.environ.get('http_proxy')
+            if proxy:
+                session.proxies = {'http': proxy, 'https': proxy}
+                print(f"使用代理: {proxy}")
+        return session
+
+
+# 行程內共用的 Session 管理器
+session_manager = SessionManager()
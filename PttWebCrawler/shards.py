@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+多節點分片爬取的租約表
+
+協調端將看板的頁數範圍切成分片寫入共用的 SQLite 檔案，各節點的工作者認領
+分片（取得租約）後爬取，爬取期間定期延長租約，完成後標記為 done。節點中止
+時租約會過期，分片回到可認領狀態由其他節點接手；同一分片失敗超過
+MAX_ATTEMPTS 次則標記為 failed，不再重試。
+
+查看進度：
+    python -m PttWebCrawler.shards /shared/ptt_shards.sqlite
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_SHARD_SIZE = 100
+DEFAULT_LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    start_page INTEGER NOT NULL,
+    end_page INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    article_count INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (board, start_page)
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, lease_expires);
+'''
+
+
+def default_owner():
+    """工作者識別名稱：主機名稱加上行程 ID"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def shard_name(shard):
+    """分片的輸出檔名，例如 Gossiping-101-200"""
+    return f"{shard['board']}-{shard['start_page']}-{shard['end_page']}"
+
+
+class ShardStore(object):
+    """
+    以 SQLite 保存分片與租約，每次操作使用獨立連線以便跨執行緒使用
+
+    檔案通常放在多台機器共用的磁碟上，因此不使用 WAL（WAL 依賴共用記憶體，
+    無法跨機器），改用預設的 rollback journal 並以 BEGIN IMMEDIATE 序列化認領。
+
+    Args:
+        path: SQLite 檔案路徑
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def plan(self, board, start, end, shard_size=DEFAULT_SHARD_SIZE):
+        """
+        將 start 到 end 頁切成最多 shard_size 頁的分片
+
+        已被既有分片涵蓋的頁數會略過，重複執行或範圍重疊時不會產生重複的分片。
+
+        Returns:
+            新增的分片數量
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            covered = conn.execute(
+                'SELECT start_page, end_page FROM shards WHERE board = ? AND end_page >= ? AND start_page <= ? '
+                'ORDER BY start_page', (board, start, end)
+            ).fetchall()
+            ranges = []
+            page = start
+            for covered_start, covered_end in list(covered) + [(end + 1, end + 1)]:
+                while page < covered_start and page <= end:
+                    last = min(page + shard_size - 1, covered_start - 1, end)
+                    ranges.append((page, last))
+                    page = last + 1
+                page = max(page, covered_end + 1)
+            conn.executemany(
+                'INSERT INTO shards (board, start_page, end_page, updated_at) VALUES (?, ?, ?, ?)',
+                [(board, first, last, now) for first, last in ranges]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return len(ranges)
+
+    def claim(self, owner, lease_seconds=DEFAULT_LEASE_SECONDS, board=None):
+        """
+        認領一個待處理或租約已過期的分片
+
+        Returns:
+            分片字典；沒有可認領的分片時回傳 None
+        """
+        now = time.time()
+        sql = ("SELECT * FROM shards WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+               "AND attempts < ?")
+        params = [now, MAX_ATTEMPTS]
+        if board:
+            sql += ' AND board = ?'
+            params.append(board)
+        conn = self._connect()
+        try:
+            # 先取得寫入鎖再查詢，多個節點同時認領時不會拿到同一個分片
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(sql + ' ORDER BY board, start_page LIMIT 1', params).fetchone()
+            if row is None:
+                # 租約過期且已達重試上限的分片不會再被認領，直接標記為失敗
+                conn.execute(
+                    "UPDATE shards SET status = 'failed', updated_at = ? "
+                    "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, MAX_ATTEMPTS)
+                )
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?", (owner, now + lease_seconds, now, row['id'])
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        shard = dict(row)
+        shard.update(status='leased', owner=owner, lease_expires=now + lease_seconds, attempts=row['attempts'] + 1)
+        return shard
+
+    def _update_lease(self, shard_id, owner, sql, params):
+        """只在租約仍屬於 owner 時更新分片，回傳是否成功"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                sql + " WHERE id = ? AND owner = ? AND status = 'leased'", list(params) + [shard_id, owner]
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, shard_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """延長租約；租約已被其他節點接手時回傳 False"""
+        now = time.time()
+        return self._update_lease(shard_id, owner, 'UPDATE shards SET lease_expires = ?, updated_at = ?',
+                                  (now + lease_seconds, now))
+
+    def complete(self, shard_id, owner, article_count=0):
+        """標記分片完成；租約已被其他節點接手時回傳 False"""
+        return self._update_lease(shard_id, owner,
+                                  "UPDATE shards SET status = 'done', lease_expires = NULL, article_count = ?, "
+                                  "error = NULL, updated_at = ?", (article_count, time.time()))
+
+    def release(self, shard_id, owner, error=None):
+        """爬取失敗時交還分片；達到重試上限的分片標記為 failed"""
+        return self._update_lease(shard_id, owner,
+                                  "UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                  "owner = NULL, lease_expires = NULL, error = ?, updated_at = ?",
+                                  (MAX_ATTEMPTS, error, time.time()))
+
+    def get(self, shard_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM shards WHERE id = ?', (shard_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def progress(self, board=None):
+        """
+        各狀態的分片數與頁數
+
+        Returns:
+            {'pending': {'shards': 3, 'pages': 300}, 'done': {...}, ...}，另含 articles 總數
+        """
+        sql = 'SELECT status, COUNT(*), SUM(end_page - start_page + 1), SUM(article_count) FROM shards'
+        params = []
+        if board:
+            sql += ' WHERE board = ?'
+            params.append(board)
+        result = {'articles': 0}
+        with self._connect() as conn:
+            for status, shards, pages, articles in conn.execute(sql + ' GROUP BY status', params):
+                result[status] = {'shards': shards, 'pages': pages}
+                result['articles'] += articles or 0
+        return result
+
+
+class Lease(object):
+    """
+    以背景執行緒定期延長分片租約
+
+    延長失敗（租約已過期並被其他節點接手）時設定 lost，爬取端應停止輸出。
+    """
+
+    def __init__(self, store, shard, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.store = store
+        self.shard = shard
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        # 每過租約時間的三分之一延長一次，單次延長失敗仍有餘裕重試
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.store.heartbeat(self.shard['id'], self.owner, self.lease_seconds):
+                    print(f"分片 {shard_name(self.shard)} 的租約已被其他節點接手")
+                    self.lost.set()
+                    return
+            except sqlite3.Error as e:
+                print(f"延長分片 {shard_name(self.shard)} 的租約時出錯: {e}")
+
+    def guard(self, records):
+        """逐筆轉交 records，租約遺失後停止"""
+        for record in records:
+            if self.lost.is_set():
+                return
+            yield record
+
+
+def run_worker(store, process, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS, board=None):
+    """
+    持續認領並處理分片，直到沒有可認領的分片
+
+    Args:
+        store: ShardStore
+        process: process(shard, lease) 爬取一個分片並回傳文章數，失敗時拋出例外
+        owner: 工作者識別名稱，預設為主機名稱加行程 ID
+        board: 只認領此看板的分片
+
+    Returns:
+        一個字典，包含本工作者完成的分片數與文章數
+    """
+    owner = owner or default_owner()
+    shards = 0
+    articles = 0
+    while True:
+        shard = store.claim(owner, lease_seconds, board)
+        if shard is None:
+            break
+        name = shard_name(shard)
+        print(f"{owner} 認領分片 {name}（第 {shard['attempts']} 次）")
+        try:
+            with Lease(store, shard, owner, lease_seconds) as lease:
+                count = process(shard, lease)
+        except Exception as e:
+            error_msg = f"爬取分片 {name} 時出錯: {e}"
+            print(error_msg)
+            store.release(shard['id'], owner, error_msg)
+            continue
+        if lease.lost.is_set() or not store.complete(shard['id'], owner, count):
+            print(f"分片 {name} 的租約已遺失，結果交由接手的節點重新產生")
+            continue
+        shards += 1
+        articles += count
+    print(f"{owner} 完成 {shards} 個分片、{articles} 篇文章")
+    return {'owner': owner, 'shards': shards, 'articles': articles}
+
+
+def main(cmdline=None):
+    parser = argparse.ArgumentParser(description='查看分片爬取的進度')
+    parser.add_argument('shards', metavar='SHARD_DB', help='分片表檔案路徑')
+    parser.add_argument('-b', metavar='BOARD_NAME', help='只顯示此看板')
+    args = parser.parse_args(cmdline)
+
+    for status, value in sorted(ShardStore(args.shards).progress(args.b).items()):
+        if status == 'articles':
+            print(f"文章數: {value}")
+        else:
+            print(f"{status}: {value['shards']} 個分片，{value['pages']} 頁")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+文章與推文的 SQLite 儲存層
+
+articles 表每篇文章一列，以 (board, article_id) 為唯一鍵；messages 表每則推文
+一列，以 article_pk 對應文章。寫入時以批次交易 upsert，重複爬取同一篇文章會
+更新內容並以新的推文取代舊的推文。
+"""
+
+import json
+import codecs
+import sqlite3
+from datetime import datetime
+
+from PttWebCrawler.parsers import article_timestamp
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    article_id TEXT NOT NULL,
+    url TEXT,
+    title TEXT,
+    author TEXT,
+    date TEXT,
+    timestamp INTEGER,
+    content TEXT,
+    ip TEXT,
+    push_count INTEGER,
+    push INTEGER,
+    boo INTEGER,
+    neutral INTEGER,
+    message_total INTEGER,
+    crawled_at TEXT NOT NULL,
+    UNIQUE (board, article_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    article_pk INTEGER NOT NULL REFERENCES articles (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    push_tag TEXT,
+    push_userid TEXT,
+    push_content TEXT,
+    push_ipdatetime TEXT,
+    PRIMARY KEY (article_pk, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS articles_board_timestamp ON articles (board, timestamp);
+CREATE INDEX IF NOT EXISTS articles_timestamp ON articles (timestamp);
+CREATE INDEX IF NOT EXISTS articles_author ON articles (author);
+CREATE INDEX IF NOT EXISTS messages_push_userid ON messages (push_userid);
+'''
+
+ARTICLE_COLUMNS = ('board', 'article_id', 'url', 'title', 'author', 'date', 'timestamp', 'content', 'ip',
+                   'push_count', 'push', 'boo', 'neutral', 'message_total', 'crawled_at')
+
+INSERT_SQL = 'INSERT INTO articles ({}) VALUES ({})'.format(
+    ', '.join(ARTICLE_COLUMNS), ', '.join(':' + column for column in ARTICLE_COLUMNS))
+
+# 完整文章以新的內容覆寫所有欄位
+UPSERT_ARTICLE_SQL = INSERT_SQL + ' ON CONFLICT (board, article_id) DO UPDATE SET ' + ', '.join(
+    f'{column} = excluded.{column}' for column in ARTICLE_COLUMNS[2:])
+
+# 列表資訊（-l）的作者、日期格式較簡略，已存在的文章只更新推文數
+UPSERT_ROW_SQL = INSERT_SQL + (' ON CONFLICT (board, article_id) DO UPDATE SET '
+                               'push_count = excluded.push_count, crawled_at = excluded.crawled_at')
+
+MESSAGE_FIELDS = ('push_tag', 'push_userid', 'push_content', 'push_ipdatetime')
+
+
+def article_row(article, board=None):
+    """將 parse() 的文章字典或列表資訊轉成 articles 表的欄位"""
+    message_count = article.get('message_count') or {}
+    return {
+        'board': article.get('board') or board or '',
+        'article_id': article['article_id'],
+        'url': article.get('url'),
+        'title': article.get('article_title') or article.get('title'),
+        'author': article.get('author'),
+        'date': article.get('date'),
+        'timestamp': article_timestamp(article['article_id']),
+        'content': article.get('content'),
+        'ip': article.get('ip'),
+        'push_count': message_count.get('count', article.get('push_count')),
+        'push': message_count.get('push'),
+        'boo': message_count.get('boo'),
+        'neutral': message_count.get('neutral'),
+        'message_total': message_count.get('all'),
+        'crawled_at': datetime.now().isoformat(),
+    }
+
+
+def load_articles(path):
+    """讀取爬蟲輸出的 JSON（{"articles": [...]} 或單篇文章）或 JSON Lines 檔案"""
+    with codecs.open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    for article in (data.get('articles', [data]) if isinstance(data, dict) else data):
+        yield article
+
+
+class ArticleStore(object):
+    """
+    以 SQLite 保存文章與推文
+
+    Args:
+        path: SQLite 檔案路徑
+        batch_size: 每次交易寫入的文章數
+    """
+
+    def __init__(self, path, batch_size=200):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def upsert(self, articles, board=None):
+        """在同一個交易中寫入多篇文章，沒有文章 ID 或解析失敗的項目會被略過，回傳寫入數量"""
+        count = 0
+        with self.conn:
+            for article in articles:
+                if not article.get('article_id') or 'error' in article:
+                    continue
+                row = article_row(article, board)
+                self.conn.execute(UPSERT_ARTICLE_SQL if 'content' in article else UPSERT_ROW_SQL, row)
+                if 'messages' in article:
+                    article_pk = self.conn.execute(
+                        'SELECT id FROM articles WHERE board = ? AND article_id = ?',
+                        (row['board'], row['article_id'])
+                    ).fetchone()[0]
+                    self.conn.execute('DELETE FROM messages WHERE article_pk = ?', (article_pk,))
+                    self.conn.executemany(
+                        'INSERT INTO messages (article_pk, seq, push_tag, push_userid, push_content, push_ipdatetime) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        [(article_pk, seq) + tuple(message.get(field) for field in MESSAGE_FIELDS)
+                         for seq, message in enumerate(article['messages'])]
+                    )
+                count += 1
+        return count
+
+    def iter_write(self, records, board=None):
+        """逐筆轉交 records，同時每累積 batch_size 筆就寫入一次，可串接在其他輸出之前"""
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.upsert(batch, board)
+                batch = []
+            yield record
+        if batch:
+            self.upsert(batch, board)
+
+    def write(self, records, board=None):
+        """寫入所有 records，回傳筆數"""
+        count = 0
+        for _ in self.iter_write(records, board):
+            count += 1
+        return count
+
+    def push_counts(self, board, article_ids):
+        """
+        已保存完整內容的文章推噓相抵數量
+
+        Returns:
+            {文章 ID: push_count}；不存在或只有列表資訊的文章不會出現在結果中
+        """
+        ids = list(article_ids)
+        result = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            result.update(self.conn.execute(
+                'SELECT article_id, push_count FROM articles WHERE board = ? AND content IS NOT NULL '
+                'AND article_id IN ({})'.format(', '.join('?' * len(chunk))),
+                [board] + chunk
+            ).fetchall())
+        return result
+
+    def merge_messages(self, article, board=None):
+        """
+        以重新抓取的文章更新推文：只附加新的推文並更新推文統計，不覆寫內文
+
+        先確認已保存的最後一則推文與新資料同一位置的推文相同；推文被刪除或文章
+        尚未保存時改以 upsert 覆寫整篇文章。
+
+        Returns:
+            新增的推文數；改為覆寫整篇文章時回傳 None
+        """
+        row = article_row(article, board)
+        messages = article.get('messages') or []
+        stored = self.conn.execute(
+            'SELECT id FROM articles WHERE board = ? AND article_id = ? AND content IS NOT NULL',
+            (row['board'], row['article_id'])
+        ).fetchone()
+        if stored is not None:
+            article_pk = stored['id']
+            count = self.conn.execute('SELECT COUNT(*) FROM messages WHERE article_pk = ?', (article_pk,)).fetchone()[0]
+            last = self.conn.execute(
+                'SELECT push_tag, push_userid, push_content, push_ipdatetime FROM messages WHERE article_pk = ? AND seq = ?',
+                (article_pk, count - 1)
+            ).fetchone()
+            if len(messages) >= count and (
+                    count == 0 or tuple(last) == tuple(messages[count - 1].get(field) for field in MESSAGE_FIELDS)):
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT INTO messages (article_pk, seq, push_tag, push_userid, push_content, push_ipdatetime) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        [(article_pk, seq) + tuple(message.get(field) for field in MESSAGE_FIELDS)
+                         for seq, message in enumerate(messages[count:], count)]
+                    )
+                    self.conn.execute(
+                        'UPDATE articles SET push_count = :push_count, push = :push, boo = :boo, neutral = :neutral, '
+                        'message_total = :message_total, crawled_at = :crawled_at WHERE id = :id',
+                        dict(row, id=article_pk)
+                    )
+                return len(messages) - count
+        self.upsert([article], board)
+        return None
+
+    def get(self, board, article_id):
+        """讀取一篇文章，格式與 parse() 相同；不存在時回傳 None"""
+        row = self.conn.execute(
+            'SELECT * FROM articles WHERE board = ? AND article_id = ?', (board, article_id)
+        ).fetchone()
+        if row is None:
+            return None
+        messages = self.conn.execute(
+            'SELECT push_tag, push_userid, push_content, push_ipdatetime FROM messages WHERE article_pk = ? ORDER BY seq',
+            (row['id'],)
+        ).fetchall()
+        return {
+            'url': row['url'],
+            'board': row['board'],
+            'article_id': row['article_id'],
+            'article_title': row['title'],
+            'author': row['author'],
+            'date': row['date'],
+            'content': row['content'],
+            'ip': row['ip'],
+            'message_count': {'all': row['message_total'], 'count': row['push_count'], 'push': row['push'],
+                              'boo': row['boo'], 'neutral': row['neutral']},
+            'messages': [dict(message) for message in messages],
+        }
+
+    def find(self, board=None, author=None, push_userid=None, since=None, until=None, limit=100):
+        """
+        依條件查詢文章摘要（不含內文與推文），依發文時間由新到舊排序
+
+        Args:
+            since, until: 發文時間範圍（Unix time）
+            push_userid: 只回傳此帳號有推文的文章
+        """
+        sql = 'SELECT a.board, a.article_id, a.title, a.author, a.date, a.timestamp, a.push_count FROM articles a'
+        filters = []
+        params = []
+        if push_userid:
+            filters.append('a.id IN (SELECT article_pk FROM messages WHERE push_userid = ?)')
+            params.append(push_userid)
+        if board:
+            filters.append('a.board = ?')
+            params.append(board)
+        if author:
+            filters.append("(a.author = ? OR a.author LIKE ? || ' (%')")
+            params.extend([author, author])
+        if since is not None:
+            filters.append('a.timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            filters.append('a.timestamp < ?')
+            params.append(until)
+        if filters:
+            sql += ' WHERE ' + ' AND '.join(filters)
+        sql += ' ORDER BY a.timestamp DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(sql, params)]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+看板增量同步的進度紀錄
+
+每個看板記錄上次處理到的列表頁碼，以及已處理的最新文章（發文時間與文章 ID），
+下次同步時只抓取在這個位置之後出現的列表頁與文章。
+"""
+
+import os
+import json
+import codecs
+from datetime import datetime
+
+from PttWebCrawler.parsers import article_timestamp
+
+DEFAULT_SYNC_STATE = 'ptt_sync_state.json'
+
+
+def article_mark(article_id):
+    """文章在看板上的先後順序鍵值：(發文時間, 文章 ID)"""
+    return (article_timestamp(article_id) or 0, article_id)
+
+
+def is_permanent_error(article):
+    """
+    錯誤字典是否代表重抓也不會成功的失敗
+
+    4xx 回應（429 除外，屬於限速）與找不到文章內容屬於永久失敗，例如文章已被刪除；
+    5xx、年齡驗證失敗與連線問題屬於暫時失敗，下次同步應重試。
+    """
+    status_code = article.get('status_code')
+    if status_code is not None:
+        return 400 <= status_code < 500 and status_code != 429
+    return article.get('error') == 'main-content not found'
+
+
+class SyncState(object):
+    """
+    以 JSON 檔保存各看板的同步位置
+
+    檔案內容為 {看板: {'last_page', 'last_article_id', 'last_timestamp', 'synced_at'}}
+    """
+
+    def __init__(self, path=DEFAULT_SYNC_STATE):
+        self.path = path
+        self.boards = {}
+        if os.path.exists(path):
+            with codecs.open(path, 'r', encoding='utf-8') as f:
+                self.boards = json.load(f)
+
+    def get(self, board):
+        return self.boards.get(board)
+
+    def high_water_mark(self, board):
+        """回傳已處理的最新文章鍵值，尚未同步過時回傳 None"""
+        record = self.get(board)
+        if not record or not record.get('last_article_id'):
+            return None
+        return (record.get('last_timestamp') or 0, record['last_article_id'])
+
+    def set(self, board, record):
+        """直接設定看板的同步紀錄，例如 sync_board(save=False) 回傳的 sync"""
+        self.boards[board] = record
+
+    def update(self, board, last_page, mark):
+        self.boards[board] = {
+            'last_page': last_page,
+            'last_article_id': mark[1] if mark else None,
+            'last_timestamp': mark[0] if mark else None,
+            'synced_at': datetime.now().isoformat(),
+        }
+
+    def save(self):
+        # 先寫入暫存檔再取代，避免中途失敗留下損毀的紀錄
+        tmp_path = self.path + '.tmp'
+        with codecs.open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.boards, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
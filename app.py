@@ -1,8 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import json
 import sys
 import os
 import logging
+import threading
 import traceback
 
 # 設置基本日誌配置
@@ -16,6 +17,10 @@ logging.basicConfig(
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from PttWebCrawler.crawler import PttWebCrawler
 from PttWebCrawler.error_handlers import get_error_response
+from PttWebCrawler.jobs import JobStore, JobManager, JOB_MODES, DEFAULT_JOBS_DB
+from PttWebCrawler.result_cache import ResultCache, DEFAULT_RESULT_CACHE
+from PttWebCrawler.search_index import SearchIndex, DEFAULT_SEARCH_INDEX
+from PttWebCrawler.filters import ArticleFilter
 
 # 檢測是否在 Azure 環境中運行
 IS_AZURE = 'AZURE_FUNCTIONS_ENVIRONMENT' in os.environ or 'WEBSITE_SITE_NAME' in os.environ
@@ -33,6 +38,120 @@ if IS_AZURE:
 
 app = Flask(__name__)
 
+# 背景爬取工作管理器，第一次使用時才建立
+job_manager = None
+job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """取得背景工作管理器，建立時一併接手先前中斷的工作"""
+    global job_manager
+    if job_manager is None:
+        # 同時到達的第一批請求只建立一個管理器
+        with job_manager_lock:
+            if job_manager is None:
+                manager = JobManager(
+                    JobStore(DEFAULT_JOBS_DB),
+                    max_workers=int(os.environ.get('PTT_JOB_WORKERS', 2))
+                )
+                resumed = manager.resume_stale()
+                if resumed:
+                    app.logger.info(f"接手 {len(resumed)} 個中斷的爬取工作")
+                job_manager = manager
+    return job_manager
+
+
+# 跨 worker 共用的 API 結果快取，第一次使用時才建立
+result_cache = None
+
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        max_mb = int(os.environ.get('PTT_RESULT_CACHE_MB', 64))
+        result_cache = ResultCache(DEFAULT_RESULT_CACHE, max_bytes=max_mb * 1024 * 1024)
+    return result_cache
+
+
+def cached_json(endpoint, key):
+    """快取中有未過期的結果時回傳帶 X-Cache: HIT 的回應，否則回傳 None"""
+    try:
+        cached = get_result_cache().get(endpoint, key)
+    except Exception as e:
+        app.logger.warning(f"讀取結果快取失敗: {e}")
+        return None
+    if cached is None:
+        return None
+    data, age = cached
+    response = jsonify(data)
+    response.headers['X-Cache'] = 'HIT'
+    response.headers['Age'] = str(age)
+    return response
+
+
+def store_json(endpoint, key, data):
+    """將結果寫入快取，回傳帶 X-Cache: MISS 的回應"""
+    try:
+        get_result_cache().set(endpoint, key, data)
+    except Exception as e:
+        app.logger.warning(f"寫入結果快取失敗: {e}")
+    response = jsonify(data)
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+
+def wants_stream():
+    """是否要求以 NDJSON 串流回應（stream=1）"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def ndjson_response(records, error_log, request_info):
+    """
+    將文章逐筆以 NDJSON 串流回傳，每爬完一篇就送出一行
+
+    最後一行為 {"summary": {...}}，包含總筆數、錯誤紀錄與請求參數
+    """
+    def generate():
+        count = 0
+        try:
+            for record in records:
+                count += 1
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        except Exception as e:
+            app.logger.error(f"串流爬取時發生異常: {e}")
+            error_log.append(f"串流爬取時發生異常: {e}")
+        summary = {'count': count, 'errors': error_log, 'request_info': request_info}
+        yield json.dumps({'summary': summary}, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def apply_time_window(board, start_idx, end_idx, timeout=10):
+    """
+    處理 since/until 參數：未提供 start/end 時以二分搜尋列表頁換算成頁碼範圍，
+    並建立在抓取前略過範圍外文章的 ArticleFilter
+
+    Returns:
+        (start, end, ArticleFilter 或 None, 回應)：回應不為 None 時應直接回傳
+        （時間格式錯誤，或範圍內沒有文章）
+    """
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    if not (since or until):
+        return start_idx, end_idx, None, None
+    try:
+        article_filter = ArticleFilter(since=since, until=until)
+    except ValueError as e:
+        return start_idx, end_idx, None, (jsonify({"error": f"since/until 格式錯誤: {e}"}), 400)
+    if start_idx and end_idx:
+        return start_idx, end_idx, article_filter, None
+    page_range = PttWebCrawler(as_lib=True).find_page_range(board, article_filter.since, article_filter.until, timeout)
+    if page_range is None:
+        return start_idx, end_idx, None, jsonify({'articles': [], 'pages': None})
+    app.logger.info(f"{board} 板 since={since} until={until} 對應頁數 {page_range[0]}-{page_range[1]}")
+    return str(page_range[0]), str(page_range[1]), article_filter, None
+
+
 @app.route('/api/articles', methods=['GET'])
 def get_articles():
     """爬取特定看板的文章，可用頁數範圍"""
@@ -46,6 +165,10 @@ def get_articles():
         return jsonify({"error": "必須提供看板名稱 (board)"}), 400
     
     try:
+        start_idx, end_idx, article_filter, response = apply_time_window(board, start_idx, end_idx)
+        if response is not None:
+            return response
+        
         # 如果提供了起始與結束頁數
         if start_idx and end_idx:
             start_idx = int(start_idx)
@@ -53,10 +176,17 @@ def get_articles():
             
             # 初始化爬蟲
             crawler = PttWebCrawler(as_lib=True)
-            articles = crawler.parse_articles(start_idx, end_idx, board)
+            
+            if wants_stream():
+                error_log = []
+                records = crawler.iter_articles(start_idx, end_idx, board, error_log=error_log,
+                                                article_filter=article_filter)
+                return ndjson_response(records, error_log, {'board': board, 'start': start_idx, 'end': end_idx})
+            
+            articles = crawler.parse_articles(start_idx, end_idx, board, article_filter=article_filter)
             return jsonify(articles)
         else:
-            return jsonify({"error": "必須提供起始頁 (start) 和結束頁 (end)"}), 400
+            return jsonify({"error": "必須提供起始頁 (start) 和結束頁 (end)，或時間範圍 (since、until)"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -69,34 +199,63 @@ def get_article_by_id(article_id):
     if not board:
         return jsonify({"error": "必須提供看板名稱 (board)"}), 400
     
+    cache_key = f"{board}/{article_id}"
+    cached = cached_json('article', cache_key)
+    if cached is not None:
+        return cached
+    
     try:
         # 初始化爬蟲
         crawler = PttWebCrawler(as_lib=True)
         article = crawler.parse_article(article_id, board)
-        return jsonify(article)
+        if 'error' in article:
+            return jsonify(article)
+        return store_json('article', cache_key, article)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/search', methods=['GET'])
 def search_articles():
-    """搜尋特定關鍵字的文章"""
+    """以 PTT 看板搜尋頁搜尋特定關鍵字的文章"""
     board = request.args.get('board', '')
     keyword = request.args.get('keyword', '')
+    author = request.args.get('author', '') or None
+    recommend = request.args.get('recommend', '')
     
     # 參數檢查
     if not board:
         return jsonify({"error": "必須提供看板名稱 (board)"}), 400
-    if not keyword:
-        return jsonify({"error": "必須提供關鍵字 (keyword)"}), 400
+    if not keyword and not author and not recommend:
+        return jsonify({"error": "必須提供關鍵字 (keyword) 或篩選條件 (author、recommend)"}), 400
+    try:
+        recommend = int(recommend) if recommend else None
+        max_pages = int(request.args.get('max_pages', 5))
+    except ValueError:
+        return jsonify({"error": "recommend 和 max_pages 必須為整數"}), 400
+    if max_pages <= 0:
+        return jsonify({"error": "max_pages 必須大於 0"}), 400
+    fetch_content = request.args.get('content', '').lower() in ('1', 'true', 'yes')
+    
+    # backend=index 時查詢本地全文索引，不需要連線到 PTT
+    if request.args.get('backend', 'ptt') == 'index':
+        if not os.path.exists(DEFAULT_SEARCH_INDEX):
+            return jsonify({"error": "尚未建立本地搜尋索引"}), 503
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            return jsonify({"error": "limit 必須為整數"}), 400
+        index = SearchIndex(DEFAULT_SEARCH_INDEX)
+        try:
+            articles = index.search(keyword, board=board, author=author, recommend=recommend, limit=limit)
+        finally:
+            index.close()
+        return jsonify({'articles': articles, 'query': keyword, 'backend': 'index'})
     
     try:
-        # 初始化爬蟲 (這個功能需要確認原專案是否支援關鍵字搜尋)
         crawler = PttWebCrawler(as_lib=True)
-        # 若原專案有實現，可以使用
-        # articles = crawler.search_articles(keyword, board)
-        
-        # 若原專案未實現，可以先回傳未實現訊息
-        return jsonify({"error": "關鍵字搜尋功能尚未實現"}), 501
+        result = crawler.search_articles(keyword, board, max_pages=max_pages, author=author,
+                                         recommend=recommend, fetch_content=fetch_content)
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -118,6 +277,10 @@ def get_articles_list():
         return jsonify({"error": "必須提供看板名稱 (board)"}), 400
     
     try:
+        start_idx, end_idx, article_filter, response = apply_time_window(board, start_idx, end_idx)
+        if response is not None:
+            return response
+        
         # 如果提供了起始與結束頁數
         if start_idx and end_idx:
             try:
@@ -141,6 +304,15 @@ def get_articles_list():
                 app.logger.warning(f"超時參數過小: timeout={timeout}")
                 timeout = 5  # 確保最小超時時間
             
+            cache_key = f"{board}/{start_idx}-{end_idx}"
+            if article_filter is not None:
+                cache_key += f"/{article_filter.since}-{article_filter.until}"
+            if not wants_stream():
+                cached = cached_json('list', cache_key)
+                if cached is not None:
+                    app.logger.info(f"{board} 板文章列表 {start_idx}-{end_idx} 命中結果快取")
+                    return cached
+            
             app.logger.info(f"開始爬取 {board} 板的文章列表，頁數: {start_idx}-{end_idx}")
             
             # 初始化爬蟲
@@ -172,9 +344,21 @@ def get_articles_list():
                 except Exception as e:
                     app.logger.warning(f"獲取網路診斷資訊失敗: {e}")
             
+            if wants_stream():
+                error_log = []
+                records = crawler.iter_list_articles(start_idx, end_idx, board, timeout=timeout, error_log=error_log,
+                                                     article_filter=article_filter)
+                return ndjson_response(records, error_log, {
+                    'board': board,
+                    'start': start_idx,
+                    'end': end_idx,
+                    'timeout': timeout
+                })
+            
             # 嘗試執行爬蟲操作
             try:
-                result = crawler.parse_list_articles(start_idx, end_idx, board, timeout=timeout)
+                result = crawler.parse_list_articles(start_idx, end_idx, board, timeout=timeout,
+                                                     article_filter=article_filter)
             except Exception as e:
                 app.logger.error(f"爬蟲執行時發生異常: {e}")
                 app.logger.error(f"異常詳情: {traceback.format_exc()}")
@@ -212,10 +396,13 @@ def get_articles_list():
                             }
                         }
             
+            # 只快取完整成功的結果，避免把暫時性的錯誤保留到 TTL 結束
+            if result.get('articles') and not result.get('errors'):
+                return store_json('list', cache_key, result)
             return jsonify(result)
         else:
             app.logger.warning("缺少必要參數: 起始頁或結束頁")
-            return jsonify({"error": "必須提供起始頁 (start) 和結束頁 (end)"}), 400
+            return jsonify({"error": "必須提供起始頁 (start) 和結束頁 (end)，或時間範圍 (since、until)"}), 400
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -229,6 +416,70 @@ def get_articles_list():
             "trace": error_details.split('\n')[-10:] if 'DEBUG' in os.environ else "啟用 DEBUG 環境變數以查看詳細堆疊追蹤"
         }), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """建立背景爬取工作，立即回傳工作 ID"""
+    params = request.get_json(silent=True) or request.form
+    board = params.get('board', '')
+    mode = params.get('mode', 'articles')
+    
+    # 參數檢查
+    if not board:
+        return jsonify({"error": "必須提供看板名稱 (board)"}), 400
+    if mode not in JOB_MODES:
+        return jsonify({"error": f"mode 必須是 {', '.join(JOB_MODES)} 其中之一"}), 400
+    try:
+        start_idx = int(params.get('start', ''))
+        end_idx = int(params.get('end', ''))
+    except (TypeError, ValueError):
+        return jsonify({"error": "必須提供整數的起始頁 (start) 和結束頁 (end)"}), 400
+    if end_idx != -1 and end_idx < start_idx:
+        return jsonify({"error": "結束頁數不能小於起始頁數"}), 400
+    
+    job_id = get_job_manager().submit(board, start_idx, end_idx, mode)
+    app.logger.info(f"建立爬取工作 {job_id}: board={board}, start={start_idx}, end={end_idx}, mode={mode}")
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "results_url": f"/api/jobs/{job_id}/results"
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查詢背景工作的進度"""
+    job = get_job_manager().store.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到指定的工作"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    """分頁取得背景工作的結果，工作執行中也可以取得已完成的部分"""
+    store = get_job_manager().store
+    job = store.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到指定的工作"}), 404
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"error": "offset 和 limit 必須為整數"}), 400
+    if offset < 0 or limit <= 0:
+        return jsonify({"error": "offset 不可小於 0，limit 必須大於 0"}), 400
+    limit = min(limit, 1000)
+    
+    results = store.results(job_id, offset, limit)
+    next_offset = offset + len(results)
+    return jsonify({
+        "job_id": job_id,
+        "status": job['status'],
+        "total": job['article_count'],
+        "offset": offset,
+        "limit": limit,
+        "results": results,
+        "next_offset": next_offset if next_offset < job['article_count'] else None
+    })
+
 # 添加簡單的文檔頁面
 @app.route('/', methods=['GET'])
 def index():
@@ -253,8 +504,10 @@ def index():
                 <div class="url">/api/articles?board={board}&start={start_idx}&end={end_idx}</div>
                 <div class="params">
                     <div class="param"><strong>board</strong>: PTT 看板名稱 (必填)</div>
-                    <div class="param"><strong>start</strong>: 起始頁數 (必填)</div>
-                    <div class="param"><strong>end</strong>: 結束頁數 (必填)</div>
+                    <div class="param"><strong>start</strong>: 起始頁數 (未提供 since、until 時必填)</div>
+                    <div class="param"><strong>end</strong>: 結束頁數 (未提供 since、until 時必填)</div>
+                    <div class="param"><strong>since</strong>, <strong>until</strong>: 發文時間範圍，例如 2024-01-31 或 Unix time，未提供 start、end 時自動換算成頁數，範圍外的文章在抓取前略過 (選填)</div>
+                    <div class="param"><strong>stream</strong>: 設為 1 時以 NDJSON 逐篇串流回傳 (選填)</div>
                 </div>
             </div>
             
@@ -272,17 +525,51 @@ def index():
                 <div class="url">/api/search?board={board}&keyword={keyword}</div>
                 <div class="params">
                     <div class="param"><strong>board</strong>: PTT 看板名稱 (必填)</div>
-                    <div class="param"><strong>keyword</strong>: 搜尋關鍵字 (必填)</div>
+                    <div class="param"><strong>keyword</strong>: 搜尋關鍵字 (keyword、author、recommend 至少提供一項)</div>
+                    <div class="param"><strong>author</strong>: 只搜尋此作者的文章 (選填)</div>
+                    <div class="param"><strong>recommend</strong>: 推文數下限 (選填)</div>
+                    <div class="param"><strong>max_pages</strong>: 最多抓取的搜尋結果頁數 (選填，預設 5)</div>
+                    <div class="param"><strong>content</strong>: 設為 1 時抓取每篇文章的完整內容 (選填)</div>
+                    <div class="param"><strong>backend</strong>: 設為 index 時查詢本地全文索引，不連線到 PTT (選填)</div>
                 </div>
             </div>
 
             <div class="endpoint">
                 <div class="method">GET</div>
                 <div class="url">/api/articles/list?board={board}&start={start_idx}&end={end_idx}</div>
+                <div class="params">
+                    <div class="param"><strong>board</strong>: PTT 看板名稱 (必填)</div>
+                    <div class="param"><strong>start</strong>: 起始頁數 (未提供 since、until 時必填)</div>
+                    <div class="param"><strong>end</strong>: 結束頁數 (未提供 since、until 時必填)</div>
+                    <div class="param"><strong>since</strong>, <strong>until</strong>: 發文時間範圍，未提供 start、end 時自動換算成頁數，只回傳範圍內的文章 (選填)</div>
+                    <div class="param"><strong>stream</strong>: 設為 1 時以 NDJSON 逐筆串流回傳 (選填)</div>
+                </div>
+            </div>
+            <div class="endpoint">
+                <div class="method">POST</div>
+                <div class="url">/api/jobs</div>
                 <div class="params">
                     <div class="param"><strong>board</strong>: PTT 看板名稱 (必填)</div>
                     <div class="param"><strong>start</strong>: 起始頁數 (必填)</div>
-                    <div class="param"><strong>end</strong>: 結束頁數 (必填)</div>
+                    <div class="param"><strong>end</strong>: 結束頁數，-1 表示最後一頁 (必填)</div>
+                    <div class="param"><strong>mode</strong>: articles 爬取文章內容，list 只爬取列表資訊 (選填，預設 articles)</div>
+                </div>
+            </div>
+
+            <div class="endpoint">
+                <div class="method">GET</div>
+                <div class="url">/api/jobs/{job_id}</div>
+                <div class="params">
+                    <div class="param">查詢工作狀態 (queued、running、finished、failed) 與進度</div>
+                </div>
+            </div>
+
+            <div class="endpoint">
+                <div class="method">GET</div>
+                <div class="url">/api/jobs/{job_id}/results?offset={offset}&limit={limit}</div>
+                <div class="params">
+                    <div class="param"><strong>offset</strong>: 起始筆數 (選填，預設 0)</div>
+                    <div class="param"><strong>limit</strong>: 每次回傳筆數，最多 1000 (選填，預設 100)</div>
                 </div>
             </div>
         </body>
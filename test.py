@@ -1,7 +1,70 @@
 # -*- coding: utf-8 -*-
 import unittest
 from PttWebCrawler.crawler import PttWebCrawler as crawler
-import codecs, json, os
+from PttWebCrawler.ratelimit import RateLimiter, TokenBucket
+from PttWebCrawler.session import SessionManager
+from PttWebCrawler.cache import ResponseCache, url_class
+from PttWebCrawler.jobs import JobStore, JobManager
+from PttWebCrawler.shards import ShardStore
+from PttWebCrawler.sync import SyncState
+from PttWebCrawler.filters import ArticleFilter, load_article_ids
+from PttWebCrawler.priority import Budget
+from PttWebCrawler.result_cache import ResultCache
+from PttWebCrawler.search_index import SearchIndex, tokenize
+from PttWebCrawler.storage import ArticleStore
+from PttWebCrawler import export, parsers
+from PttWebCrawler.models import Article, ArticleError
+import codecs, json, os, shutil, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+
+
+INDEX_HTML = u'''<div class="r-ent">
+<div class="nrec"><span class="hl f3">12</span></div>
+<div class="title"><a href="/bbs/Test/M.1500000001.A.001.html">[問題] 第一篇</a></div>
+<div class="meta"><div class="author">alice</div><div class="date"> 7/14</div></div>
+</div>
+<div class="r-ent">
+<div class="nrec"></div>
+<div class="title">(本文已被刪除) [bob]</div>
+<div class="meta"><div class="author">-</div><div class="date"> 7/14</div></div>
+</div>
+<div class="r-ent">
+<div class="nrec"><span class="hl f1">爆</span></div>
+<div class="title"><a href="/bbs/Test/M.1500000002.A.002.html">[新聞] 第二篇</a></div>
+<div class="meta"><div class="author">carol</div><div class="date"> 7/15</div></div>
+</div>
+<div class="r-ent">
+<div class="nrec"><span class="hl f1">X3</span></div>
+<div class="title"><a href="/bbs/Test/M.1500000003.A.003.html">Re: [問題] 第一篇</a></div>
+<div class="meta"><div class="author">dave</div><div class="date"> 7/15</div></div>
+</div>
+<div class="btn-group-paging"><a class="btn wide" href="/bbs/Test/index1.html">最舊</a><a class="btn wide" href="/bbs/Test/index1.html">&lsaquo; 上頁</a></div>
+'''
+
+ARTICLE_HTML = u'''<html><body><div id="main-content" class="bbs-screen bbs-content"><div class="article-metaline"><span class="article-meta-tag">作者</span><span class="article-meta-value">alice (愛麗絲)</span></div><div class="article-metaline-right"><span class="article-meta-tag">看板</span><span class="article-meta-value">Test</span></div><div class="article-metaline"><span class="article-meta-tag">標題</span><span class="article-meta-value">[問題] 測試&amp;標題</span></div><div class="article-metaline"><span class="article-meta-tag">時間</span><span class="article-meta-value">Mon Sep  1 08:38:00 2014</span></div>
+第一行內容 hello world!!
+<span class="hl f3">紅字</span>尾巴 <a href="http://example.com/x?a=1">http://example.com/x?a=1</a>
+<!-- a comment -->
+--
+<span class="f2">※ 發信站: 批踢踢實業坊(ptt.cc), 來自: 114.34.56.78
+</span><span class="f2">※ 文章網址: <a href="https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html">https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html</a>
+</span><div class="push"><span class="hl push-tag">推 </span><span class="f3 hl push-userid">bob</span><span class="f3 push-content">: 好文 <a href="http://tinyurl.com/4arw47s">http://tinyurl.com/4arw47s</a> 讚</span><span class="push-ipdatetime"> 09/01 08:40
+</span></div><div class="push"><span class="f1 hl push-tag">噓 </span><span class="f3 hl push-userid">carol</span><span class="f3 push-content">: 不好</span><span class="push-ipdatetime"> 09/01 08:41
+</span></div><div class="push"><span class="f1 hl push-tag">→ </span><span class="f3 hl push-userid">dave</span><span class="f3 push-content">:</span><span class="push-ipdatetime"> 09/01 08:42
+</span></div><div class="push center warning-box">檔案過大！部分文章無法顯示</div>
+</div></body></html>
+'''
+
+
+def fake_response(text, status_code=200):
+    resp = mock.Mock()
+    resp.status_code = status_code
+    resp.text = text
+    resp.content = text.encode('utf-8')
+    resp.url = ''
+    return resp
 
 
 class TestCrawler(unittest.TestCase):
@@ -67,5 +130,804 @@ class TestCrawler(unittest.TestCase):
                 self.fail("getLastPage() raised Exception.")
 
 
+class TestCrawlerOffline(unittest.TestCase):
+    def test_parse_html_backends_agree(self):
+        link = 'https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html'
+        article_id = 'M.1409529482.A.9D3'
+        data = crawler.parse_html(ARTICLE_HTML, link, article_id, 'Test', backend='lxml')
+        self.assertEqual(data, crawler.parse_html(ARTICLE_HTML, link, article_id, 'Test', backend='bs4'))
+        self.assertEqual(data['author'], u'alice (愛麗絲)')
+        self.assertEqual(data['article_title'], u'[問題] 測試&標題')
+        self.assertEqual(data['ip'], '114.34.56.78')
+        self.assertEqual(data['content'], u'第一行內容 hello world 紅字 尾巴 http://example.com/x?a=1')
+        self.assertEqual(data['message_count'], {'all': 3, 'count': 0, 'push': 1, 'boo': 1, 'neutral': 1})
+        self.assertIn('http://tinyurl.com/4arw47s', data['messages'][0]['push_content'])
+
+    def test_parse_record_matches_json_wrapper(self):
+        link = 'https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html'
+        article_id = 'M.1409529482.A.9D3'
+        with mock.patch('requests.Session.get', return_value=fake_response(ARTICLE_HTML)):
+            record = crawler.parse_record(link, article_id, 'Test')
+            text = crawler.parse(link, article_id, 'Test')
+        self.assertIsInstance(record, Article)
+        self.assertEqual(record.message_count.push, 1)
+        self.assertEqual(record.messages[1].push_userid, 'carol')
+        self.assertEqual(record.to_json(), text)
+        self.assertEqual(Article.from_dict(json.loads(text)), record)
+
+        with mock.patch('requests.Session.get', return_value=fake_response('', 404)):
+            with self.assertRaises(ArticleError) as error:
+                crawler.parse_record(link, article_id, 'Test')
+            self.assertEqual(json.loads(crawler.parse(link, article_id, 'Test')), {'error': 'invalid url', 'status_code': 404})
+        self.assertEqual(error.exception.data['status_code'], 404)
+
+    def test_parse_index_rows(self):
+        rows = crawler.parse_index_rows(INDEX_HTML)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['article_id'], 'M.1500000001.A.001')
+        self.assertEqual(rows[0]['url'], 'https://www.ptt.cc/bbs/Test/M.1500000001.A.001.html')
+        self.assertEqual(rows[0]['author'], 'alice')
+        self.assertEqual(rows[0]['push_count'], 12)
+        self.assertIsNone(rows[1]['url'])
+        self.assertEqual(rows[1]['title'], u'(本文已被刪除) [bob]')
+        self.assertEqual(rows[2]['push_count'], 100)
+        self.assertEqual(rows[3]['push_count'], -3)
+        self.assertEqual(rows, crawler._parse_index_rows_bs4(INDEX_HTML))
+
+    def fake_parse(self, link, article_id, board, timeout=3):
+        if article_id.endswith('002'):
+            raise ValueError('broken article')
+        return Article.from_dict({'article_id': article_id, 'board': board})
+
+    @staticmethod
+    def index_row(article_id):
+        """fetch_index_rows 回傳的列表項目"""
+        return {'title': '', 'url': 'https://www.ptt.cc/bbs/Test/%s.html' % article_id, 'article_id': article_id,
+                'author': '', 'date': '', 'push_count': 0, 'push_count_text': ''}
+
+    @mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML))
+    def test_parse_articles_with_workers_keeps_index_order(self, _get):
+        with mock.patch.object(crawler, 'parse_record', side_effect=self.fake_parse):
+            result = crawler(as_lib=True).parse_articles(1, 2, 'Test', workers=4)
+            error_log = []
+            list(crawler(as_lib=True).iter_articles(1, 1, 'Test', workers=4, error_log=error_log))
+        ids = [a['article_id'] for a in result['articles']]
+        self.assertEqual(ids, ['M.1500000001.A.001', 'M.1500000003.A.003'] * 2)
+        # 錯誤訊息指向失敗的文章，而不是本頁最後一篇
+        self.assertEqual(len(error_log), 1)
+        self.assertIn('M.1500000002.A.002', error_log[0])
+
+    def test_stream_endpoints_emit_ndjson_with_summary(self):
+        import app as api
+        def fake_iter_articles(self, start, end, board, error_log=None, article_filter=None, **kwargs):
+            yield {'article_id': 'M.1500000001.A.001', 'board': board}
+            error_log.append('處理文章 M.1500000002.A.002 時出錯: broken article')
+            yield {'article_id': 'M.1500000003.A.003', 'board': board}
+        def fake_iter_list_articles(self, start, end, board, timeout=10, error_log=None, article_filter=None, **kwargs):
+            yield {'article_id': 'M.1500000001.A.001', 'push_count': 12}
+            raise RuntimeError('connection reset')
+
+        client = api.app.test_client()
+        with mock.patch.object(crawler, 'iter_articles', fake_iter_articles), \
+                mock.patch.object(crawler, 'iter_list_articles', fake_iter_list_articles):
+            # 串流回應須在下一個請求之前讀完
+            articles = client.get('/api/articles?board=Test&start=1&end=2&stream=1')
+            article_lines = [json.loads(line) for line in articles.get_data(as_text=True).splitlines()]
+            listing = client.get('/api/articles/list?board=Test&start=1&end=1&stream=1')
+            list_lines = [json.loads(line) for line in listing.get_data(as_text=True).splitlines()]
+        self.assertEqual(articles.mimetype, 'application/x-ndjson')
+        lines = article_lines
+        self.assertEqual([line.get('article_id') for line in lines[:-1]], ['M.1500000001.A.001', 'M.1500000003.A.003'])
+        self.assertEqual(lines[-1], {'summary': {
+            'count': 2, 'errors': ['處理文章 M.1500000002.A.002 時出錯: broken article'],
+            'request_info': {'board': 'Test', 'start': 1, 'end': 2}}})
+        # 串流途中的例外記錄在最後一行的摘要中
+        lines = list_lines
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1]['summary']['count'], 1)
+        self.assertEqual(lines[1]['summary']['errors'], ['串流爬取時發生異常: connection reset'])
+        self.assertEqual(lines[1]['summary']['request_info']['timeout'], 30)
+
+
+    def test_process_pipeline_keeps_order_and_bounds_window(self):
+        def fake_get(url, **kwargs):
+            if 'index' in url:
+                return fake_response(INDEX_HTML)
+            if url.endswith('002.html'):
+                return fake_response('', 404)
+            return fake_response(ARTICLE_HTML)
+
+        with mock.patch('requests.Session.get', side_effect=fake_get):
+            result = crawler(as_lib=True).parse_articles(1, 2, 'Test', workers=2, processes=2)
+        articles = result['articles']
+        self.assertEqual([a.get('article_id') for a in articles],
+                         ['M.1500000001.A.001', None, 'M.1500000003.A.003'] * 2)
+        self.assertEqual(articles[1], {'error': 'invalid url', 'status_code': 404})
+        self.assertEqual(articles[0], crawler.parse_html(ARTICLE_HTML, 'https://www.ptt.cc/bbs/Test/M.1500000001.A.001.html',
+                                                         'M.1500000001.A.001', 'Test'))
+
+        # 送出的文章數不超過 window，上游產生器只會多讀取等待送出的下一筆
+        consumed = []
+        def rows():
+            for i in range(10):
+                consumed.append(i)
+                yield {'url': f'https://www.ptt.cc/bbs/Test/M.{i}.A.001.html', 'article_id': f'M.{i}.A.001', 'title': ''}
+
+        c = crawler(as_lib=True)
+        with ThreadPoolExecutor(2) as executor, ProcessPoolExecutor(1) as pool, \
+                mock.patch('requests.Session.get', return_value=fake_response(ARTICLE_HTML)):
+            articles = c.pipeline_articles(rows(), 'Test', 3, executor, pool, window=3)
+            first = next(articles)
+            self.assertEqual(first['article_id'], 'M.0.A.001')
+            self.assertEqual(len(consumed), 4)
+            self.assertEqual([a['article_id'] for a in articles], [f'M.{i}.A.001' for i in range(1, 10)])
+
+    @mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML))
+    def test_jsonl_output_streams_articles(self, _get):
+        directory = tempfile.mkdtemp()
+        output = os.path.join(directory, 'out.jsonl')
+        try:
+            with mock.patch.object(crawler, 'parse_record', side_effect=self.fake_parse):
+                result = crawler(['-b', 'Test', '-i', '1', '1', '--jsonl', output], as_lib=True).run()
+            with codecs.open(output, 'r', encoding='utf-8') as f:
+                lines = [json.loads(line) for line in f]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(result['count'], 2)
+        self.assertEqual([a['article_id'] for a in lines], ['M.1500000001.A.001', 'M.1500000003.A.003'])
+
+    def test_resume_skips_finished_pages_and_articles(self):
+        def fake_get(url, **kwargs):
+            # 第 2 頁的文章 ID 與第 1 頁不同
+            return fake_response(INDEX_HTML.replace('.A.00', '.A.20') if 'index2' in url else INDEX_HTML)
+
+        calls = []
+        def interrupted_parse(link, article_id, board, timeout=3):
+            calls.append(article_id)
+            if article_id.endswith('201'):
+                raise KeyboardInterrupt()
+            return self.fake_parse(link, article_id, board, timeout)
+
+        def fixed_parse(link, article_id, board, timeout=3):
+            calls.append(article_id)
+            return Article.from_dict({'article_id': article_id, 'board': board})
+
+        directory = tempfile.mkdtemp()
+        output = os.path.join(directory, 'out.jsonl')
+        cmdline = ['-b', 'Test', '-i', '1', '2', '--jsonl', output]
+        try:
+            crawler._last_pages.clear()
+            with mock.patch('requests.Session.get', side_effect=fake_get) as get:
+                with mock.patch.object(crawler, 'parse_record', side_effect=interrupted_parse):
+                    with self.assertRaises(KeyboardInterrupt):
+                        crawler(cmdline, as_lib=True).run()
+                del calls[:]
+                with mock.patch.object(crawler, 'parse_record', side_effect=fixed_parse):
+                    result = crawler(cmdline + ['--resume'], as_lib=True).run()
+                    self.assertEqual(calls, ['M.1500000002.A.002', 'M.1500000001.A.201', 'M.1500000002.A.202',
+                                             'M.1500000003.A.203'])
+                    # 全部完成後再次接續不會再下載任何頁面
+                    get.reset_mock()
+                    crawler(cmdline + ['--resume'], as_lib=True).run()
+                    self.assertEqual(get.call_count, 0)
+            with codecs.open(output, 'r', encoding='utf-8') as f:
+                ids = [json.loads(line)['article_id'] for line in f]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(result['count'], 4)
+        self.assertEqual(ids, ['M.1500000001.A.001', 'M.1500000003.A.003', 'M.1500000002.A.002',
+                               'M.1500000001.A.201', 'M.1500000002.A.202', 'M.1500000003.A.203'])
+        # 非同步引擎不經過檢查點，不能接續
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            crawler(cmdline + ['--resume', '--engine', 'async'], as_lib=True)
+
+    @mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML))
+    def test_board_bootstrap_is_cached(self, get):
+        crawler._last_pages.clear()
+        c = crawler(as_lib=True)
+        self.assertEqual(len(list(c.iter_list_articles(1, 1, 'Test'))), 4)
+        self.assertEqual(get.call_count, 2)
+        # TTL 內再次爬取只需要列表頁本身的請求
+        with mock.patch.object(crawler, 'parse_record', side_effect=self.fake_parse):
+            self.assertEqual(len(list(c.iter_articles(1, 1, 'Test'))), 2)
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(crawler.getLastPage('Test'), 2)
+        self.assertEqual(get.call_count, 3)
+
+    def test_find_page_range_by_time(self):
+        # 第 p 頁的文章時間為 p * 1000 到 p * 1000 + 900
+        probes = []
+        def page_time_range(self, board, page, timeout=10):
+            probes.append(page)
+            return (page * 1000, page * 1000 + 900)
+
+        c = crawler(as_lib=True)
+        with mock.patch.object(crawler, 'page_time_range', page_time_range), \
+                mock.patch.object(crawler, 'board_last_page', return_value=5000):
+            self.assertEqual(c.find_page_range('Test', since=2500950, until=2600500), (2501, 2600))
+            self.assertLess(len(set(probes)), 15)
+            self.assertEqual(c.find_page_range('Test', since=3000000), (3000, 5000))
+            self.assertEqual(c.find_page_range('Test', until='1500'), (1, 1))
+            self.assertIsNone(c.find_page_range('Test', since=6000000))
+        with mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML)):
+            self.assertEqual(c.page_time_range('Test', 1), (1500000001, 1500000003))
+        # 未指定時區的日期視為台灣時間
+        self.assertEqual(parsers.parse_time('2014-09-01 08:38:02'), 1409531882)
+
+    def test_article_filter_skips_before_fetch(self):
+        directory = tempfile.mkdtemp()
+        try:
+            done = os.path.join(directory, 'done.jsonl')
+            with codecs.open(done, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'article_id': 'M.1500000003.A.003'}) + '\n')
+            article_filter = ArticleFilter(since=1500000001, until='2017-07-14 10:40:02',
+                                           deny=load_article_ids(done))
+            self.assertEqual(article_filter.until, 1500000002)
+            fetched = []
+            def fake_parse(link, article_id, board, timeout=3):
+                fetched.append(article_id)
+                return Article.from_dict({'article_id': article_id, 'board': board})
+            with mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML)), \
+                    mock.patch.object(crawler, 'parse_record', side_effect=fake_parse):
+                result = crawler(as_lib=True).parse_articles(1, 1, 'Test', article_filter=article_filter)
+                rows = crawler(as_lib=True).parse_list_articles(1, 1, 'Test', article_filter=ArticleFilter(deny=['M.1500000001.A.001']))
+        finally:
+            shutil.rmtree(directory)
+        # 002 在時間範圍外、003 在排除清單中，都不會發出請求；已刪除的項目無法判斷時間也一併略過
+        self.assertEqual(fetched, ['M.1500000001.A.001'])
+        self.assertEqual([a['article_id'] for a in result['articles']], ['M.1500000001.A.001'])
+        self.assertEqual(article_filter.skipped, 3)
+        # 只有排除清單時保留已刪除文章的列表項目
+        self.assertEqual([row['article_id'] for row in rows['articles']], [None, 'M.1500000002.A.002', 'M.1500000003.A.003'])
+
+    def test_async_engine_against_local_server(self):
+        import asyncio
+        page2 = INDEX_HTML.split('<div class="r-ent">')[1].replace('001', '004')
+        requests_seen = []
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_seen.append((self.path, self.headers.get('Cookie', '')))
+                if 'over18=1' not in self.headers.get('Cookie', ''):
+                    body, status = '您必須年滿十八歲才能瀏覽此網頁', 200
+                elif self.path.endswith('/index.html') or self.path.endswith('/index1.html'):
+                    body, status = INDEX_HTML, 200
+                elif self.path.endswith('/index2.html'):
+                    body, status = '<div class="r-ent">' + page2, 200
+                elif '002' in self.path:
+                    body, status = 'not found', 404
+                else:
+                    if '001' in self.path:
+                        # 第一篇最慢完成，輸出仍依列表頁順序
+                        time.sleep(0.2)
+                    body, status = ARTICLE_HTML, 200
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        crawler._last_pages.clear()
+        try:
+            with mock.patch.object(crawler, 'PTT_URL', f'http://127.0.0.1:{server.server_port}'), \
+                    mock.patch('PttWebCrawler.async_engine.rate_limiter', RateLimiter(rate=100, max_rate=100, capacity=20)):
+                c = crawler(as_lib=True, engine='async')
+                result = c.parse_articles(1, -1, 'Test')
+                listing = c.parse_list_articles(2, 2, 'Test')
+                missing = c.parse_article('M.1500000002.A.002', 'Test')
+
+                async def run_async():
+                    try:
+                        return await c.aparse_articles(2, 2, 'Test')
+                    finally:
+                        await c.aclose()
+                awaited = asyncio.run(run_async())
+        finally:
+            server.shutdown()
+            server.server_close()
+            crawler._last_pages.clear()
+        self.assertEqual([a.get('article_id') for a in result['articles']],
+                         ['M.1500000001.A.001', None, 'M.1500000003.A.003', 'M.1500000004.A.004'])
+        self.assertEqual(result['articles'][1], {'error': 'invalid url', 'status_code': 404})
+        self.assertEqual(result['articles'][0]['message_count']['all'], 3)
+        self.assertEqual([row['article_id'] for row in listing['articles']], ['M.1500000004.A.004'])
+        self.assertEqual(missing, {'error': 'invalid url', 'status_code': 404})
+        self.assertEqual([a['article_id'] for a in awaited['articles']], ['M.1500000004.A.004'])
+        # 所有請求都帶有 over18 cookie，不會拿到年齡驗證頁面
+        self.assertTrue(all('over18=1' in cookie for _, cookie in requests_seen))
+
+    def test_async_engine_applies_article_filter(self):
+        requested = []
+        async def fake_fetch(self, url):
+            requested.append(url)
+            return 200, INDEX_HTML if 'index' in url else ARTICLE_HTML
+        crawler._last_pages.clear()
+        c = crawler(as_lib=True, engine='async')
+        with mock.patch('PttWebCrawler.async_engine.AsyncCrawlEngine.fetch', fake_fetch):
+            result = c.parse_articles(1, 1, 'Test', article_filter=ArticleFilter(until=1500000002))
+            rows = c.parse_list_articles(1, 1, 'Test', article_filter=ArticleFilter(deny=['M.1500000002.A.002']))
+        self.assertEqual([a['article_id'] for a in result['articles']], ['M.1500000001.A.001'])
+        self.assertEqual([url for url in requested if 'M.' in url], ['https://www.ptt.cc/bbs/Test/M.1500000001.A.001.html'])
+        self.assertEqual([row['article_id'] for row in rows['articles']], ['M.1500000001.A.001', None, 'M.1500000003.A.003'])
+
+    def test_priority_schedule_fetches_hot_articles_first(self):
+        fetched = []
+        def fake_parse(link, article_id, board, timeout=3):
+            fetched.append(article_id)
+            return Article.from_dict({'article_id': article_id, 'board': board})
+        c = crawler(as_lib=True)
+        with mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML)), \
+                mock.patch.object(crawler, 'parse_record', side_effect=fake_parse):
+            budget = Budget(max_articles=2)
+            hot = c.parse_articles(1, 1, 'Test', workers=2, priority='push', budget=budget)
+            recent = c.parse_articles(1, 1, 'Test', priority='recent')
+            custom = c.parse_articles(1, 1, 'Test', priority=lambda row: -row['push_count'],
+                                      budget=Budget(max_seconds=0))
+        # 爆 (100) 先於 12 推，預算用完時 X3 的文章尚未抓取
+        self.assertEqual([a['article_id'] for a in hot['articles']], ['M.1500000002.A.002', 'M.1500000001.A.001'])
+        self.assertEqual((budget.spent, budget.left), (2, 1))
+        self.assertEqual([a['article_id'] for a in recent['articles']],
+                         ['M.1500000003.A.003', 'M.1500000002.A.002', 'M.1500000001.A.001'])
+        # 時間預算為 0 時讀完列表頁即停止，不發出文章請求
+        self.assertEqual(custom['articles'], [])
+        self.assertEqual(len(fetched), 5)
+        with self.assertRaises(SystemExit):
+            crawler(['-b', 'Test', '-i', '1', '1', '--max-articles', '10'], as_lib=True)
+
+    def test_search_articles_fetches_pages_and_filters(self):
+        search_html = INDEX_HTML + '<a class="btn wide" href="/bbs/Test/search?page=3&amp;q=%E5%95%8F%E9%A1%8C">最舊</a>'
+        urls = []
+        def fake_get(self, url, **kwargs):
+            urls.append(url)
+            return fake_response(search_html)
+        with mock.patch('requests.Session.get', fake_get):
+            result = crawler(as_lib=True).search_articles(u'問題', 'Test', max_pages=2, recommend=10)
+        self.assertEqual(sorted(urls), ['https://www.ptt.cc/bbs/Test/search?page=%d&q=%%E5%%95%%8F%%E9%%A1%%8C+recommend%%3A10' % i
+                                        for i in (1, 2)])
+        self.assertEqual(result['pages'], 2)
+        self.assertEqual([a['article_id'] for a in result['articles']], ['M.1500000001.A.001', 'M.1500000002.A.002'] * 2)
+
+    def test_search_index_keywords_and_phrases(self):
+        self.assertEqual(tokenize(u'台北市 iPhone'), [u'台', u'北', u'市', u'台北', u'北市', 'iph', 'pho', 'hon', 'one'])
+        directory = tempfile.mkdtemp()
+        try:
+            index = SearchIndex(os.path.join(directory, 'index.sqlite'))
+            articles = [
+                {'board': 'Test', 'article_id': 'M.1.A.1', 'article_title': u'[新聞] 颱風停班停課', 'author': 'alice (A)',
+                 'content': u'明天台北市停班', 'messages': [], 'message_count': {'count': 20}},
+                {'board': 'Test', 'article_id': 'M.2.A.2', 'article_title': u'[問卦] 停課', 'author': 'bob (B)',
+                 'content': u'颱風天在家', 'messages': [{'push_content': u'台北停班'}], 'message_count': {'count': 3}},
+            ]
+            self.assertEqual(index.add_articles(articles + [{'error': 'invalid url'}]), 2)
+            ids = lambda results: sorted(a['article_id'] for a in results)
+            self.assertEqual(ids(index.search(u'颱風 停班')), ['M.1.A.1', 'M.2.A.2'])
+            self.assertEqual(ids(index.search(u'"停班停課"')), ['M.1.A.1'])
+            self.assertEqual(ids(index.search(u'台北市')), ['M.1.A.1'])
+            self.assertEqual(ids(index.search(u'颱風', author='bob')), ['M.2.A.2'])
+            self.assertEqual(ids(index.search(u'颱風', recommend=10)), ['M.1.A.1'])
+            # 與 PTT 搜尋一樣是子字串比對，單一中文字與英文單字的片段也由索引詞找出候選文章
+            index.add({'board': 'Test', 'article_id': 'M.3.A.3', 'article_title': u'[閒聊] iPhone15 開箱',
+                       'content': u'手機', 'messages': []})
+            statements = []
+            index.conn.set_trace_callback(statements.append)
+            self.assertEqual(ids(index.search(u'iphone')), ['M.3.A.3'])
+            self.assertIn('FROM postings', statements[-1])
+            del statements[:]
+            self.assertEqual(ids(index.search(u'颱')), ['M.1.A.1', 'M.2.A.2'])
+            self.assertIn('FROM postings', statements[-1])
+            index.conn.set_trace_callback(None)
+            self.assertEqual(ids(index.search(u'停 颱風')), ['M.1.A.1', 'M.2.A.2'])
+            self.assertEqual(ids(index.search(u'phone1 機')), ['M.3.A.3'])
+            self.assertEqual(ids(index.search(u'"iphone15 開箱"')), ['M.3.A.3'])
+            self.assertEqual(ids(index.search(u'iphone16')), [])
+            self.assertEqual(ids(index.search(u'"apple watch"')), [])
+
+            # 重複加入同一篇文章時更新索引內容
+            index.add(dict(articles[1], content=u'晴天'))
+            self.assertEqual(ids(index.search(u'颱風')), ['M.1.A.1'])
+            self.assertEqual(len(index), 3)
+            index.close()
+        finally:
+            shutil.rmtree(directory)
+
+    @mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML))
+    def test_db_output_upserts_articles_and_messages(self, _get):
+        def fake_parse(link, article_id, board, timeout=3):
+            return crawler.parse_html_record(ARTICLE_HTML, link, article_id, board)
+        directory = tempfile.mkdtemp()
+        db = os.path.join(directory, 'ptt.sqlite')
+        try:
+            with mock.patch.object(crawler, 'parse_record', side_effect=fake_parse):
+                result = crawler(['-b', 'Test', '-i', '1', '1', '--db', db], as_lib=True).run()
+            # 之後只爬列表資訊時更新推文數，但保留已寫入的內文與推文
+            crawler(['-b', 'Test', '-i', '1', '1', '-l', '--db', db], as_lib=True).run()
+            with ArticleStore(db) as store:
+                article = store.get('Test', 'M.1500000001.A.001')
+                found = store.find(board='Test', push_userid='carol', since=1500000002)
+                by_author = store.find(author='alice')
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(result['count'], 3)
+        self.assertTrue(article['content'].startswith(u'第一行內容 hello world'))
+        self.assertEqual([m['push_userid'] for m in article['messages']], ['bob', 'carol', 'dave'])
+        self.assertEqual(article['message_count']['count'], 12)
+        self.assertEqual([a['article_id'] for a in found], ['M.1500000003.A.003', 'M.1500000002.A.002'])
+        self.assertEqual(len(by_author), 3)
+
+    def test_refresh_fetches_changed_articles_and_appends_messages(self):
+        link = 'https://www.ptt.cc/bbs/Test/M.1500000001.A.001.html'
+        requested = []
+        def fake_get(url, **kwargs):
+            requested.append(url)
+            return fake_response(ARTICLE_HTML if url == link else INDEX_HTML)
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'ptt.sqlite')
+        try:
+            with ArticleStore(path) as store:
+                # 001 先前只保存了前兩則推文，內文之後被修改也不應覆寫；003 顯示 X3，推文數沒有變化
+                old = crawler.parse_html(ARTICLE_HTML, link, 'M.1500000001.A.001', 'Test')
+                old['messages'] = old['messages'][:2]
+                old['content'] = 'old content'
+                unchanged = {'article_id': 'M.1500000003.A.003', 'board': 'Test', 'content': '',
+                             'message_count': {'count': -35}, 'messages': []}
+                store.upsert([old, unchanged])
+            crawler._last_pages.clear()
+            with mock.patch('requests.Session.get', side_effect=fake_get):
+                result = crawler(['-b', 'Test', '-i', '1', '1', '--db', path, '--refresh'], as_lib=True).run()
+            with ArticleStore(path) as store:
+                refreshed = store.get('Test', 'M.1500000001.A.001')
+                # 已保存的推文與新資料對不上時改為覆寫整篇文章
+                edited = dict(old, messages=[{'push_tag': 'x'}] * 4)
+                self.assertIsNone(store.merge_messages(edited))
+                self.assertEqual(len(store.get('Test', 'M.1500000001.A.001')['messages']), 4)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(result['refresh'], {'checked': 3, 'not_stored': 1, 'changed': 1, 'new_messages': 1, 'rewritten': 0})
+        self.assertEqual(requested.count(link), 1)
+        self.assertNotIn('https://www.ptt.cc/bbs/Test/M.1500000003.A.003.html', requested)
+        self.assertEqual(refreshed['content'], 'old content')
+        self.assertEqual([m['push_userid'] for m in refreshed['messages']], ['bob', 'carol', 'dave'])
+        self.assertEqual(refreshed['message_count']['all'], 3)
+
+    @unittest.skipIf(export.pa is None, 'pyarrow is not installed')
+    def test_columnar_export_flattens_messages(self):
+        link = 'https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html'
+        article = crawler.parse_html(ARTICLE_HTML, link, 'M.1409529482.A.9D3', 'Test')
+        directory = tempfile.mkdtemp()
+        try:
+            source = os.path.join(directory, 'Test.json')
+            with codecs.open(source, 'w', encoding='utf-8') as f:
+                json.dump({'articles': [article, {'error': 'invalid url'}]}, f, ensure_ascii=False)
+            export.main([os.path.join(directory, 'out'), source])
+            articles = export.pq.read_table(os.path.join(directory, 'out', 'articles.parquet'))
+            messages = export.pq.read_table(os.path.join(directory, 'out', 'messages.parquet'))
+            # 列表資訊沒有 board 欄位，使用呼叫端傳入的板名
+            with export.ColumnarExporter(os.path.join(directory, 'rows')) as exporter:
+                exporter.write([{'article_id': 'M.1500000001.A.001', 'title': 'a', 'push_count': 12}], 'Test')
+            rows = export.pq.read_table(os.path.join(directory, 'rows', 'articles.parquet'))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(articles.num_rows, 1)
+        self.assertEqual(articles.column('timestamp').to_pylist(), [1409529482])
+        self.assertEqual(messages.column('push_userid').to_pylist(), ['bob', 'carol', 'dave'])
+        self.assertEqual(messages.column('article_id').to_pylist(), ['M.1409529482.A.9D3'] * 3)
+        self.assertEqual(str(messages.schema.field('push_tag').type), 'dictionary<values=string, indices=int32, ordered=0>')
+        self.assertEqual((rows.column('board').to_pylist(), rows.column('push_count').to_pylist()), (['Test'], [12]))
+
+    def test_token_bucket_aimd(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2.0, min_rate=0.5, max_rate=3.0, capacity=1, increase=0.5, clock=lambda: now[0])
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        bucket.on_success()
+        bucket.on_success()
+        bucket.on_success()
+        self.assertEqual(bucket.rate, 3.0)
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 1.5)
+        bucket.on_throttle()
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 0.5)
+
+    def test_pool_growth_keeps_session_state_and_in_flight_session(self):
+        manager = SessionManager(pool_size=2)
+        first = manager.get()
+        first.cookies.set('theme', 'dark', domain='www.ptt.cc')
+        first.headers['Referer'] = 'https://www.ptt.cc/bbs/index.html'
+        with mock.patch.object(first, 'close') as close:
+            manager.ensure_pool_size(1)
+            self.assertIs(manager.get(), first)
+            manager.ensure_pool_size(8)
+        second = manager.get()
+        # 其他執行緒可能仍在使用舊的 Session，不可關閉
+        close.assert_not_called()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.get_adapter('https://www.ptt.cc/')._pool_maxsize, 8)
+        self.assertEqual(second.cookies.get('over18', domain='www.ptt.cc'), '1')
+        self.assertEqual(second.cookies.get('theme', domain='www.ptt.cc'), 'dark')
+        self.assertEqual(second.headers['Referer'], 'https://www.ptt.cc/bbs/index.html')
+        self.assertIn('Chrome', second.headers['User-Agent'])
+        # 未指定 cache 時維持原本的快取，cache=None 停用快取
+        cache = mock.Mock()
+        manager.configure(cache=cache)
+        manager.configure(pool_size=4)
+        self.assertIs(manager.cache, cache)
+        manager.configure(cache=None)
+        self.assertIsNone(manager.cache)
+        manager.reset()
+        first.close()
+
+    def test_throttled_response_reaches_limiter(self):
+        hits = []
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}/bbs/Test/index.html'
+        limiter = RateLimiter(rate=2.0)
+        manager = SessionManager(limiter=limiter)
+        try:
+            resp = manager.get().get(url, timeout=5)
+        finally:
+            manager.reset()
+            server.shutdown()
+            server.server_close()
+        # 503 不由 urllib3 重試，直接交給限速器減速
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(limiter.current_rate(url), 1.0)
+
+
+    def test_response_cache(self):
+        self.assertEqual(url_class('https://www.ptt.cc/bbs/Test/index12.html'), 'index')
+        self.assertEqual(url_class('https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html'), 'article')
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ResponseCache(directory, max_bytes=250)
+            entry = cache.store('https://www.ptt.cc/bbs/Test/index1.html', b'x' * 100, {'ETag': '"v1"'})
+            self.assertEqual(entry.conditional_headers(), {'If-None-Match': '"v1"'})
+            self.assertTrue(cache.is_fresh(cache.get('https://www.ptt.cc/bbs/Test/index1.html')))
+            cache.store('https://www.ptt.cc/bbs/Test/index2.html', b'y' * 100)
+            cache.store('https://www.ptt.cc/bbs/Test/index3.html', b'z' * 100)
+            self.assertLessEqual(cache.stats()['bytes'], 250)
+            self.assertIsNotNone(cache.get('https://www.ptt.cc/bbs/Test/index3.html'))
+
+            # 增量同步與推文更新期間，TTL 內的文章頁也必須重新驗證
+            article_url = 'https://www.ptt.cc/bbs/Test/M.1409529482.A.9D3.html'
+            cache.store(article_url, b'a' * 10)
+            self.assertTrue(cache.is_fresh(cache.get(article_url)))
+            with mock.patch('PttWebCrawler.crawler.session_manager.cache', cache):
+                with crawler.revalidating_cache():
+                    self.assertFalse(cache.is_fresh(cache.get(article_url)))
+            self.assertTrue(cache.is_fresh(cache.get(article_url)))
+
+            # 讀取不會看到寫到一半的內容，也不會讓 ETag 搭配另一次寫入的內容
+            cache = ResponseCache(directory)
+            cache.store(article_url, b'a' * 50000, {'ETag': 'a'})
+            stop = threading.Event()
+            def writer():
+                bodies = [b'a' * 50000, b'b' * 50000]
+                i = 0
+                while not stop.is_set():
+                    body = bodies[i % 2]
+                    cache.store(article_url, body, {'ETag': body[:1].decode()})
+                    i += 1
+            thread = threading.Thread(target=writer)
+            thread.start()
+            try:
+                for _ in range(200):
+                    entry = cache.get(article_url)
+                    if entry is None:
+                        continue
+                    self.assertEqual(len(entry.body), 50000)
+                    self.assertEqual(entry.body.count(entry.etag.encode()), 50000)
+            finally:
+                stop.set()
+                thread.join()
+            self.assertEqual(len(cache.get(article_url).body), 50000)
+            self.assertFalse([name for name in os.listdir(directory) if name.endswith('.tmp')])
+        finally:
+            shutil.rmtree(directory)
+
+
+    def test_sync_board_only_fetches_new_articles(self):
+        pages = {1: [self.index_row('M.1500000001.A.001'), self.index_row('M.1500000002.A.002')]}
+        fetch_rows = lambda board, index, timeout=10: (pages[index], '')
+        fetch_article = lambda url, article_id, board, timeout: {'article_id': article_id}
+        directory = tempfile.mkdtemp()
+        state_file = os.path.join(directory, 'state.json')
+        c = crawler(as_lib=True)
+        try:
+            with mock.patch.object(c, 'fetch_index_rows', side_effect=fetch_rows), \
+                    mock.patch.object(c, '_fetch_article', side_effect=fetch_article), \
+                    mock.patch.object(crawler, 'board_last_page', side_effect=lambda board, timeout=10: max(pages)):
+                first = c.sync_board('Test', state_file)
+                pages[1].append(self.index_row('M.1500000003.A.003'))
+                pages[2] = [self.index_row('M.1500000004.A.004')]
+                second = c.sync_board('Test', state_file)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(first['articles']), 2)
+        self.assertEqual([a['article_id'] for a in second['articles']], ['M.1500000003.A.003', 'M.1500000004.A.004'])
+        self.assertEqual(second['sync']['last_page'], 2)
+        self.assertEqual(second['sync']['last_article_id'], 'M.1500000004.A.004')
+
+    def test_sync_board_skips_deleted_articles(self):
+        pages = {1: [self.index_row('M.1500000001.A.001'), self.index_row('M.1500000002.A.002')],
+                 2: [self.index_row('M.1500000003.A.003')]}
+        failures = {'M.1500000001.A.001': {'error': 'invalid url', 'status_code': 404}}
+        def fetch_article(url, article_id, board, timeout):
+            return failures.get(article_id) or {'article_id': article_id}
+        directory = tempfile.mkdtemp()
+        state_file = os.path.join(directory, 'state.json')
+        c = crawler(as_lib=True)
+        try:
+            with mock.patch.object(c, 'fetch_index_rows', side_effect=lambda board, index, timeout=10: (pages[index], '')), \
+                    mock.patch.object(c, '_fetch_article', side_effect=fetch_article), \
+                    mock.patch.object(crawler, 'board_last_page', side_effect=lambda board, timeout=10: max(pages)):
+                # 已刪除的文章 (404) 不會讓同步停在第 1 頁
+                first = c.sync_board('Test', state_file, workers=2, initial_pages=2)
+                # 暫時的錯誤 (503) 則停在失敗的文章之前，下次重抓
+                pages[2].append(self.index_row('M.1500000004.A.004'))
+                pages[2].append(self.index_row('M.1500000005.A.005'))
+                failures['M.1500000004.A.004'] = {'error': 'invalid url', 'status_code': 503}
+                second = c.sync_board('Test', state_file)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(first['sync']['last_page'], 2)
+        self.assertEqual(first['sync']['last_article_id'], 'M.1500000003.A.003')
+        self.assertEqual(second['sync']['last_article_id'], 'M.1500000003.A.003')
+
+    def test_sync_board_saves_state_after_outputs(self):
+        directory = tempfile.mkdtemp()
+        state_file = os.path.join(directory, 'state.json')
+        args = ['--sync', 'Test', '--sync-state', state_file, '--jsonl', os.path.join(directory, 'out.jsonl')]
+        fetch_article = lambda url, article_id, board, timeout: {'article_id': article_id}
+        try:
+            # 無法取得最後頁碼時不抓取也不寫入進度，下次同步不會從第 1 頁重抓整個看板
+            c = crawler(args, as_lib=True)
+            with mock.patch.object(crawler, 'board_last_page', side_effect=Exception('503')):
+                result = c.run()
+            self.assertEqual(len(result['errors']), 1)
+            self.assertFalse(os.path.exists(state_file))
+            # 輸出寫入失敗時同步位置不前進
+            with mock.patch.object(crawler, 'board_last_page', return_value=2), \
+                    mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML)), \
+                    mock.patch.object(c, '_fetch_article', side_effect=fetch_article):
+                with mock.patch.object(c, 'write_outputs', side_effect=OSError('disk full')):
+                    self.assertRaises(OSError, c.run)
+                self.assertFalse(os.path.exists(state_file))
+                result = c.run()
+            self.assertEqual(result['count'], 3)
+            self.assertEqual(SyncState(state_file).get('Test')['last_page'], 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_job_manager_persists_progress_and_resumes(self):
+        pages = {1: [self.index_row('M.1500000001.A.001')],
+                 2: [self.index_row('M.1500000002.A.002'), self.index_row('M.1500000003.A.003')]}
+        fetch_rows = lambda self, board, index, timeout=10: (pages[index], '')
+        fetch_article = lambda self, url, article_id, board, timeout: {'article_id': article_id}
+        directory = tempfile.mkdtemp()
+        try:
+            store = JobStore(os.path.join(directory, 'jobs.sqlite'))
+            with mock.patch.object(crawler, 'fetch_index_rows', fetch_rows), \
+                    mock.patch.object(crawler, '_fetch_article', fetch_article), \
+                    mock.patch.object(crawler, 'board_last_page', side_effect=lambda board, timeout=10: max(pages)):
+                manager = JobManager(store, workers=1)
+                job_id = manager.submit('Test', 1, -1)
+                manager.shutdown()
+                # 模擬中斷的工作：已完成第 1 頁，之後行程停止
+                stale_id = store.create('Test', 1, 2, 'list', owner='dead-host')
+                store.add_results(stale_id, pages[1], 1, [])
+                store.update(stale_id, status='running')
+                # 另一個存活的行程中仍在排隊的工作，心跳持續更新
+                queued_id = store.create('Test', 1, 2, 'list', owner='live-host')
+                later = store.get(stale_id)['updated_at'] + 3600
+                with mock.patch('time.time', return_value=later):
+                    store.heartbeat('live-host')
+                with mock.patch('time.time', return_value=later + 60):
+                    claimed = store.claim_stale(manager.owner)
+                # 原本的行程恢復後無法再寫入已被接手的工作
+                self.assertFalse(store.add_results(stale_id, pages[2], 2, [], owner='dead-host'))
+                for job in claimed:
+                    manager._run(job)
+            job = store.get(job_id)
+            resumed = store.get(stale_id)
+            self.assertEqual(claimed, [stale_id])
+            self.assertEqual((job['status'], job['pages_done'], job['pages_total'], job['article_count']), ('finished', 2, 2, 3))
+            self.assertEqual([a['article_id'] for a in store.results(job_id, 1, 2)], ['M.1500000002.A.002', 'M.1500000003.A.003'])
+            self.assertEqual((resumed['status'], resumed['article_count'], resumed['owner']), ('finished', 3, manager.owner))
+            self.assertEqual(store.get(queued_id)['status'], 'queued')
+
+            # 無法取得最後頁碼的工作標記為失敗並記錄錯誤
+            with mock.patch.object(crawler, 'board_last_page', side_effect=Exception('503')):
+                failed_id = store.create('Test', 1, -1, 'list', owner=manager.owner)
+                manager._run(failed_id)
+            failed = store.get(failed_id)
+            self.assertEqual((failed['status'], failed['error_count']), ('failed', 1))
+            self.assertIn('503', failed['errors'][0])
+            # 錯誤訊息只保留最近的 MAX_ERRORS 則
+            for i in range(3):
+                store.add_errors(failed_id, ['e%d' % j for j in range(60)])
+            failed = store.get(failed_id)
+            self.assertEqual((failed['error_count'], len(failed['errors'])), (181, 100))
+            self.assertEqual(failed['errors'][-1], 'e59')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shard_leases_cover_range_once(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'shards.sqlite')
+            store = ShardStore(path)
+            self.assertEqual(store.plan('Test', 1, 2, 1), 2)
+            # 重疊的範圍只補上尚未涵蓋的頁數
+            self.assertEqual(store.plan('Test', 2, 3, 1), 1)
+            first = store.claim('node-a', 60)
+            second = store.claim('node-b', 60)
+            self.assertEqual([(s['start_page'], s['end_page']) for s in (first, second)], [(1, 1), (2, 2)])
+            # node-a 停止回報，租約過期後分片由 node-c 接手
+            with mock.patch('time.time', return_value=time.time() + 120):
+                self.assertTrue(store.heartbeat(second['id'], 'node-b', 600))
+                taken = store.claim('node-c', 60)
+            self.assertEqual((taken['id'], taken['attempts']), (first['id'], 2))
+            self.assertFalse(store.heartbeat(first['id'], 'node-a'))
+            self.assertFalse(store.complete(first['id'], 'node-a'))
+            self.assertTrue(store.complete(taken['id'], 'node-c', 2))
+            self.assertTrue(store.release(second['id'], 'node-b', 'timeout'))
+
+            # 工作者處理剩下的分片，每個分片寫入各自的 JSONL 檔
+            crawler._last_pages.clear()
+            output = os.path.join(directory, 'out')
+            with mock.patch('requests.Session.get', return_value=fake_response(INDEX_HTML)):
+                result = crawler(['--shard-worker', path, '-l', '--jsonl', output], as_lib=True).run()
+            self.assertEqual((result['shards'], result['articles']), (2, 4))
+            self.assertEqual(sorted(os.listdir(output)), ['Test-2-2.jsonl', 'Test-3-3.jsonl'])
+            self.assertEqual(result['progress'], {'done': {'shards': 3, 'pages': 3}, 'articles': 6})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_result_cache_ttl_and_lru(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = ResultCache(os.path.join(directory, 'results.sqlite'), max_bytes=300, ttls={'list': 30})
+            cache.set('list', 'Test/1-1', {'articles': ['a' * 50]})
+            self.assertEqual(cache.get('list', 'Test/1-1')[0], {'articles': ['a' * 50]})
+            self.assertIsNone(cache.get('article', 'Test/1-1'))
+            # 不同端點使用相同的鍵時各自保存
+            cache.set('article', 'Test/1-1', {'content': 'b'})
+            self.assertEqual(cache.get('list', 'Test/1-1')[0], {'articles': ['a' * 50]})
+            self.assertEqual(cache.get('article', 'Test/1-1')[0], {'content': 'b'})
+            cache.clear()
+            cache.set('list', 'Test/1-1', {'articles': ['a' * 50]})
+            expired_at = time.time() + 30
+            with mock.patch('time.time', return_value=expired_at):
+                self.assertIsNone(cache.get('list', 'Test/1-1'))
+
+            # 超過容量上限時先刪除最久未使用的項目
+            cache.set('article', 'Test/A', {'content': 'x' * 80})
+            cache.set('article', 'Test/B', {'content': 'y' * 80})
+            cache.get('list', 'Test/1-1')
+            cache.set('article', 'Test/C', {'content': 'z' * 80})
+            self.assertIsNone(cache.get('article', 'Test/A'))
+            self.assertIsNotNone(cache.get('article', 'Test/C'))
+            self.assertIsNotNone(cache.get('list', 'Test/1-1'))
+        finally:
+            shutil.rmtree(directory)
+
+
 if __name__ == '__main__':
     unittest.main()